@@ -1,4 +1,12 @@
-from flask import Flask
+import os
+import glob
+import time
+
+from flask import Flask, Response
+
+import metrics as snapshots
+from vars import METRICS_FILE, METRICS_INTERVAL
+
 app = Flask(__name__)
 
 @app.route('/')
@@ -6,5 +14,30 @@ def hello_world():
     return 'Tech VJ'
 
 
+@app.route('/metrics')
+def metrics():
+    # The bot and every worker.py run in their own processes and write their
+    # snapshots periodically; a worker's snapshot that stopped being
+    # rewritten belongs to a worker that is gone.
+    paths = [METRICS_FILE]
+    stale = time.time() - 4 * METRICS_INTERVAL
+    for path in glob.glob(snapshots.snapshot_path(METRICS_FILE, "*")):
+        try:
+            if os.path.getmtime(path) >= stale:
+                paths.append(path)
+        except OSError:
+            pass
+    texts = []
+    for path in paths:
+        try:
+            with open(path) as f:
+                texts.append(f.read())
+        except FileNotFoundError:
+            pass
+    if not texts:
+        return Response("# no metrics exported yet\n", status=503, mimetype="text/plain")
+    return Response(snapshots.merge(texts), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     app.run()
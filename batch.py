@@ -0,0 +1,808 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           BATCH RUNNER
+===========================================================================
+Description        : The /upload batch stages (resolve, download, probe,
+                     upload, post) driven through the pipeline. Everything
+                     they talk to - the Telegram client, the journal, the
+                     scheduler - is handed in, so the same code runs under
+                     the bot and under the offline benchmark in bench.py.
+===========================================================================
+"""
+
+import os
+import time
+import shlex
+import asyncio
+import logging
+
+from telethon.errors import BadRequestError
+from telethon.tl.types import DocumentAttributeVideo, InputDocument  # For video attributes
+
+from vars import (
+    PREFETCH, DISK_BUDGET_MB, DISK_RESERVE_MB, DOWNLOAD_WORKERS, DOWNLOAD_TIMEOUT,
+    RESOLVE_AHEAD, STREAM_UPLOAD, UPLOADER, MAX_UPLOAD_MB, FASTSTART, ALBUM_SIZE,
+)
+
+import core as helper
+import logs
+import journal
+import retry
+import metrics
+import uploader
+import manifests
+import resolvers
+from pacer import Pacer
+from pipeline import DiskBudget, host_key, result_size, run_pipeline
+
+# ---------------------------------------------------------------------------
+# Finished files go through uploader.upload_file unless UPLOADER=spylib.
+# ---------------------------------------------------------------------------
+if UPLOADER == "spylib":
+    from devgagantools.spylib import upload_file as default_upload
+else:
+    default_upload = uploader.upload_file
+
+log = logging.getLogger(__name__)
+
+UPLOAD_LIMIT = MAX_UPLOAD_MB * 1024 * 1024
+
+
+def build_items(links, start_index):
+    """
+    Turn the parsed TXT lines into ordered work items.
+
+    Every item keeps its original link number so that file names and
+    captions stay stable no matter when the item is downloaded.
+    """
+    items = []
+    for index, link in enumerate(links[start_index - 1:], start=start_index):
+        link_protocol, link_body = link
+        # Reconstruct URL
+        V = link_body.replace("file/d/", "uc?export=download&id=") \
+                     .replace("www.youtube-nocookie.com/embed", "youtu.be") \
+                     .replace("?modestbranding=1", "") \
+                     .replace("/view?usp=sharing", "")
+        # Construct safe file name
+        name1 = link_protocol.replace("\t", "").replace(":", "").replace("/", "") \
+                              .replace("+", "").replace("#", "").replace("|", "") \
+                              .replace("@", "").replace("*", "").replace(".", "") \
+                              .replace("https", "").replace("http", "").strip()
+        items.append({
+            "index": index,
+            "name": name1,
+            "url": "https://" + V,
+            "file_name": f'{str(index).zfill(3)}) {name1[:60]}',
+        })
+    return items
+
+
+def is_document(url):
+    """Links fetched as plain files (PDFs, Drive) rather than as videos."""
+    return "drive" in url or ".pdf" in url
+
+
+def url_cache_key(batch, item):
+    """
+    Media cache key for a link. A video is cached per requested resolution,
+    so a lecture first posted at 360p isn't re-sent for a 1080p batch.
+    """
+    key = "url:" + journal.normalize_url(item["url"])
+    if is_document(item["url"]):
+        return key
+    return f"{key}@{batch.get('res') or 'UN'}"
+
+
+def discard_result(batch, result):
+    """Delete a fetch result's downloaded file (and the parts it was split into)."""
+    for entry in [result] + result.get("parts", []):
+        path = entry.get("path")
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def log_done(message, stage, result, start):
+    """Structured log record for a link that got through `stage`."""
+    logs.event(log, message, stage=stage, kind=result.get("kind"), bytes=result.get("size") or result_size(result),
+               duration=round(time.perf_counter() - start, 3))
+
+
+def part_caption(caption, number, total):
+    """`caption` with "· Part 2/3" added to its first line."""
+    head, sep, rest = caption.partition("\n")
+    return f"{head} · Part {number}/{total}{sep}{rest}"
+
+
+async def video_result(batch, res_file, base):
+    """Probe a downloaded video for the upload stage."""
+    # Process the downloaded video file (cached for the later stages).
+    info = await helper.probe(res_file)
+    # Parts of a split video are cut with faststart anyway.
+    if FASTSTART and info.size <= UPLOAD_LIMIT:
+        try:
+            if await helper.faststart(res_file, info):
+                info = await helper.probe(res_file)
+        except Exception as e:
+            if not os.path.exists(res_file):
+                raise
+            log.warning(f"Faststart failed for {res_file}, uploading as is: {e}")
+
+    return {
+        "kind": "video",
+        "path": res_file,
+        "duration": int(info.duration),
+        "width": info.width,
+        "height": info.height,
+        "info": info,
+    }
+
+
+class AlbumQueue:
+    """
+    Buffers a batch's consecutive document links and posts them as albums
+    of up to `size`.
+
+    A document's upload starts (in its own upload slot) as soon as it is
+    added, so the next album uploads while the previous one is being
+    posted. Anything else posted to the chat has to `flush()` first, which
+    keeps the chat in batch order; documents that failed are reported right
+    after their album.
+    """
+
+    def __init__(self, runner, batch, size=ALBUM_SIZE):
+        self.runner = runner
+        self.batch = batch
+        self.size = size
+        self._group = []
+        self._posting = None
+
+    def takes(self, result):
+        return self.size > 1 and isinstance(result, dict) and result.get("kind") == "doc"
+
+    async def add(self, item, result):
+        upload = asyncio.ensure_future(self._prepare(item, result))
+        self._group.append((item, result, upload))
+        if len(self._group) >= self.size:
+            await self._wait_posting()
+            self._start()
+
+    async def flush(self):
+        """Post whatever is buffered and wait until every album is out."""
+        await self._wait_posting()
+        if self._group:
+            self._start()
+            await self._wait_posting()
+
+    def close(self):
+        """Drop buffered documents (the batch was stopped)."""
+        for _, _, upload in self._group:
+            upload.cancel()
+        self._group = []
+        if self._posting is not None:
+            self._posting.cancel()
+            self._posting = None
+
+    async def _prepare(self, item, result):
+        async with self.runner.scheduler.uploads.slot(self.batch["chat_id"]):
+            return await self.runner.prepare_link(self.batch, item, result)
+
+    def _start(self):
+        group, self._group = self._group, []
+        self._posting = asyncio.ensure_future(self._post(group))
+
+    async def _wait_posting(self):
+        if self._posting is not None:
+            await self._posting
+            self._posting = None
+
+    async def _post(self, group):
+        prepared, failed = [], []
+        for item, result, upload in group:
+            try:
+                prepared.append((item, await upload))
+            except Exception as e:
+                failed.append((item, result, e))
+        if prepared:
+            try:
+                await self.runner.send_album(self.batch, prepared)
+            except Exception as e:
+                failed += [(item, result, e) for item, result in prepared]
+        for item, result, error in sorted(failed, key=lambda x: x[0]["index"]):
+            with logs.link(self.batch["job_id"], item["index"]):
+                await self.runner.report_failure(self.batch, item, result, error)
+
+
+class BatchRunner:
+    """
+    Runs journalled batches for one Telegram client.
+
+    Args:
+        client: The Telethon client (or a stand-in with the same methods).
+        journal (journal.Journal): Batch journal.
+        media (journal.MediaCache): Dedup cache of sent media.
+        progress (progress.ProgressHub): Upload status messages.
+        scheduler (scheduler.Scheduler): Global job/download/upload slots.
+        hosts (pipeline.HostLimiter): Per-CDN download caps.
+        upload (coroutine function): `upload(client, file_obj, progress_callback=...)`
+            used for finished files; defaults to the UPLOADER setting.
+    """
+
+    def __init__(self, client, journal, media, progress, scheduler, hosts, upload=default_upload):
+        self.bot = client
+        self.journal = journal
+        self.media = media
+        self.progress = progress
+        self.scheduler = scheduler
+        self.hosts = hosts
+        self.upload = upload
+        self.pacer = Pacer()
+
+    # -- download stage -----------------------------------------------------
+    async def fetch_link(self, batch, item):
+        """
+        Download stage: resolve, download and probe a single link, recording
+        each step in the journal.
+
+        Returns:
+            dict: `kind` ("doc" or "video"), `path` and the metadata the upload
+            stage needs. Failures are raised and reported by `post_link`.
+        """
+        # A download finished before a restart is reused as-is.
+        if item.get("state") == journal.DOWNLOADED and journal.reusable(item.get("result")):
+            result = item["result"]
+            if result.get("parts"):
+                result = await self.split_video(batch, item, result)
+            return result
+
+        # Telegram already has this link: re-send it by reference.
+        cached = self.media.lookup(url_cache_key(batch, item))
+        if cached is not None:
+            metrics.CACHE.inc(cache="media", result="hit")
+            return {"kind": "cached", "ref": cached}
+
+        # Keep the resolver a few links ahead of the downloaders.
+        host = host_key(item["url"])
+        # Indexes have gaps once posted or failed links drop out on /resume.
+        positions = batch.get("positions")
+        if positions is None:
+            positions = batch["positions"] = {x["index"]: i for i, x in enumerate(batch["items"])}
+        pos = positions[item["index"]]
+        resolvers.prefetch([x["url"] for x in batch["items"][pos + 1:pos + 1 + RESOLVE_AHEAD]], batch["pw_token"])
+        with metrics.stage("resolve", host):
+            url = await retry.ENGINE.run(lambda: resolvers.resolve(item["url"], batch["pw_token"]), host,
+                                         batch.get("retries"), stage="resolve")
+        item["resolved"] = url
+        self.journal.mark(batch["job_id"], item["index"], journal.RESOLVED, resolved=url)
+
+        with metrics.stage("download", host):
+            result = await self.download_link(batch, item, url)
+        result["size"] = os.path.getsize(result["path"])
+        metrics.STAGE_BYTES.inc(result["size"], stage="download", host=host)
+
+        # Same bytes under another link: skip the upload, keep the reference.
+        result["hash"] = await asyncio.to_thread(helper.content_hash, result["path"])
+        cached = self.media.lookup("hash:" + result["hash"])
+        if cached is not None:
+            metrics.CACHE.inc(cache="media", result="hit")
+            discard_result(batch, result)
+            return {"kind": "cached", "ref": cached}
+        metrics.CACHE.inc(cache="media", result="miss")
+        if result["kind"] == "video" and result["size"] > UPLOAD_LIMIT:
+            # Bytes streamed up past the limit can't be posted; send parts instead.
+            result.pop("uploaded", None)
+            previous = item.get("result") or {}
+            if previous.get("parts") and previous.get("size") == result["size"]:
+                result["parts"] = previous["parts"]
+            result = await self.split_video(batch, item, result)
+        self._journal_download(batch, item, result)
+        return result
+
+    async def download_link(self, batch, item, url):
+        """Download a resolved link and gather what the upload stage needs."""
+        file_name = item["file_name"]
+        scratch = batch["scratch"]
+        base = os.path.join(scratch, file_name)
+        host = host_key(item["url"])
+        budget = batch.get("retries")
+
+        if is_document(url):
+            # Plain files: fetched in-process, no downloader to spawn.
+            ka = await helper.download(url, base, budget=budget)
+            return {"kind": "doc", "path": ka}
+
+        selection = await self.select_variant(batch, item, url)
+
+        if STREAM_UPLOAD and ".m3u8" in url:
+            try:
+                return await self.stream_link(batch, item, url, base, selection)
+            except Exception as e:
+                log.error(f"Streaming upload failed for {file_name}, falling back: {e}")
+                if os.path.exists(f"{base}.mp4"):
+                    os.remove(f"{base}.mp4")
+
+        # Use N_m3u8DL-RE for video downloads.
+        select = manifests.n_m3u8dl_args(selection) if selection else "--auto-select"
+        n_cmd = (
+            f'./N_m3u8DL-RE "{url}" --save-name "{file_name}" '
+            f'--save-dir "{scratch}" --tmp-dir "{scratch}" '
+            f'--del-after-done --thread-count 16 {select} --live-perform-as-vod'
+        )
+        await retry.ENGINE.run(lambda: helper.execute(n_cmd, kind="io", timeout=DOWNLOAD_TIMEOUT), host, budget)
+        res_file = f"{base}.mp4"
+
+        return await video_result(batch, res_file, base)
+
+    async def split_video(self, batch, item, result):
+        """
+        Cut an oversize video at keyframes into parts under UPLOAD_LIMIT.
+
+        The plan is journalled before anything is cut and reused as-is
+        afterwards, so a retry or restart only re-cuts the parts that are
+        missing, at the same points. The full download is deleted once
+        every part is on disk.
+        """
+        path = result["path"]
+        if not result.get("parts"):
+            offsets, total = await helper.keyframe_offsets(path)
+            plan = helper.plan_split(offsets, total, UPLOAD_LIMIT)
+            stem = os.path.splitext(path)[0]
+            result["parts"] = [
+                {"start": start, "end": end, "path": f"{stem}.part{n}.mp4"}
+                for n, (start, end) in enumerate(plan, start=1)
+            ]
+            log.info(f"Splitting {item['file_name']} ({result['size']} bytes) into {len(plan)} parts")
+            self._journal_download(batch, item, result)
+
+        for part in result["parts"]:
+            if journal.reusable(part):
+                continue
+            await helper.cut(path, part["start"], part["end"], part["path"])
+            info = await helper.probe(part["path"])
+            part.update(size=info.size, duration=int(info.duration))
+            if info.size > UPLOAD_LIMIT:
+                raise ValueError(f"Part {part['path']} is still {info.size} bytes, over the upload limit")
+        # The part sizes are what makes the parts reusable after the full
+        # download is gone: record them first.
+        self._journal_download(batch, item, result)
+        if os.path.exists(path):
+            os.remove(path)
+        return result
+
+    def _journal_download(self, batch, item, result):
+        self.journal.mark(batch["job_id"], item["index"], journal.DOWNLOADED,
+                          result={k: v for k, v in result.items() if k not in ("info", "uploaded")})
+
+    async def select_variant(self, batch, item, url):
+        """
+        Choose the manifest variant for the batch's resolution.
+
+        Returns None (let the downloader pick the best) when there is no
+        choice to make or the manifest can't be read.
+        """
+        try:
+            with metrics.stage("inspect", host_key(item["url"])):
+                selection = await manifests.inspect(url, batch.get("res"))
+        except Exception as e:
+            log.warning(f"Could not inspect the manifest of {item['file_name']}, using --auto-select: {e}")
+            return None
+        if selection is not None:
+            log.info(f"{item['file_name']}: {manifests.describe(selection)}")
+        return selection
+
+    async def stream_link(self, batch, item, url, base, selection=None):
+        """
+        Download an HLS link with ffmpeg as a fragmented MP4 and upload its
+        parts to Telegram while it is still being written.
+
+        The upload stage then only has to post the already-uploaded file, so
+        time-to-post is roughly max(download, upload) instead of their sum.
+        With a `selection` only the chosen variant (and audio) is read.
+        """
+        res_file = f"{base}.mp4"
+        inputs = f"-i {shlex.quote(url)}"
+        if selection and selection["video"]["url"]:
+            inputs = f"-i {shlex.quote(selection['video']['url'])}"
+            audio = selection["audio"]
+            if audio and audio["url"]:
+                inputs += f" -i {shlex.quote(audio['url'])} -map 0:v:0 -map 1:a:0"
+        # pipe:1 is never seeked, so the file only grows and finished parts
+        # can be uploaded straight away.
+        cmd = (
+            f'ffmpeg -v error -y {inputs} -c copy -bsf:a aac_adtstoasc '
+            f'-f mp4 -movflags frag_keyframe+empty_moov+default_base_moof pipe:1 > {shlex.quote(res_file)}'
+        )
+        writer = asyncio.ensure_future(helper.execute(cmd, kind="io", timeout=DOWNLOAD_TIMEOUT))
+        tracker = self.progress.track(batch["chat_id"], item["file_name"])
+        try:
+            async with self.scheduler.uploads.slot(batch["chat_id"]):
+                with metrics.stage("upload"):
+                    uploaded = await uploader.upload_growing(self.bot, res_file, writer,
+                                                             name=f"{item['file_name']}.mp4",
+                                                             progress_callback=tracker)
+            metrics.STAGE_BYTES.inc(os.path.getsize(res_file), stage="upload", host="")
+        finally:
+            self.progress.done(tracker)
+            if not writer.done():
+                writer.cancel()
+        result = await video_result(batch, res_file, base)
+        result["uploaded"] = uploaded
+        return result
+
+    # -- upload stage -------------------------------------------------------
+    async def send_cached(self, batch, item, result, caption):
+        """
+        Re-send a cached Telegram document by reference with a new caption.
+
+        Returns the sent message, or None when Telegram no longer accepts the
+        reference (the entry is then dropped from the cache).
+        """
+        ref = result["ref"]
+        media = InputDocument(ref["doc_id"], ref["access_hash"], ref["file_reference"])
+        try:
+            sent = await self.pacer.send(
+                batch["chat_id"], lambda: self.bot.send_file(batch["chat_id"], file=media, caption=caption))
+        except BadRequestError as e:
+            log.info(f"Cached media {ref['doc_id']} rejected ({e}), downloading again")
+            self.media.invalidate(ref["doc_id"])
+            return None
+        self.media.record(True, ref["size"])
+        self.media.store([url_cache_key(batch, item)], ref["kind"], sent.document)
+        return sent
+
+    async def upload_with_progress(self, chat_id, res_file, label):
+        """Upload a finished file, reporting to the chat's status message."""
+        tracker = self.progress.track(chat_id, label)
+        try:
+            with metrics.stage("upload"), open(res_file, "rb") as file_obj:
+                uploaded = await self.upload(self.bot, file_obj, progress_callback=tracker)
+        finally:
+            self.progress.done(tracker)
+        metrics.STAGE_BYTES.inc(os.path.getsize(res_file), stage="upload", host="")
+        return uploaded
+
+    def captions(self, batch, item):
+        """Return the (video, document) captions for a link."""
+        count = item["index"]
+        name1 = item["name"]
+        caption = batch["caption"]
+        batch_name = batch["batch_name"]
+        cc = (
+            f"**{str(count).zfill(3)}**. {name1}{caption}.mkv\n"
+            f"**Batch Name »** {batch_name}\n"
+            f"**Downloaded By :** TechMon ❤️‍🔥 @TechMonX"
+        )
+        cc1 = (
+            f"**{str(count).zfill(3)}**. {name1}{caption}.pdf\n"
+            f"**Batch Name »** {batch_name}\n"
+            f"**Downloaded By :** TechMon ❤️‍🔥 @TechMonX"
+        )
+        return cc, cc1
+
+    async def prepare_link(self, batch, item, result):
+        """
+        Upload a fetched file's bytes (and cut its thumbnail) without posting
+        anything yet, so this part may run out of batch order.
+
+        Returns the result with `uploaded` (and `thumb` for videos) filled in;
+        cached results are returned untouched.
+        """
+        if isinstance(result, Exception):
+            raise result
+        chat_id = batch["chat_id"]
+
+        if result["kind"] == "cached":
+            return result
+
+        if result["kind"] == "doc":
+            with metrics.stage("upload"):
+                result["uploaded"] = await self.bot.upload_file(result["path"])
+            metrics.STAGE_BYTES.inc(result["size"], stage="upload", host="")
+            return result
+
+        if result.get("parts"):
+            await self.prepare_parts(batch, item, result)
+            return result
+
+        res_file = result["path"]
+        # The thumbnail is cut on the ffmpeg pool while the upload runs.
+        if batch["thumb"] is None:
+            thumb_task = asyncio.ensure_future(helper.thumbnail(res_file, key=result.get("hash")))
+        else:
+            thumb_task = None
+        try:
+            if result.get("uploaded") is None:
+                result["uploaded"] = await self.upload_with_progress(chat_id, res_file, item["file_name"])
+            result["thumb"] = await thumb_task if thumb_task else batch["thumb"]
+        finally:
+            if thumb_task and not thumb_task.done():
+                thumb_task.cancel()
+        return result
+
+    async def prepare_parts(self, batch, item, result):
+        """
+        Upload the parts of a split video one after another, each with its
+        own thumbnail. Each upload already opens up to UPLOAD_CONNECTIONS
+        senders; running the parts at once would multiply that per link.
+        """
+        parts = result["parts"]
+
+        async def one(number, part):
+            if batch["thumb"] is None:
+                key = f"{result['hash']}-{number}" if result.get("hash") else None
+                thumb_task = asyncio.ensure_future(helper.thumbnail(part["path"], key=key))
+            else:
+                thumb_task = None
+            try:
+                part["uploaded"] = await self.upload_with_progress(
+                    batch["chat_id"], part["path"], f"{item['file_name']} ({number}/{len(parts)})")
+                part["thumb"] = await thumb_task if thumb_task else batch["thumb"]
+            finally:
+                if thumb_task and not thumb_task.done():
+                    thumb_task.cancel()
+
+        for number, part in enumerate(parts, start=1):
+            await one(number, part)
+
+    async def send_parts(self, batch, item, result, caption):
+        """Post a split video as numbered posts; returns the first message."""
+        first = None
+        for number, part in enumerate(result["parts"], start=1):
+            uploaded_file = part["uploaded"]
+            uploaded_file.name = f"{item['file_name']}.part{number}.mp4"
+            sent = await self.pacer.send(batch["chat_id"], lambda: self.bot.send_file(
+                batch["chat_id"],
+                file=uploaded_file,
+                caption=part_caption(caption, number, len(result["parts"])),
+                supports_streaming=True,
+                attributes=[DocumentAttributeVideo(
+                    part["duration"], w=result["width"], h=result["height"], supports_streaming=True
+                )],
+                thumb=part["thumb"],
+            ))
+            first = first or sent
+        return first
+
+    async def send_link(self, batch, item, result):
+        """Post a prepared link to the chat; must be called in batch order."""
+        bot = self.bot
+        chat_id = batch["chat_id"]
+        count = item["index"]
+        file_name = item["file_name"]
+        cc, cc1 = self.captions(batch, item)
+
+        if result["kind"] == "cached":
+            sent = await self.send_cached(batch, item, result, cc1 if result["ref"]["kind"] == "doc" else cc)
+            if sent is not None:
+                self.journal.mark(batch["job_id"], count, journal.UPLOADED, message_id=sent.id)
+                metrics.LINKS.inc(result="cached")
+                return
+            # Stale reference: fetch the link for real and post it below.
+            result = await self.fetch_link(batch, item)
+            result = await self.prepare_link(batch, item, result)
+
+        keys = [url_cache_key(batch, item), "hash:" + result["hash"] if result.get("hash") else None]
+
+        if result["kind"] == "doc":
+            sent = await self.pacer.send(chat_id, lambda: bot.send_file(chat_id, file=result["uploaded"], caption=cc1))
+            self.journal.mark(batch["job_id"], count, journal.UPLOADED, message_id=sent.id)
+            metrics.LINKS.inc(result="uploaded")
+            self.media.record(False)
+            self.media.store(keys, "doc", sent.document)
+            discard_result(batch, result)
+            return
+
+        if result.get("parts"):
+            # Several messages: nothing to re-send by reference later.
+            sent = await self.send_parts(batch, item, result, cc)
+            self.journal.mark(batch["job_id"], count, journal.UPLOADED, message_id=sent.id)
+            metrics.LINKS.inc(result="uploaded")
+            discard_result(batch, result)
+            return
+
+        uploaded_file = result["uploaded"]
+        uploaded_file.name = f"{file_name}.mp4"
+        attributes = [DocumentAttributeVideo(
+            result["duration"], w=result["width"], h=result["height"], supports_streaming=True
+        )]
+
+        sent = await self.pacer.send(chat_id, lambda: bot.send_file(
+            chat_id,
+            file=uploaded_file,
+            caption=cc,
+            supports_streaming=True,
+            attributes=attributes,
+            thumb=result["thumb"]
+        ))
+        self.journal.mark(batch["job_id"], count, journal.UPLOADED, message_id=sent.id)
+        metrics.LINKS.inc(result="uploaded")
+        self.media.record(False)
+        self.media.store(keys, "video", sent.document)
+        # Free the prefetch budget for the next downloads.
+        discard_result(batch, result)
+
+    async def send_album(self, batch, group):
+        """
+        Post prepared document links as one album, captions kept per item;
+        must be called in batch order.
+
+        Args:
+            group (list): (item, result) pairs of "doc" results, at most
+                ALBUM_SIZE of them.
+
+        Falls back to one post per link when Telegram refuses the album.
+        """
+        chat_id = batch["chat_id"]
+        if len(group) == 1:
+            await self.send_link(batch, *group[0])
+            return
+        files = [result["uploaded"] for _, result in group]
+        captions = [self.captions(batch, item)[1] for item, _ in group]
+        start = time.perf_counter()
+        try:
+            sent = await self.pacer.send(
+                chat_id, lambda: self.bot.send_file(chat_id, file=files, caption=captions, force_document=True))
+        except BadRequestError as e:
+            log.info(f"Album of {len(group)} documents refused ({e}), posting them one by one")
+            for item, result in group:
+                await self.send_link(batch, item, result)
+            return
+        for (item, result), message in zip(group, sent):
+            with logs.link(batch["job_id"], item["index"]):
+                log_done("posted", "post", result, start)
+            self.journal.mark(batch["job_id"], item["index"], journal.UPLOADED, message_id=message.id)
+            metrics.LINKS.inc(result="uploaded")
+            self.media.record(False)
+            self.media.store([url_cache_key(batch, item), "hash:" + result["hash"] if result.get("hash") else None],
+                             "doc", message.document)
+            discard_result(batch, result)
+
+    async def report_failure(self, batch, item, result, error):
+        """Mark a link failed and tell the chat why."""
+        chat_id = batch["chat_id"]
+        log.warning(f"{item['file_name']} failed: {logs.clip(str(error), 500)}")
+        logs.event(log, "failed", logging.WARNING, error=logs.clip(str(error), 500))
+        self.journal.mark(batch["job_id"], item["index"], journal.FAILED, error=str(error))
+        metrics.LINKS.inc(result="failed")
+        if isinstance(result, dict) and result.get("kind") == "doc":
+            await self.pacer.send(chat_id, lambda: self.bot.send_message(chat_id, str(error)))
+            return
+        url = item.get("resolved", item["url"])
+        error_text = (
+            f"**Downloading Interrupted**\n{str(error)}\n"
+            f"**Name »** {item['file_name']}\n"
+            f"**URL »** `{url}`"
+        )
+        await self.pacer.send(chat_id, lambda: self.bot.send_message(chat_id, error_text))
+
+    async def post_link(self, batch, item, result):
+        """
+        Upload stage: send a fetched link to the chat, in batch order.
+
+        `result` is whatever `fetch_link` returned, or the exception it raised.
+        """
+        start = time.perf_counter()
+        try:
+            result = await self.prepare_link(batch, item, result)
+            await self.send_link(batch, item, result)
+        except Exception as e:
+            await self.report_failure(batch, item, result, e)
+            return
+        log_done("posted", "post", result, start)
+
+    # -- jobs ---------------------------------------------------------------
+    async def run(self, job_id):
+        """
+        Run (or continue) a journalled batch through the download/upload pipeline.
+
+        Links already uploaded or failed are skipped; finished downloads are
+        reused from disk.
+        """
+        bot = self.bot
+        job = self.journal.job(job_id)
+        chat_id = job["chat_id"]
+        batch = dict(job["settings"], chat_id=chat_id, job_id=job_id)
+        items = self.journal.items(job_id, states=(journal.PENDING, journal.RESOLVED, journal.DOWNLOADED))
+        batch["items"] = items
+        batch["retries"] = retry.Budget()
+
+        # Notify processing start
+        counts = self.journal.counts(job_id)
+        if counts.get(journal.PENDING, 0) == sum(counts.values()):
+            start_text = "Processing your links..."
+        else:
+            start_text = f"Resuming **{batch['batch_name']}** from link {items[0]['index'] if items else '-'}..."
+        status_msg = await bot.send_message(chat_id, start_text)
+
+        queued = False
+
+        async def report_queue(position):
+            nonlocal queued
+            queued = True
+            await bot.edit_message(chat_id, status_msg.id, f"⏳ Waiting for a free slot... queue position **{position}**")
+
+        # The chat is the scheduling owner: slots rotate between users.
+        async def fetch(item):
+            with logs.link(job_id, item["index"]):
+                # Links to a host that keeps failing wait here, without a slot.
+                await retry.ENGINE.wait(host_key(item["url"]), batch["retries"])
+                async with self.scheduler.downloads.slot(chat_id):
+                    start = time.perf_counter()
+                    result = await self.fetch_link(batch, item)
+                log_done("fetched", "fetch", result, start)
+                return result
+
+        albums = AlbumQueue(self, batch)
+
+        async def post(item, result):
+            with logs.link(job_id, item["index"]):
+                if albums.takes(result):
+                    await albums.add(item, result)
+                    return
+                await albums.flush()
+                async with self.scheduler.uploads.slot(chat_id):
+                    await self.post_link(batch, item, result)
+
+        async with self.scheduler.admit(chat_id, on_wait=report_queue):
+            if queued:
+                await bot.edit_message(chat_id, status_msg.id, start_text)
+            batch["scratch"] = self.scheduler.scratch(job_id)
+            if items:
+                budget = DiskBudget(DISK_BUDGET_MB * 1024 * 1024, DISK_RESERVE_MB * 1024 * 1024,
+                                    path=batch["scratch"])
+                try:
+                    await run_pipeline(
+                        items,
+                        fetch,
+                        post,
+                        workers=DOWNLOAD_WORKERS,
+                        prefetch=PREFETCH,
+                        budget=budget,
+                        host_of=lambda item: host_key(item["url"]),
+                        hosts=self.hosts,
+                    )
+                    await albums.flush()
+                finally:
+                    albums.close()
+
+        await self.finish(job_id, batch, status_msg)
+
+    async def watch(self, job_id, queue, interval=10):
+        """
+        Distributed mode: follow a batch that worker processes are running
+        (see worker.py) and finish it once every link is posted.
+
+        Returns early, leaving the job as it is, when it stops running
+        (e.g. /stop paused it).
+        """
+        job = self.journal.job(job_id)
+        chat_id = job["chat_id"]
+        batch = dict(job["settings"], chat_id=chat_id, job_id=job_id)
+        status_msg = await self.bot.send_message(chat_id, "Processing your links...")
+        last = None
+        while True:
+            if self.journal.job(job_id)["state"] != "running":
+                return
+            remaining = queue.remaining(job_id)
+            if remaining == 0:
+                break
+            text = f"⏳ **{remaining}** links left, **{queue.live_workers()}** workers online"
+            if text != last:
+                await self.bot.edit_message(chat_id, status_msg.id, text)
+                last = text
+            await asyncio.sleep(interval)
+        await self.finish(job_id, batch, status_msg)
+
+    async def finish(self, job_id, batch, status_msg):
+        bot = self.bot
+        chat_id = batch["chat_id"]
+        self.journal.set_job_state(job_id, "done")
+        self.scheduler.cleanup(job_id)
+        spent = batch["retries"].summary() if batch.get("retries") else ""
+        await bot.send_message(chat_id, f"**Done Boss 😎**\n`{spent}`" if spent else "**Done Boss 😎**")
+        await bot.delete_messages(chat_id, status_msg.id)
+
+        batch_thumb = batch["thumb"]
+        if batch_thumb is not None and os.path.exists(batch_thumb):
+            os.remove(batch_thumb)
@@ -0,0 +1,841 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           BENCHMARKS
+===========================================================================
+Description        : Micro-benchmarks for the batch pipeline stages, and an
+                     offline end-to-end run of a synthetic batch against the
+                     stand-ins in fakes.py.
+
+Usage:
+    python3 bench.py probe FILE [-n 5]
+    python3 bench.py thumb FILE [-n 3] [--offset SECONDS]
+    python3 bench.py e2e [--hls 6] [--dash 2] [--pdfs 4] [--save FILE] [--compare FILE]
+    python3 bench.py upload [--mb 200] [--bandwidth 40] [--conn-bandwidth 4] [-n 2]
+    python3 bench.py ttff [FILE] [--duration 300] [--rate 8] [-n 3]
+    python3 bench.py fetch [--small 20] [--large 2] [--large-mb 64] [--rate 4]
+    python3 bench.py importtime [--modules main,worker] [-n 5] [--budget MS]
+    python3 bench.py logging [--tasks 200] [--records 100] [--slow-ms 0.2]
+
+The e2e run reads the usual settings (DOWNLOAD_WORKERS, PREFETCH,
+GLOBAL_UPLOADS, STREAM_UPLOAD, ...) from the environment like the bot does.
+===========================================================================
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import shutil
+import socket
+import asyncio
+import resource
+import tempfile
+import argparse
+import statistics
+
+import core as helper
+import logs
+
+
+def report(label, samples):
+    """Print min/median/max of a list of timings in milliseconds."""
+    ms = [x * 1000 for x in samples]
+    print(f"{label:<28} min {min(ms):8.1f} ms   median {statistics.median(ms):8.1f} ms   "
+          f"max {max(ms):8.1f} ms")
+
+
+# =============================================================================
+#                           METADATA PROBE
+# =============================================================================
+def moviepy_probe(path):
+    """The old upload_handler path: open a VideoFileClip for duration/size."""
+    from moviepy.editor import VideoFileClip
+    clip = VideoFileClip(path)
+    info = (int(clip.duration), *clip.size)
+    clip.close()
+    return info
+
+
+async def bench_probe(args):
+    samples = []
+    try:
+        for _ in range(args.n):
+            start = time.perf_counter()
+            moviepy_probe(args.file)
+            samples.append(time.perf_counter() - start)
+        report("moviepy VideoFileClip", samples)
+    except ImportError:
+        print("moviepy not installed, skipping the old path")
+
+    samples = []
+    for _ in range(args.n):
+        helper._probe_cache.clear()
+        start = time.perf_counter()
+        info = await helper.probe(args.file)
+        samples.append(time.perf_counter() - start)
+    report("core.probe (cold)", samples)
+
+    samples = []
+    for _ in range(args.n):
+        start = time.perf_counter()
+        await helper.probe(args.file)
+        samples.append(time.perf_counter() - start)
+    report("core.probe (cached)", samples)
+    print(info)
+
+
+# =============================================================================
+#                           THUMBNAILS
+# =============================================================================
+async def bench_thumb(args):
+    info = await helper.probe(args.file)
+    offset = args.offset if args.offset is not None else info.duration * 0.5
+    tmp = tempfile.mkdtemp()
+    # Cold runs wipe the cache: use a scratch one, not the bot's.
+    thumb_dir, helper.THUMB_DIR = helper.THUMB_DIR, os.path.join(tmp, "thumbs")
+    try:
+        # Old path: -ss after -i decodes everything up to the offset.
+        samples = []
+        for _ in range(args.n):
+            start = time.perf_counter()
+            await helper.execute(["ffmpeg", "-v", "error", "-y", "-i", args.file, "-ss", f"{offset:.3f}",
+                                  "-vframes", "1", os.path.join(tmp, "old.jpg")], kind="cpu")
+            samples.append(time.perf_counter() - start)
+        report(f"output-side seek @ {offset:.0f}s", samples)
+
+        samples = []
+        for _ in range(args.n):
+            start = time.perf_counter()
+            await helper._grab_frame(args.file, offset, os.path.join(tmp, "new.jpg"))
+            samples.append(time.perf_counter() - start)
+        report(f"input-side seek @ {offset:.0f}s", samples)
+
+        samples = []
+        for _ in range(args.n):
+            shutil.rmtree(helper.THUMB_DIR, ignore_errors=True)
+            start = time.perf_counter()
+            await helper.thumbnail(args.file, info=info)
+            samples.append(time.perf_counter() - start)
+        report("core.thumbnail (cold)", samples)
+
+        start = time.perf_counter()
+        await helper.thumbnail(args.file, info=info)
+        report("core.thumbnail (cached)", [time.perf_counter() - start])
+    finally:
+        helper.THUMB_DIR = thumb_dir
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# =============================================================================
+#                           END TO END
+# =============================================================================
+MB = 1024 * 1024
+
+# Headline metrics checked against a baseline: whether higher is better, and
+# the absolute change that is always treated as noise.
+CHECKS = [
+    ("links_per_min", True, 0),
+    ("bytes_per_s", True, 0),
+    ("peak_rss_mb", False, 5),
+    ("loop_lag_p99_ms", False, 5),
+]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Stages:
+    """Wall-clock samples per batch stage, collected by wrapping functions in place."""
+
+    def __init__(self):
+        self.samples = {}
+        self._patched = []
+
+    def record(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def wrap(self, obj, attr, name):
+        """Time every call of `obj.attr` (sync or async) under `name`."""
+        func = getattr(obj, attr)
+        if asyncio.iscoroutinefunction(func):
+            async def timed(*args, **kwargs):
+                label = name(*args, **kwargs) if callable(name) else name
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    if label:
+                        self.record(label, time.perf_counter() - start)
+        else:
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+        self._patched.append((obj, attr, func))
+        setattr(obj, attr, timed)
+
+    def restore(self):
+        for obj, attr, func in reversed(self._patched):
+            setattr(obj, attr, func)
+        self._patched.clear()
+
+    def summary(self):
+        return {
+            name: {
+                "count": len(xs),
+                "total_s": round(sum(xs), 3),
+                "median_ms": round(statistics.median(xs) * 1000, 1),
+                "p95_ms": round(percentile(xs, 95) * 1000, 1),
+            }
+            for name, xs in sorted(self.samples.items())
+        }
+
+
+def download_stage(cmd, *args, **kwargs):
+    """Only the downloader commands count as the download stage."""
+    if isinstance(cmd, str) and cmd.split(" ", 1)[0] in ("./N_m3u8DL-RE", "yt-dlp"):
+        return "download"
+    return None
+
+
+async def watch_loop(samples, interval=0.05):
+    """Record how late the event loop wakes a sleeping task."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"fake CDN did not come up on port {port}")
+            await asyncio.sleep(0.1)
+
+
+async def build_cdn(root, args):
+    """Generate the synthetic batch; returns the TXT lines pointing at it."""
+    import fakes
+
+    videos = args.hls + args.dash
+    await asyncio.gather(*(
+        fakes.make_video(os.path.join(root, f"v{i}"), i, args.duration, args.size, dash=i >= args.hls)
+        for i in range(videos)
+    ))
+    os.makedirs(os.path.join(root, "pdf"), exist_ok=True)
+    for j in range(args.pdfs):
+        fakes.make_pdf(os.path.join(root, "pdf", f"notes{j}.pdf"), int(args.pdf_mb * MB))
+
+    # Interleave notes between lectures like a real course export.
+    lines = []
+    pdfs = [f"Notes {j}:http://{{host}}/pdf/notes{j}.pdf" for j in range(args.pdfs)]
+    for i in range(videos):
+        path = f"v{i}/manifest.mpd" if i >= args.hls else f"v{i}/index.m3u8"
+        lines.append(f"Lecture {i}:http://{{host}}/{path}")
+        if pdfs:
+            lines.append(pdfs.pop(0))
+    return lines + pdfs
+
+
+async def bench_e2e(args):
+    import vars as config
+    import fakes
+    import batch
+    import journal
+    import resolvers
+    from scheduler import Scheduler
+    from progress import ProgressHub
+    from pipeline import HostLimiter, parse_host_limits
+
+    tmp = tempfile.mkdtemp(prefix="bench-e2e-")
+    cwd = os.getcwd()
+    server = None
+    stages = Stages()
+    try:
+        print("Generating synthetic batch...")
+        cdn = os.path.join(tmp, "cdn")
+        lines = await build_cdn(cdn, args)
+        port = free_port()
+        server = await asyncio.create_subprocess_exec(
+            sys.executable, fakes.__file__, "serve", cdn, str(port), "--rate", str(args.cdn_rate * MB))
+        await wait_port(port)
+
+        # The bot runs ./N_m3u8DL-RE and yt-dlp; point both at the fakes.
+        bin_dir = os.path.join(tmp, "bin")
+        fakes.install_downloaders(bin_dir)
+        os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+        os.chdir(bin_dir)
+
+        client = fakes.FakeClient(bandwidth=args.bandwidth * MB, latency=args.latency,
+                                  conn_bandwidth=args.conn_bandwidth * MB or None,
+                                  max_file_size=config.MAX_UPLOAD_MB * MB,
+                                  flood_limit=args.flood_limit or None)
+        db = journal.Journal(os.path.join(tmp, "journal.db"))
+        runner = batch.BatchRunner(
+            client, db, journal.MediaCache(db), ProgressHub(client),
+            Scheduler(work_dir=os.path.join(tmp, "work")),
+            HostLimiter(parse_host_limits(config.HOST_LIMITS), config.DEFAULT_HOST_LIMIT),
+            upload=make_upload(args.uploader, client),
+        )
+
+        # Same parsing as /upload; the stand-ins speak plain HTTP.
+        links = [line.format(host=f"127.0.0.1:{port}").split("://", 1) for line in lines]
+        items = batch.build_items(links, 1)
+        for item in items:
+            item["url"] = "http://" + item["url"][len("https://"):]
+        settings = {"pw_token": "no", "batch_name": "bench", "res": args.res, "caption": "", "thumb": None}
+        job_id = db.create_job(1, settings, items)
+
+        stages.wrap(resolvers, "resolve", "resolve")
+        stages.wrap(helper, "execute", download_stage)
+        stages.wrap(helper, "probe", "probe")
+        stages.wrap(helper, "content_hash", "hash")
+        stages.wrap(helper, "thumbnail", "thumbnail")
+        stages.wrap(runner, "upload", "upload")
+        stages.wrap(client, "send_file", "send_file")
+        stages.wrap(runner, "fetch_link", "fetch (total)")
+        stages.wrap(runner, "post_link", "post (total)")
+        stages.wrap(runner, "send_album", "album (total)")
+
+        lag = []
+        watcher = asyncio.ensure_future(watch_loop(lag))
+        print(f"Running {len(items)} links...")
+        start = time.perf_counter()
+        try:
+            await runner.run(job_id)
+        finally:
+            wall = time.perf_counter() - start
+            watcher.cancel()
+            stages.restore()
+
+        counts = db.counts(job_id)
+        for row in db.db.execute("SELECT idx, error FROM links WHERE job_id = ? AND state = ?",
+                                 (job_id, journal.FAILED)):
+            print(f"  link {row['idx']} failed: {row['error']}")
+        posted = [row["message_id"] for row in db.db.execute(
+            "SELECT message_id FROM links WHERE job_id = ? AND state = ? ORDER BY idx", (job_id, journal.UPLOADED))]
+        if posted != sorted(posted):
+            print("  links were posted out of order")
+        results = {
+            "links": len(items),
+            "uploaded": counts.get(journal.UPLOADED, 0),
+            "failed": counts.get(journal.FAILED, 0),
+            "wall_s": round(wall, 3),
+            "links_per_min": round(len(items) * 60 / wall, 2),
+            "bytes": client.bytes_uploaded,
+            "bytes_per_s": round(client.bytes_uploaded / wall),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "loop_lag_p50_ms": round(percentile(lag, 50) * 1000, 2),
+            "loop_lag_p99_ms": round(percentile(lag, 99) * 1000, 2),
+            "loop_lag_max_ms": round(max(lag, default=0) * 1000, 2),
+            "flood_waits": client.flood_waits,
+            "stages": stages.summary(),
+        }
+    finally:
+        os.chdir(cwd)
+        if server is not None and server.returncode is None:
+            server.terminate()
+            await server.wait()
+        await helper.close_http_session()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print_e2e(results)
+    params = {k: v for k, v in vars(args).items() if k not in ("func", "save", "compare", "tolerance")}
+    params["config"] = {k: getattr(config, k) for k in (
+        "DOWNLOAD_WORKERS", "PREFETCH", "GLOBAL_DOWNLOADS", "GLOBAL_UPLOADS", "STREAM_UPLOAD", "MAX_UPLOAD_MB",
+        "ALBUM_SIZE", "SEND_INTERVAL")}
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"params": params, "results": results}, f, indent=2)
+        print(f"Baseline saved to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["params"] != params:
+            print("warning: baseline was recorded with different parameters")
+        if compare_e2e(baseline["results"], results, args.tolerance):
+            sys.exit(1)
+    if results["failed"] or results["uploaded"] != results["links"]:
+        sys.exit(1)
+
+
+def print_e2e(results):
+    print(f"\nlinks {results['links']}  uploaded {results['uploaded']}  failed {results['failed']}  "
+          f"in {results['wall_s']:.1f} s")
+    print(f"{'links/min':<18}{results['links_per_min']:>12.2f}")
+    print(f"{'uploaded MB':<18}{results['bytes'] / MB:>12.1f}")
+    print(f"{'upload MB/s':<18}{results['bytes_per_s'] / MB:>12.2f}")
+    print(f"{'peak RSS MB':<18}{results['peak_rss_mb']:>12.1f}")
+    print(f"{'flood waits':<18}{results.get('flood_waits', 0):>12}")
+    print(f"{'loop lag ms':<18}{'p50':>6} {results['loop_lag_p50_ms']:.2f}   p99 {results['loop_lag_p99_ms']:.2f}"
+          f"   max {results['loop_lag_max_ms']:.2f}")
+    print(f"\n{'stage':<16}{'count':>6}{'total s':>10}{'median ms':>12}{'p95 ms':>10}")
+    for name, s in results["stages"].items():
+        print(f"{name:<16}{s['count']:>6}{s['total_s']:>10.2f}{s['median_ms']:>12.1f}{s['p95_ms']:>10.1f}")
+
+
+def compare_e2e(baseline, results, tolerance):
+    """Print deltas against a saved baseline; returns True on a regression."""
+    regressed = False
+    print(f"\n{'metric':<24}{'baseline':>12}{'now':>12}{'change':>10}")
+    for key, higher_is_better, noise in CHECKS:
+        old, new = baseline[key], results[key]
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > tolerance and abs(new - old) > noise:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{key:<24}{old:>12.2f}{new:>12.2f}{change:>+10.1%}{flag}")
+    for name, s in results["stages"].items():
+        old = baseline["stages"].get(name)
+        if old and old["median_ms"]:
+            change = (s["median_ms"] - old["median_ms"]) / old["median_ms"]
+            print(f"{name + ' median ms':<24}{old['median_ms']:>12.1f}{s['median_ms']:>12.1f}{change:>+10.1%}")
+    return regressed
+
+
+# =============================================================================
+#                           UPLOADS
+# =============================================================================
+UPLOADERS = ("single", "spylib", "native")
+
+
+def make_upload(kind, client):
+    """`upload(client, file, progress_callback=...)` of one kind, bound to a FakeClient."""
+    import fakes
+    import uploader
+
+    if kind == "native":
+        async def upload(client, file, progress_callback=None):
+            return await uploader.upload_file(client, file, progress_callback=progress_callback,
+                                              connect=client.connect)
+        return upload
+    if kind == "spylib":
+        from devgagantools import spylib
+        # Its extra senders are opened on the fake instead of a real DC.
+        spylib.ParallelTransferrer._create_sender = lambda self: self.client.connect()
+        return spylib.upload_file
+    return fakes.fake_upload
+
+
+async def bench_upload(args):
+    import fakes
+
+    fd, path = tempfile.mkstemp(suffix=".mp4")
+    with os.fdopen(fd, "wb") as f:
+        for _ in range(int(args.mb)):
+            f.write(os.urandom(MB))
+    size = os.path.getsize(path)
+    print(f"{args.mb:.0f} MB file, link {args.bandwidth:g} MB/s, {args.conn_bandwidth:g} MB/s per connection, "
+          f"{args.latency * 1000:.0f} ms round trip\n")
+    print(f"{'uploader':<10}{'run':>4}{'s':>8}{'MB/s':>8}{'conns':>7}{'lag p99 ms':>12}{'lag max ms':>12}")
+    try:
+        for kind in args.uploaders.split(","):
+            # One client per uploader, so the native one's tuned count carries across its runs.
+            client = fakes.FakeClient(bandwidth=args.bandwidth * MB, latency=args.latency,
+                                      conn_bandwidth=args.conn_bandwidth * MB or None)
+            upload = make_upload(kind, client)
+            for run in range(1, args.n + 1):
+                lag = []
+                watcher = asyncio.ensure_future(watch_loop(lag))
+                client.peak_connections = 0
+                start = time.perf_counter()
+                with open(path, "rb") as f:
+                    result = await upload(client, f, progress_callback=lambda current, total: None)
+                wall = time.perf_counter() - start
+                watcher.cancel()
+                if client._sizes.get(result.id) != size:
+                    raise RuntimeError(f"{kind}: sink got {client._sizes.get(result.id)} of {size} bytes")
+                print(f"{kind:<10}{run:>4}{wall:>8.2f}{size / MB / wall:>8.2f}{client.peak_connections:>7}"
+                      f"{percentile(lag, 99) * 1000:>12.2f}{max(lag, default=0) * 1000:>12.2f}")
+    finally:
+        os.remove(path)
+
+
+# =============================================================================
+#                           FASTSTART
+# =============================================================================
+async def first_frame(url):
+    """
+    Seconds until ffmpeg has decoded the first video frame of `url`, and
+    whether it got there at all (moov at the end behind a server that
+    can't seek means reading the whole file, then failing).
+    """
+    start = time.perf_counter()
+    try:
+        await helper.execute(["ffmpeg", "-v", "error", "-i", url, "-frames:v", "1", "-f", "null", "-"],
+                             kind="cpu")
+    except helper.ProcessError:
+        return time.perf_counter() - start, False
+    return time.perf_counter() - start, True
+
+
+async def bench_ttff(args):
+    import fakes
+
+    tmp = tempfile.mkdtemp(prefix="bench-ttff-")
+    servers = []
+    try:
+        source = args.file
+        if source is None:
+            print(f"Generating a {args.duration}s {args.size} lecture...")
+            await fakes.make_video(os.path.join(tmp, "src"), 1, args.duration, args.size)
+            source = os.path.join(tmp, "src.mp4")
+            with open(source, "wb") as out:
+                for name in ["init.mp4"] + sorted(x for x in os.listdir(os.path.join(tmp, "src")) if x.endswith(".m4s")):
+                    with open(os.path.join(tmp, "src", name), "rb") as f:
+                        shutil.copyfileobj(f, out)
+        # What N_m3u8DL-RE's mux usually leaves: moov after mdat.
+        tail = os.path.join(tmp, "tail.mp4")
+        await helper.execute(["ffmpeg", "-v", "error", "-y", "-i", source, "-c", "copy", tail], kind="cpu")
+        fast = os.path.join(tmp, "fast.mp4")
+        shutil.copy(tail, fast)
+        start = time.perf_counter()
+        await helper.faststart(fast)
+        in_place = time.perf_counter() - start
+        start = time.perf_counter()
+        await helper.execute(["ffmpeg", "-v", "error", "-y", "-i", tail, "-c", "copy", "-movflags", "+faststart",
+                              os.path.join(tmp, "remux.mp4")], kind="cpu")
+        remux = time.perf_counter() - start
+        os.remove(os.path.join(tmp, "remux.mp4"))
+        print(f"{os.path.getsize(tail) / MB:.0f} MB; faststart in place {in_place:.2f} s, "
+              f"ffmpeg remux {remux:.2f} s\n")
+
+        for ranges in (True, False):
+            port = free_port()
+            cmd = [sys.executable, fakes.__file__, "serve", tmp, str(port), "--rate", str(args.rate * MB)]
+            servers.append(await asyncio.create_subprocess_exec(*cmd + ([] if ranges else ["--no-ranges"])))
+            await wait_port(port)
+            print(f"{args.rate:g} MB/s, {'with' if ranges else 'without'} Range support")
+            for label, path in (("moov at end", tail), ("faststart", fast)):
+                url = f"http://127.0.0.1:{port}/{os.path.basename(path)}"
+                runs = [await first_frame(url) for _ in range(args.n)]
+                if all(ok for _, ok in runs):
+                    report(f"  {label}", [t for t, _ in runs])
+                else:
+                    print(f"{'  ' + label:<28} no first frame; gave up after {statistics.median(t for t, _ in runs):.1f} s")
+    finally:
+        for server in servers:
+            if server.returncode is None:
+                server.terminate()
+                await server.wait()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# =============================================================================
+#                           DIRECT DOWNLOADS
+# =============================================================================
+# What upload_handler used to run for every .pdf link.
+YTDLP_PDF = (
+    'yt-dlp --external-downloader aria2c '
+    '--external-downloader-args "-j 128 -x 16 -s 16 -k 1M --timeout=120 --connect-timeout=120 '
+    '--max-download-limit=0 --max-overall-download-limit=0 '
+    '--enable-http-pipelining=true --file-allocation=falloc" '
+    '-o "{out}" "{url}" -R 25 --fragment-retries 25'
+)
+
+
+async def bench_fetch(args):
+    import fakes
+
+    tmp = tempfile.mkdtemp(prefix="bench-fetch-")
+    server = None
+    try:
+        served, out = os.path.join(tmp, "cdn"), os.path.join(tmp, "out")
+        os.makedirs(served)
+        os.makedirs(out)
+        files = [("small", f"small{j}.pdf", int(args.small_kb * 1024)) for j in range(args.small)]
+        files += [("large", f"large{j}.pdf", int(args.large_mb * MB)) for j in range(args.large)]
+        for _, name, size in files:
+            fakes.make_pdf(os.path.join(served, name), size)
+        port = free_port()
+        server = await asyncio.create_subprocess_exec(
+            sys.executable, fakes.__file__, "serve", served, str(port), "--rate", str(args.rate * MB))
+        await wait_port(port)
+        if not shutil.which("aria2c"):
+            print("aria2c is not installed: yt-dlp falls back to its own downloader")
+        print(f"{args.small} x {args.small_kb:g} KB + {args.large} x {args.large_mb:g} MB, "
+              f"{args.rate:g} MB/s per connection\n")
+
+        async def old(url, dest):
+            await helper.execute(YTDLP_PDF.format(out=dest + ".pdf", url=url), kind="io")
+
+        async def new(url, dest):
+            await helper.download(url, dest)
+
+        for label, fetch in (("yt-dlp", old), ("native", new)):
+            timings = {"small": [], "large": []}
+            for kind, name, size in files:
+                dest = os.path.join(out, name[:-4])
+                start = time.perf_counter()
+                await fetch(f"http://127.0.0.1:{port}/{name}", dest)
+                timings[kind].append(time.perf_counter() - start)
+                if os.path.getsize(dest + ".pdf") != size:
+                    raise RuntimeError(f"{label}: {name} came out the wrong size")
+                os.remove(dest + ".pdf")
+            for kind, samples in timings.items():
+                if samples:
+                    report(f"{label} {kind}", samples)
+            print(f"{label + ' total':<28} {sum(map(sum, timings.values())):.2f} s")
+    finally:
+        if server is not None and server.returncode is None:
+            server.terminate()
+            await server.wait()
+        await helper.close_http_session()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# =============================================================================
+#                           COLD START
+# =============================================================================
+# Must not be imported while the bot starts up: the stages that need them
+# load them on first use (or they are not used at all).
+COLD_START_BANNED = ("pyrogram", "pyromod", "moviepy", "numpy", "requests", "devgagantools")
+
+
+async def import_profile(module, cwd):
+    """
+    `python -X importtime -c "import <module>"` in `cwd`.
+
+    Returns:
+        (wall seconds, {module name: cumulative import µs}, the same for
+        the modules `module` imports directly).
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "-X", "importtime", "-c", f"import {module}", cwd=cwd, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    _, stderr = await proc.communicate()
+    wall = time.perf_counter() - start
+    stderr = stderr.decode(errors="replace")
+    if proc.returncode:
+        raise RuntimeError(f"import {module} failed:\n{stderr[-2000:]}")
+    cumulative, direct, children = {}, {}, {}
+    for line in stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2][1:]
+        cumulative[name.strip()] = int(fields[1])
+        # Two spaces per nesting level; children are listed before their parent.
+        if not name.startswith(" "):
+            if name == module:
+                direct = children
+            children = {}
+        elif not name.startswith("   "):
+            children[name.strip()] = int(fields[1])
+    return wall, cumulative, direct
+
+
+async def bench_importtime(args):
+    tmp = tempfile.mkdtemp(prefix="bench-import-")
+    failed = False
+    try:
+        for module in args.modules.split(","):
+            # main.py opens its session file and journal in the working directory.
+            runs = [await import_profile(module, tmp) for _ in range(args.n)]
+            print(f"import {module}")
+            report("  wall (interpreter + import)", [wall for wall, _, _ in runs])
+            report("  import", [cumulative[module] / 1e6 for _, cumulative, _ in runs])
+            _, cumulative, direct = runs[-1]
+            for name, us in sorted(direct.items(), key=lambda x: -x[1])[:args.top]:
+                print(f"    {name:<26}{us / 1000:8.1f} ms")
+            banned = sorted({name.split(".")[0] for name in cumulative} & set(COLD_START_BANNED))
+            if banned:
+                print(f"  REGRESSION: imported at startup: {', '.join(banned)}")
+                failed = True
+            median = statistics.median(cumulative[module] for _, cumulative, _ in runs) / 1000
+            if args.budget and median > args.budget:
+                print(f"  REGRESSION: {median:.0f} ms is over the {args.budget:g} ms budget")
+                failed = True
+            print()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    if failed:
+        sys.exit(1)
+
+
+# =============================================================================
+#                           LOGGING
+# =============================================================================
+class SlowFileHandler(logging.FileHandler):
+    """A FileHandler on a disk that takes `delay` seconds per write."""
+
+    def __init__(self, path, delay):
+        super().__init__(path)
+        self.delay = delay
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        super().emit(record)
+
+
+async def log_workload(tasks, records, output):
+    """
+    `tasks` coroutines each logging `records` lines (every 20th one a
+    tool's whole output). Returns (wall s, loop lag samples, seconds the
+    loop spent inside logging calls).
+    """
+    log = logging.getLogger("bench.logging")
+    spent = []
+
+    async def one(n):
+        with logs.link(1, n):
+            for i in range(records):
+                start = time.perf_counter()
+                if i % 20 == 0:
+                    log.info(f"[ffmpeg exited with 0]\n{output}")
+                else:
+                    logs.event(log, "stage done", stage="download", bytes=i * 1024, duration=0.1)
+                spent.append(time.perf_counter() - start)
+                await asyncio.sleep(0)
+
+    lag = []
+    watcher = asyncio.ensure_future(watch_loop(lag, interval=0.01))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(tasks)))
+    wall = time.perf_counter() - start
+    watcher.cancel()
+    return wall, lag, sum(spent)
+
+
+async def bench_logging(args):
+    tmp = tempfile.mkdtemp(prefix="bench-logging-")
+    output = "frame=  100 fps=0.0 q=-1.0 size=N/A time=00:00:04.00 bitrate=N/A speed=8x\n" * 250
+    root = logging.getLogger()
+    print(f"{args.tasks} tasks x {args.records} records, {args.slow_ms:g} ms per disk write, "
+          f"tool output {len(output) // 1024} KB\n")
+    print(f"{'setup':<10}{'wall s':>8}{'in log calls s':>16}{'lag p99 ms':>12}{'lag max ms':>12}")
+    try:
+        # The old setup: a handler writing from the logging task itself.
+        handler = SlowFileHandler(os.path.join(tmp, "sync.txt"), args.slow_ms / 1000)
+        handler.setFormatter(logging.Formatter(logs.TEXT_FORMAT.replace("%(where)s", "")))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        try:
+            wall, lag, spent = await log_workload(args.tasks, args.records, output)
+        finally:
+            root.removeHandler(handler)
+            handler.close()
+        print(f"{'sync':<10}{wall:>8.2f}{spent:>16.2f}{percentile(lag, 99) * 1000:>12.1f}"
+              f"{max(lag, default=0) * 1000:>12.1f}")
+
+        listener = logs.setup("INFO", os.path.join(tmp, "logs.txt"), os.path.join(tmp, "logs.jsonl"),
+                              console=False)
+        for handler in listener.handlers:
+            handler.emit = (lambda emit: lambda record: (time.sleep(args.slow_ms / 1000), emit(record)))(
+                handler.emit)
+        wall, lag, spent = await log_workload(args.tasks, args.records, logs.clip(output))
+        print(f"{'queue':<10}{wall:>8.2f}{spent:>16.2f}{percentile(lag, 99) * 1000:>12.1f}"
+              f"{max(lag, default=0) * 1000:>12.1f}")
+        start = time.perf_counter()
+        logs.shutdown()
+        print(f"\nwriter thread caught up {time.perf_counter() - start:.2f} s later; "
+              f"{logs.dropped} records dropped")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("probe", help="core.probe vs moviepy VideoFileClip")
+    p.add_argument("file")
+    p.add_argument("-n", type=int, default=5)
+    p.set_defaults(func=bench_probe)
+
+    p = sub.add_parser("thumb", help="core.thumbnail vs the old output-side seek")
+    p.add_argument("file")
+    p.add_argument("-n", type=int, default=3)
+    p.add_argument("--offset", type=float, help="seek point in seconds (default: middle)")
+    p.set_defaults(func=bench_thumb)
+
+    p = sub.add_parser("e2e", help="synthetic batch through the real pipeline, fully offline")
+    p.add_argument("--hls", type=int, default=6, help="HLS lectures")
+    p.add_argument("--dash", type=int, default=2, help="DASH lectures")
+    p.add_argument("--pdfs", type=int, default=4)
+    p.add_argument("--duration", type=int, default=60, help="lecture length in seconds")
+    p.add_argument("--size", default="640x360,1280x720", help="lecture variants, comma separated")
+    p.add_argument("--res", default="640x360", help='resolution asked for in /upload ("UN" = best)')
+    p.add_argument("--pdf-mb", type=float, default=5)
+    p.add_argument("--cdn-rate", type=float, default=0, help="per-response CDN cap in MB/s (0 = none)")
+    p.add_argument("--bandwidth", type=float, default=20, help="simulated Telegram upload MB/s")
+    p.add_argument("--latency", type=float, default=0.05, help="simulated Telegram round trip in seconds")
+    p.add_argument("--conn-bandwidth", type=float, default=0, help="per-connection upload MB/s (0 = none)")
+    p.add_argument("--uploader", choices=UPLOADERS, default="native")
+    p.add_argument("--flood-limit", type=int, default=0, help="posts per minute a chat takes before flood waits")
+    p.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    p.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    p.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown before failing (0.1 = 10%%)")
+    p.set_defaults(func=bench_e2e)
+
+    p = sub.add_parser("upload", help="uploader.upload_file vs devgagantools vs one connection")
+    p.add_argument("--mb", type=float, default=200, help="file size in MB")
+    p.add_argument("--bandwidth", type=float, default=40, help="simulated Telegram link MB/s")
+    p.add_argument("--conn-bandwidth", type=float, default=4, help="per-connection MB/s (0 = none)")
+    p.add_argument("--latency", type=float, default=0.05, help="simulated round trip in seconds")
+    p.add_argument("--uploaders", default=",".join(UPLOADERS))
+    p.add_argument("-n", type=int, default=2, help="runs per uploader")
+    p.set_defaults(func=bench_upload)
+
+    p = sub.add_parser("ttff", help="time to first frame over HTTP: moov at the end vs faststart")
+    p.add_argument("file", nargs="?", help="MP4 to use (default: generate one)")
+    p.add_argument("--duration", type=int, default=300, help="generated lecture length in seconds")
+    p.add_argument("--size", default="1280x720", help="generated lecture resolution")
+    p.add_argument("--rate", type=float, default=8, help="CDN speed in MB/s")
+    p.add_argument("-n", type=int, default=3)
+    p.set_defaults(func=bench_ttff)
+
+    p = sub.add_parser("fetch", help="core.download vs the old yt-dlp/aria2c command for PDFs")
+    p.add_argument("--small", type=int, default=20, help="number of small PDFs")
+    p.add_argument("--small-kb", type=float, default=300)
+    p.add_argument("--large", type=int, default=2, help="number of large PDFs")
+    p.add_argument("--large-mb", type=float, default=64)
+    p.add_argument("--rate", type=float, default=4, help="CDN speed per connection in MB/s")
+    p.set_defaults(func=bench_fetch)
+
+    p = sub.add_parser("importtime", help="cold-start import cost (-X importtime); fails on banned imports")
+    p.add_argument("--modules", default="main,worker", help="modules to import, comma separated")
+    p.add_argument("-n", type=int, default=5)
+    p.add_argument("--top", type=int, default=8, help="heaviest direct imports to list")
+    p.add_argument("--budget", type=float, default=0, help="fail when the median import takes longer (ms)")
+    p.set_defaults(func=bench_importtime)
+
+    p = sub.add_parser("logging", help="logging from the loop: a plain FileHandler vs logs.setup()")
+    p.add_argument("--tasks", type=int, default=200)
+    p.add_argument("--records", type=int, default=100, help="records per task")
+    p.add_argument("--slow-ms", type=float, default=0.2, help="simulated disk latency per write")
+    p.set_defaults(func=bench_logging)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,141 +3,871 @@
 # Ask Doubt on telegram @KingVJ01
 
 import os
+import re
+import json
+import errno
+import base64
+import hashlib
 import time
+import signal
+import struct
 import datetime
 import aiohttp
 import aiofiles
 import asyncio
 import logging
-import requests
-import tgcrypto
-import subprocess
-import concurrent.futures
-
-from utils import progress_bar
-
-from pyrogram import Client, filters
-from pyrogram.types import Message
-
-def duration(filename):
-    result = subprocess.run(["ffprobe", "-v", "error", "-show_entries",
-                             "format=duration", "-of",
-                             "default=noprint_wrappers=1:nokey=1", filename],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT)
-    return float(result.stdout)
-    
-def exec(cmd):
-        process = subprocess.run(cmd, stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-        output = process.stdout.decode()
-        print(output)
-        return output
-        #err = process.stdout.decode()
-def pull_run(work, cmds):
-    with concurrent.futures.ThreadPoolExecutor(max_workers=work) as executor:
-        print("Waiting for tasks to complete")
-        fut = executor.map(exec,cmds)
-async def aio(url,name):
-    k = f'{name}.pdf'
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                f = await aiofiles.open(k, mode='wb')
-                await f.write(await resp.read())
-                await f.close()
-    return k
-
-
-async def download(url,name):
-    ka = f'{name}.pdf'
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                f = await aiofiles.open(ka, mode='wb')
-                await f.write(await resp.read())
-                await f.close()
-    return ka
+import contextlib
+from collections import namedtuple, OrderedDict
+
+from vars import (
+    CPU_PROCS, IO_PROCS, HTTP_POOL_SIZE, HTTP_PER_HOST, FFMPEG_TIMEOUT, THUMB_DIR, THUMB_CACHE_SIZE,
+    DOWNLOAD_SEGMENTS, SEGMENT_MIN_MB,
+)
+
+import logs
+import retry
+import metrics
+from pipeline import host_key
+
+
+# ---------------------------------------------------------------------------
+# Shared async executor for ffmpeg, ffprobe, N_m3u8DL-RE, yt-dlp and aria2c.
+# "cpu" tools (ffmpeg/ffprobe) and "io" tools (downloaders) get separate
+# concurrency limits so a pile of downloads never starves muxing and
+# probing, and vice versa.
+# ---------------------------------------------------------------------------
+ProcResult = namedtuple("ProcResult", "returncode stdout stderr")
+
+PROC_LIMITS = {"cpu": CPU_PROCS, "io": IO_PROCS}
+_proc_slots = {}
+
+PROCS = metrics.gauge("leech_processes", "External tools running or waiting for a slot.", ("kind", "state"))
+
+
+class ProcessError(Exception):
+    """An external tool failed, timed out or was killed."""
+
+    def __init__(self, cmd, returncode, stdout="", stderr="", timed_out=False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+        tool = (cmd if isinstance(cmd, str) else " ".join(cmd)).split(" ", 1)[0]
+        if timed_out:
+            reason = "timed out"
+        else:
+            reason = f"exited with {returncode}"
+        tail = (stderr.strip() or stdout.strip())[-500:]
+        super().__init__(f"{tool} {reason}: {tail}" if tail else f"{tool} {reason}")
+
+
+def _slot(kind):
+    if kind not in _proc_slots:
+        _proc_slots[kind] = asyncio.Semaphore(PROC_LIMITS.get(kind, IO_PROCS))
+    return _proc_slots[kind]
 
 
+@contextlib.asynccontextmanager
+async def _running(kind):
+    """Hold an executor slot, keeping the process gauges current."""
+    slot = _slot(kind)
+    PROCS.inc(kind=kind, state="waiting")
+    try:
+        await slot.acquire()
+    finally:
+        PROCS.dec(kind=kind, state="waiting")
+    PROCS.inc(kind=kind, state="running")
+    try:
+        yield
+    finally:
+        PROCS.dec(kind=kind, state="running")
+        slot.release()
+
 
-def parse_vid_info(info):
-    info = info.strip()
-    info = info.split("\n")
-    new_info = []
-    temp = []
-    for i in info:
-        i = str(i)
-        if "[" not in i and '---' not in i:
-            while "  " in i:
-                i = i.replace("  ", " ")
-            i.strip()
-            i = i.split("|")[0].split(" ",2)
+def _kill(proc):
+    """Kill a child and everything it spawned (shell, aria2c, ffmpeg...)."""
+    if proc.returncode is not None:
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+
+async def execute(cmd, kind="io", timeout=None, on_output=None, check=True,
+                  cwd=None, keep=1024 * 1024):
+    """
+    Run an external tool without blocking the event loop.
+
+    Args:
+        cmd (str or list): Shell string or argv list.
+        kind (str): "cpu" or "io"; picks the concurrency limit.
+        timeout (float): Seconds before the process group is killed.
+        on_output (callable): Called as on_output(stream, chunk) for every
+            chunk read from "stdout"/"stderr", while the tool runs.
+        check (bool): Raise ProcessError on a non-zero exit.
+        cwd (str): Working directory.
+        keep (int): Bytes of each stream kept in the result (the tail).
+
+    Returns:
+        ProcResult: returncode, stdout and stderr (decoded).
+    """
+    async with _running(kind):
+        if isinstance(cmd, str):
+            proc = await asyncio.create_subprocess_shell(
+                cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                cwd=cwd, start_new_session=True)
+        else:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                cwd=cwd, start_new_session=True)
+
+        buffers = {"stdout": bytearray(), "stderr": bytearray()}
+
+        async def pump(stream, name):
+            buf = buffers[name]
+            while True:
+                chunk = await stream.read(65536)
+                if not chunk:
+                    break
+                buf.extend(chunk)
+                if keep and len(buf) > keep:
+                    del buf[:len(buf) - keep]
+                if on_output is not None:
+                    on_output(name, chunk)
+
+        def result():
+            return ProcResult(
+                proc.returncode,
+                buffers["stdout"].decode(errors="replace"),
+                buffers["stderr"].decode(errors="replace"),
+            )
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(pump(proc.stdout, "stdout"), pump(proc.stderr, "stderr"), proc.wait()),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            _kill(proc)
+            await proc.wait()
+            res = result()
+            raise ProcessError(cmd, res.returncode, res.stdout, res.stderr, timed_out=True)
+        except asyncio.CancelledError:
+            _kill(proc)
+            raise
+
+    res = result()
+    if check and res.returncode != 0:
+        raise ProcessError(cmd, res.returncode, res.stdout, res.stderr)
+    return res
+
+
+# ---------------------------------------------------------------------------
+# Media metadata: one `ffprobe -print_format json` call per file, cached by
+# path + mtime + size so thumbnail, upload and split stages all reuse it.
+# ---------------------------------------------------------------------------
+MediaInfo = namedtuple(
+    "MediaInfo",
+    "duration width height vcodec acodec bitrate size faststart fragmented",
+)
+
+PROBE_CACHE_SIZE = 256
+_probe_cache = OrderedDict()
+
+
+def mp4_layout(filename):
+    """
+    Walk the top-level MP4 boxes and report (faststart, fragmented).
+
+    faststart is True when `moov` comes before `mdat`, False when it comes
+    after, and None when the file is not an MP4 (e.g. mkv/webm).
+    """
+    moov = fragmented = False
+    with open(filename, "rb") as f:
+        head = f.read(8)
+        if len(head) < 8 or head[4:8] != b"ftyp":
+            return None, False
+        f.seek(0)
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                break
+            size, box = struct.unpack(">I4s", head)
+            header = 8
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+                header = 16
+            if box == b"moov":
+                moov = True
+            elif box == b"moof":
+                fragmented = True
+            elif box == b"mdat":
+                return moov, fragmented
+            if size == 0 or size < header:
+                break
+            f.seek(size - header, os.SEEK_CUR)
+    return moov, fragmented
+
+
+async def probe(filename):
+    """
+    Return MediaInfo for `filename` from a single ffprobe run.
+
+    Results are cached until the file's mtime or size changes.
+    """
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+    if key in _probe_cache:
+        _probe_cache.move_to_end(key)
+        metrics.CACHE.inc(cache="probe", result="hit")
+        return _probe_cache[key]
+    metrics.CACHE.inc(cache="probe", result="miss")
+
+    with metrics.stage("probe"):
+        result = await execute(["ffprobe", "-v", "error", "-print_format", "json",
+                                "-show_format", "-show_streams", filename], kind="cpu")
+        data = json.loads(result.stdout or "{}")
+        fmt = data.get("format", {})
+        video = next((x for x in data.get("streams", []) if x.get("codec_type") == "video"), {})
+        audio = next((x for x in data.get("streams", []) if x.get("codec_type") == "audio"), {})
+        faststart, fragmented = await asyncio.to_thread(mp4_layout, filename)
+
+    info = MediaInfo(
+        duration=float(fmt.get("duration") or video.get("duration") or 0),
+        width=int(video.get("width") or 0),
+        height=int(video.get("height") or 0),
+        vcodec=video.get("codec_name"),
+        acodec=audio.get("codec_name"),
+        bitrate=int(fmt.get("bit_rate") or 0),
+        size=st.st_size,
+        faststart=faststart,
+        fragmented=bool(fragmented),
+    )
+    _probe_cache[key] = info
+    while len(_probe_cache) > PROBE_CACHE_SIZE:
+        _probe_cache.popitem(last=False)
+    return info
+
+
+def content_hash(filename, chunk=4 * 1024 * 1024):
+    """
+    SHA-256 of the whole file. It keys the upload dedup cache, where a
+    sampled fingerprint could match two lectures cut from the same template
+    and post the wrong one; run it off the event loop.
+    """
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while True:
+            block = f.read(chunk)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Thumbnails: input-side (-ss before -i) keyframe seek, scaled to Telegram's
+# 320px limit, skipping near-black frames, and cached per content hash.
+# ---------------------------------------------------------------------------
+THUMB_SIZE = 320
+THUMB_BLACK_LEVEL = 24
+THUMB_OFFSETS = (0.1, 0.25, 0.5)
+YAVG_RE = re.compile(r"lavfi\.signalstats\.YAVG=([\d.]+)")
+
+
+async def _grab_frame(filename, offset, dest):
+    """Write one scaled frame at `offset` seconds; return its mean luma."""
+    vf = (f"scale={THUMB_SIZE}:{THUMB_SIZE}:force_original_aspect_ratio=decrease,"
+          f"signalstats,metadata=print:key=lavfi.signalstats.YAVG")
+    result = await execute(["ffmpeg", "-v", "info", "-y", "-ss", f"{offset:.3f}", "-i", filename,
+                            "-frames:v", "1", "-an", "-vf", vf, "-q:v", "4", dest],
+                           kind="cpu", timeout=FFMPEG_TIMEOUT)
+    m = YAVG_RE.search(result.stderr)
+    return float(m.group(1)) if m else 255.0
+
+
+async def thumbnail(filename, key=None, info=None):
+    """
+    Return a JPEG thumbnail for a video, or None if ffmpeg could not make one.
+
+    Tries a few points into the video and keeps the first frame that is not
+    (nearly) black, else the brightest one. Thumbnails are cached in
+    THUMB_DIR under the file's content hash, so callers must not delete them.
+    """
+    key = key or await asyncio.to_thread(content_hash, filename)
+    os.makedirs(THUMB_DIR, exist_ok=True)
+    dest = os.path.join(THUMB_DIR, f"{key}.jpg")
+    try:
+        # Touch it on a hit, so pruning evicts the least recently used.
+        os.utime(dest)
+        metrics.CACHE.inc(cache="thumbnail", result="hit")
+        return dest
+    except FileNotFoundError:
+        metrics.CACHE.inc(cache="thumbnail", result="miss")
+
+    info = info or await probe(filename)
+    offsets = [info.duration * x for x in THUMB_OFFSETS] if info.duration > 2 else [0]
+    best, best_luma = None, -1.0
+    start = time.perf_counter()
+    for i, offset in enumerate(offsets):
+        candidate = f"{dest}.{i}.jpg"
+        try:
+            luma = await _grab_frame(filename, offset, candidate)
+        except ProcessError as e:
+            logging.error(f"Thumbnail generation failed: {e}")
+            continue
+        if not os.path.exists(candidate):
+            continue
+        if luma > best_luma:
+            if best:
+                os.remove(best)
+            best, best_luma = candidate, luma
+        else:
+            os.remove(candidate)
+        if luma >= THUMB_BLACK_LEVEL:
+            break
+    if best is None:
+        metrics.STAGE_FAILURES.inc(stage="thumbnail", host="")
+        return None
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage="thumbnail", host="")
+    os.replace(best, dest)
+    _prune_thumbs()
+    return dest
+
+
+def _prune_thumbs():
+    # Only finished thumbnails; "<key>.jpg.<i>.jpg" candidates are still being made.
+    files = [os.path.join(THUMB_DIR, f) for f in os.listdir(THUMB_DIR) if f.count(".") == 1]
+    files.sort(key=os.path.getmtime)
+    for path in files[:-THUMB_CACHE_SIZE]:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+# ---------------------------------------------------------------------------
+# Faststart: `moov` goes in front of `mdat` so Telegram clients can start
+# playback without fetching the tail first. The usual layout (... mdat moov)
+# is rewritten in place: the chunk offsets in moov are patched and mdat is
+# shifted up by the moov size inside the same file, so no second full-size
+# copy is written. Other layouts are remuxed with ffmpeg.
+# ---------------------------------------------------------------------------
+MOOV_CONTAINERS = (b"moov", b"trak", b"mdia", b"minf", b"stbl")
+SHIFT_CHUNK = 8 * 1024 * 1024
+
+
+def _top_boxes(fd, size):
+    """[(type, offset, size)] of the top-level boxes; None if they don't tile the file."""
+    boxes = []
+    offset = 0
+    while offset < size:
+        head = os.pread(fd, 16, offset)
+        if len(head) < 8:
+            return None
+        box_size, box = struct.unpack(">I4s", head[:8])
+        if box_size == 1:
+            box_size = struct.unpack(">Q", head[8:16])[0]
+        elif box_size == 0:
+            box_size = size - offset
+        if box_size < 8 or offset + box_size > size:
+            return None
+        boxes.append((box, offset, box_size))
+        offset += box_size
+    return boxes
+
+
+def _patch_offsets(buf, start, end, delta):
+    """Add `delta` to every stco/co64 entry under buf[start:end], in place."""
+    offset = start
+    while offset + 8 <= end:
+        box_size, box = struct.unpack_from(">I4s", buf, offset)
+        header = 8
+        if box_size == 1:
+            box_size = struct.unpack_from(">Q", buf, offset + 8)[0]
+            header = 16
+        elif box_size == 0:
+            box_size = end - offset
+        if box_size < header:
+            raise ValueError("corrupt moov")
+        if box in MOOV_CONTAINERS:
+            _patch_offsets(buf, offset + header, offset + box_size, delta)
+        elif box in (b"stco", b"co64"):
+            count = struct.unpack_from(">I", buf, offset + header + 4)[0]
+            fmt, width = (">I", 4) if box == b"stco" else (">Q", 8)
+            pos = offset + header + 8
+            for _ in range(count):
+                value = struct.unpack_from(fmt, buf, pos)[0] + delta
+                if box == b"stco" and value > 0xFFFFFFFF:
+                    raise OverflowError("stco offset needs co64")
+                struct.pack_into(fmt, buf, pos, value)
+                pos += width
+        offset += box_size
+
+
+def _faststart_in_place(filename):
+    """Move moov in front of mdat inside the file; False when the layout needs ffmpeg."""
+    fd = os.open(filename, os.O_RDWR)
+    try:
+        size = os.fstat(fd).st_size
+        boxes = _top_boxes(fd, size)
+        if not boxes:
+            return False
+        types = [box for box, _, _ in boxes]
+        if types.count(b"moov") != 1 or b"mdat" not in types:
+            return False
+        moov_at = types.index(b"moov")
+        first_mdat = types.index(b"mdat")
+        if moov_at < first_mdat or b"mdat" in types[moov_at:]:
+            return False
+        _, data_start, _ = boxes[first_mdat]
+        _, moov_start, moov_size = boxes[moov_at]
+
+        moov = bytearray(os.pread(fd, moov_size, moov_start))
+        try:
+            _patch_offsets(moov, 0, len(moov), moov_size)
+        except (OverflowError, ValueError, struct.error):
+            return False
+
+        # Shift [data_start, moov_start) up by moov_size, last chunk first.
+        pos = moov_start
+        while pos > data_start:
+            n = min(SHIFT_CHUNK, pos - data_start)
+            pos -= n
+            os.pwrite(fd, os.pread(fd, n, pos), pos + moov_size)
+        os.pwrite(fd, bytes(moov), data_start)
+        os.fsync(fd)
+        return True
+    finally:
+        os.close(fd)
+
+
+async def faststart(filename, info=None):
+    """
+    Make an MP4 start streaming before it is fully fetched.
+
+    Skipped when the probe says moov already comes first, the file is
+    fragmented (fMP4 plays from the start anyway) or it isn't an MP4.
+
+    Returns:
+        True when the file was rewritten.
+    """
+    info = info or await probe(filename)
+    if info.faststart is not False or info.fragmented:
+        return False
+    with metrics.stage("faststart"):
+        # Renamed while it is being rewritten: a crash can't leave a
+        # half-shifted file that looks like a finished download.
+        work = f"{filename}.faststart"
+        os.replace(filename, work)
+        try:
+            done = await asyncio.to_thread(_faststart_in_place, work)
+        except BaseException:
+            # Possibly half shifted: only a new download can fix it.
+            os.remove(work)
+            raise
+        tmp = f"{filename}.remux.mp4"
+        try:
+            if not done:
+                await execute(["ffmpeg", "-v", "error", "-y", "-i", work, "-map", "0:v?", "-map", "0:a?",
+                               "-c", "copy", "-movflags", "+faststart", tmp],
+                              kind="cpu", timeout=FFMPEG_TIMEOUT)
+                os.replace(tmp, work)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            os.replace(work, filename)
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Splitting: videos over Telegram's upload limit are cut at keyframes with
+# stream copy. Cut points come from the packet sizes ffprobe reports, so each
+# part lands under the limit in one pass, without re-encoding or trial cuts.
+# ---------------------------------------------------------------------------
+# Share of each part kept free for the MP4 headers the cut adds.
+SPLIT_MARGIN = 0.05
+
+
+async def keyframe_offsets(filename):
+    """
+    Return ([(seconds, bytes before it)] for every video keyframe, total bytes).
+
+    Byte counts cover every stream's packets in file order, so two entries
+    bound the payload of the part between them.
+    """
+    result = await execute(["ffprobe", "-v", "error", "-show_entries",
+                            "stream=index,codec_type:packet=stream_index,pts_time,size,flags",
+                            "-of", "compact", filename], kind="cpu", timeout=FFMPEG_TIMEOUT)
+    # Hours of video are hundreds of thousands of lines: parse off the loop.
+    return await asyncio.to_thread(_keyframe_offsets, result.stdout)
+
+
+def _keyframe_offsets(output):
+    streams, packets = [], []
+    for line in output.splitlines():
+        fields = dict(x.split("=", 1) for x in line.split("|")[1:] if "=" in x)
+        if line.startswith("packet|"):
+            packets.append(fields)
+        elif line.startswith("stream|"):
+            streams.append(fields)
+    # ffprobe lists the streams after the packets.
+    video = next((x.get("index") for x in streams if x.get("codec_type") == "video"), None)
+    total = 0
+    offsets = []
+    for fields in packets:
+        if fields.get("stream_index") == video and "K" in fields.get("flags", ""):
             try:
-                if "RESOLUTION" not in i[2] and i[2] not in temp and "audio" not in i[2]:
-                    temp.append(i[2])
-                    new_info.append((i[0], i[2]))
-            except:
+                offsets.append((float(fields["pts_time"]), total))
+            except (KeyError, ValueError):
                 pass
-    return new_info
-
-
-def vid_info(info):
-    info = info.strip()
-    info = info.split("\n")
-    new_info = dict()
-    temp = []
-    for i in info:
-        i = str(i)
-        if "[" not in i and '---' not in i:
-            while "  " in i:
-                i = i.replace("  ", " ")
-            i.strip()
-            i = i.split("|")[0].split(" ",3)
+        total += int(fields.get("size") or 0)
+    return offsets, total
+
+
+def plan_split(offsets, total, limit, margin=SPLIT_MARGIN):
+    """
+    Greedy cut points: each part runs to the last keyframe that keeps its
+    packets under `limit * (1 - margin)` bytes.
+
+    Returns:
+        [(start, end)] in seconds; the last end is None (end of file). A
+        single GOP bigger than the budget still becomes its own part.
+    """
+    budget = limit * (1 - margin)
+    parts = []
+    start, start_bytes = 0.0, 0
+    fits = None
+    for point, nbytes in offsets + [(None, total)]:
+        while nbytes - start_bytes > budget and (fits or point is not None):
+            cut_at, cut_bytes = fits or (point, nbytes)
+            parts.append((start, cut_at))
+            start, start_bytes = cut_at, cut_bytes
+            fits = None
+        if point is not None and point > start:
+            fits = (point, nbytes)
+    parts.append((start, None))
+    return parts
+
+
+async def cut(filename, start, end, dest):
+    """Copy [start, end) seconds of `filename` to `dest` (keyframe-aligned start)."""
+    cmd = ["ffmpeg", "-v", "error", "-y", "-ss", f"{start:.6f}", "-i", filename]
+    if end is not None:
+        cmd += ["-t", f"{end - start:.6f}"]
+    cmd += ["-map", "0:v?", "-map", "0:a?", "-c", "copy", "-avoid_negative_ts", "make_zero",
+            "-movflags", "+faststart", dest]
+    with metrics.stage("split"):
+        await execute(cmd, kind="cpu", timeout=FFMPEG_TIMEOUT)
+    return dest
+
+
+async def duration(filename):
+    return (await probe(filename)).duration
+
+
+async def pull_run(work, cmds, kind="io"):
+    """Run `cmds` through the executor, at most `work` at a time."""
+    sem = asyncio.Semaphore(work)
+
+    async def one(cmd):
+        async with sem:
+            return await run(cmd, kind)
+
+    logging.info("Waiting for tasks to complete")
+    return await asyncio.gather(*(one(cmd) for cmd in cmds))
+
+
+# ---------------------------------------------------------------------------
+# One pooled HTTP client for the whole process: link resolution, drive/PDF
+# downloads and API calls all reuse its keep-alive connections and DNS cache
+# instead of paying a fresh TLS handshake per link.
+# ---------------------------------------------------------------------------
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+_http_session = None
+
+
+def http_session():
+    """Return the shared aiohttp session, creating it on first use."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_SIZE,
+            limit_per_host=HTTP_PER_HOST,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        _http_session = aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT)
+    return _http_session
+
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+# ---------------------------------------------------------------------------
+# Streaming downloads: bodies go to `<file>.part` in fixed-size chunks, so
+# memory stays flat whatever the file size. A failed transfer resumes with
+# an HTTP Range request, and the result is checked against Content-Length
+# and any MD5 the server advertises before it is renamed into place.
+# ---------------------------------------------------------------------------
+CHUNK_SIZE = 1024 * 1024
+
+# aiohttp inflates gzip/deflate bodies on the fly, which would break the
+# Content-Length, MD5 and byte-range arithmetic: ask for the raw bytes.
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
+class DownloadError(Exception):
+    """An HTTP download failed; `retryable` says whether to try again."""
+
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+def _advertised_md5(headers):
+    """Return the body MD5 (raw bytes) from Content-MD5 or x-goog-hash, if any."""
+    values = [headers.get("Content-MD5", "")]
+    values += [v.strip()[4:] for h in headers.getall("x-goog-hash", [])
+               for v in h.split(",") if v.strip().startswith("md5=")]
+    for value in values:
+        if value:
             try:
-                if "RESOLUTION" not in i[2] and i[2] not in temp and "audio" not in i[2]:
-                    temp.append(i[2])
-                    
-                    # temp.update(f'{i[2]}')
-                    # new_info.append((i[2], i[0]))
-                    #  mp4,mkv etc ==== f"({i[1]})" 
-                    
-                    new_info.update({f'{i[2]}':f'{i[0]}'})
-
-            except:
+                return base64.b64decode(value)
+            except ValueError:
                 pass
-    return new_info
+    return None
+
+
+async def _hash_file(path, hasher):
+    """Feed an existing file to `hasher` in CHUNK_SIZE pieces."""
+    async with aiofiles.open(path, mode='rb') as f:
+        while True:
+            chunk = await f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+
+
+async def _fetch_part(session, url, part):
+    """Download (or continue downloading) `url` into `part`."""
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = dict(IDENTITY, Range=f"bytes={offset}-") if offset else IDENTITY
+    async with session.get(url, headers=headers) as resp:
+        if resp.status == 416 and offset:
+            # Nothing left to fetch: the part file is already complete.
+            total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit() and int(total) == offset:
+                return
+            os.remove(part)
+            raise DownloadError(f"HTTP 416 for {url}", 416, retryable=True)
+        if resp.status == 206 and offset:
+            mode = 'ab'
+        elif resp.status == 200:
+            offset, mode = 0, 'wb'
+        else:
+            raise DownloadError(f"HTTP {resp.status} for {url}", resp.status,
+                                retryable=resp.status >= 500 or resp.status == 429)
+
+        expected = offset + resp.content_length if resp.content_length is not None else None
+        md5 = _advertised_md5(resp.headers)
+        hasher = hashlib.md5() if md5 else None
+        if hasher and offset:
+            await _hash_file(part, hasher)
+
+        async with aiofiles.open(part, mode=mode) as f:
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                await f.write(chunk)
+                if hasher:
+                    hasher.update(chunk)
+
+    size = os.path.getsize(part)
+    if expected is not None and size != expected:
+        raise DownloadError(f"Short read for {url}: {size} of {expected} bytes", retryable=True)
+    if hasher and hasher.digest() != md5:
+        os.remove(part)
+        raise DownloadError(f"Checksum mismatch for {url}", retryable=True)
+
+
+async def _fetch_or_raise(url, part):
+    try:
+        await _fetch_part(http_session(), url, part)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise DownloadError(f"{type(e).__name__}: {e}", retryable=True) from e
+
+
+# ---------------------------------------------------------------------------
+# Segmented downloads: a HEAD tells the size up front. Big files on servers
+# that take Range requests are fetched as DOWNLOAD_SEGMENTS ranges in
+# parallel over the shared pool, written with pwrite into a preallocated
+# `<file>.seg`. The file is retried as one unit, so it counts once against
+# the host's circuit breaker; a retry only asks for the bytes still missing.
+# Small files and everything else take the single streaming GET above.
+# ---------------------------------------------------------------------------
+SEGMENT_MIN_SIZE = SEGMENT_MIN_MB * 1024 * 1024
+
+
+async def _head(session, url):
+    """
+    HEAD `url`, following redirects.
+
+    Returns:
+        (final url, size or None, whether byte ranges are accepted, MD5 or None);
+        a refused or failed HEAD just means "unknown".
+    """
+    try:
+        async with session.head(url, headers=IDENTITY, allow_redirects=True) as resp:
+            if resp.status != 200:
+                return url, None, False, None
+            ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+            return str(resp.url), resp.content_length, ranges, _advertised_md5(resp.headers)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return url, None, False, None
+
+
+def _allocate(path, size):
+    """Create `path` at its final size up front and return an fd open on it."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError) as e:
+            # A full disk must fail now, not halfway through the writes.
+            if getattr(e, "errno", None) == errno.ENOSPC:
+                raise
+            # No fallocate here (or on this filesystem): a sparse file will do.
+            os.ftruncate(fd, size)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+async def _fetch_range(session, url, fd, span):
+    """
+    Fill bytes span[0]..span[1] of the file behind `fd`. span[0] moves
+    forward as data lands, so a retry asks only for what is missing.
+    """
+    async with session.get(url, headers=dict(IDENTITY, Range=f"bytes={span[0]}-{span[1]}")) as resp:
+        if resp.status != 206:
+            raise DownloadError(f"HTTP {resp.status} for a range of {url}", resp.status,
+                                retryable=resp.status >= 500 or resp.status == 429)
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            chunk = chunk[:span[1] + 1 - span[0]]
+            await asyncio.to_thread(_pwrite_all, fd, chunk, span[0])
+            span[0] += len(chunk)
+            if span[0] > span[1]:
+                break
+    if span[0] <= span[1]:
+        raise DownloadError(f"Short read for a range of {url}: stopped at byte {span[0]}", retryable=True)
+
+
+async def _fetch_segmented(url, path, size, host, budget=None, segments=DOWNLOAD_SEGMENTS):
+    """Download `size` bytes of `url` into `path` as `segments` parallel ranges."""
+    session = http_session()
+    step = -(-size // segments)
+    spans = [[start, min(start + step, size) - 1] for start in range(0, size, step)]
+    fd = await asyncio.to_thread(_allocate, path, size)
+
+    async def segment(span):
+        try:
+            await _fetch_range(session, url, fd, span)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DownloadError(f"{type(e).__name__}: {e}", retryable=True) from e
+
+    async def attempt():
+        tasks = [asyncio.ensure_future(segment(span)) for span in spans if span[0] <= span[1]]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Nothing may still be writing once the fd is closed (and reused).
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    try:
+        await retry.ENGINE.run(attempt, host, budget)
+    finally:
+        os.close(fd)
+
+
+async def download(url, name, ext="pdf", budget=None):
+    """
+    Download `url` to `<name>.<ext>` and return the file name.
+
+    Files of at least SEGMENT_MIN_MB from servers that accept Range
+    requests are fetched in parallel segments; the rest are streamed with
+    one GET into a `.part` file that each retry resumes. Retries go
+    through retry.ENGINE.
+
+    Raises:
+        DownloadError: on an error response or once retries are exhausted.
+        retry.CircuitOpenError: the host is failing.
+    """
+    ka = f'{name}.{ext}'
+    part = f'{ka}.part'
+    host = host_key(url)
+    if not os.path.exists(part) and DOWNLOAD_SEGMENTS > 1:
+        target, size, ranges, md5 = await _head(http_session(), url)
+        if ranges and size and size >= SEGMENT_MIN_SIZE:
+            seg = f'{ka}.seg'
+            try:
+                await _fetch_segmented(target, seg, size, host, budget)
+                if md5:
+                    hasher = hashlib.md5()
+                    await _hash_file(seg, hasher)
+                    if hasher.digest() != md5:
+                        raise DownloadError(f"Checksum mismatch for {url}", retryable=True)
+            except BaseException as e:
+                # Don't leave the preallocated file behind, whatever stopped it
+                # (an open breaker, cancellation, ...).
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(seg)
+                if not isinstance(e, DownloadError) or e.status != 200:
+                    raise
+                # Advertised ranges but answered with the whole body.
+                logging.info(f"{host} ignores Range requests, downloading {url} in one piece")
+            else:
+                os.replace(seg, ka)
+                return ka
+    await retry.ENGINE.run(lambda: _fetch_or_raise(url, part), host, budget)
+    os.replace(part, ka)
+    return ka
 
 
+async def aio(url, name):
+    return await download(url, name)
 
-async def run(cmd):
-    proc = await asyncio.create_subprocess_shell(
-        cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE)
 
-    stdout, stderr = await proc.communicate()
+async def run(cmd, kind="io", timeout=None):
+    res = await execute(cmd, kind, timeout, check=False)
 
-    print(f'[{cmd!r} exited with {proc.returncode}]')
-    if proc.returncode == 1:
+    logging.info(f'[{logs.clip(str(cmd), 300)!r} exited with {res.returncode}]')
+    if res.returncode == 1:
         return False
-    if stdout:
-        return f'[stdout]\n{stdout.decode()}'
-    if stderr:
-        return f'[stderr]\n{stderr.decode()}'
+    if res.stdout:
+        return f'[stdout]\n{res.stdout}'
+    if res.stderr:
+        return f'[stderr]\n{res.stderr}'
 
     
 
-def old_download(url, file_name, chunk_size = 1024 * 10):
-    if os.path.exists(file_name):
-        os.remove(file_name)
-    r = requests.get(url, allow_redirects=True, stream=True)
-    with open(file_name, 'wb') as fd:
-        for chunk in r.iter_content(chunk_size=chunk_size):
-            if chunk:
-                fd.write(chunk)
-    return file_name
-
-
 def human_readable_size(size, decimal_places=2):
     for unit in ['B', 'KB', 'MB', 'GB', 'TB', 'PB']:
         if size < 1024.0 or unit == 'PB':
@@ -151,74 +881,3 @@ def time_name():
     now = datetime.datetime.now()
     current_time = now.strftime("%H%M%S")
     return f"{date} {current_time}.mp4"
-
-
-async def download_video(url,cmd, name):
-    download_cmd = f'{cmd} -R 25 --fragment-retries 25 --external-downloader aria2c --downloader-args "aria2c: -x 16 -j 32"'
-    global failed_counter
-    print(download_cmd)
-    logging.info(download_cmd)
-    k = subprocess.run(download_cmd, shell=True)
-    if "visionias" in cmd and k.returncode != 0 and failed_counter <= 10:
-        failed_counter += 1
-        await asyncio.sleep(5)
-        await download_video(url, cmd, name)
-    failed_counter = 0
-    try:
-        if os.path.isfile(name):
-            return name
-        elif os.path.isfile(f"{name}.webm"):
-            return f"{name}.webm"
-        name = name.split(".")[0]
-        if os.path.isfile(f"{name}.mkv"):
-            return f"{name}.mkv"
-        elif os.path.isfile(f"{name}.mp4"):
-            return f"{name}.mp4"
-        elif os.path.isfile(f"{name}.mp4.webm"):
-            return f"{name}.mp4.webm"
-
-        return name
-    except FileNotFoundError as exc:
-        return os.path.isfile.splitext[0] + "." + "mp4"
-
-
-async def send_doc(bot: Client, m: Message,cc,ka,cc1,prog,count,name):
-    reply = await m.reply_text(f"Uploading » `{name}`")
-    time.sleep(1)
-    start_time = time.time()
-    await m.reply_document(ka,caption=cc1)
-    count+=1
-    await reply.delete (True)
-    time.sleep(1)
-    os.remove(ka)
-    time.sleep(3) 
-
-
-async def send_vid(bot: Client, m: Message,cc,filename,thumb,name,prog):
-    
-    subprocess.run(f'ffmpeg -i "{filename}" -ss 00:00:12 -vframes 1 "{filename}.jpg"', shell=True)
-    await prog.delete (True)
-    reply = await m.reply_text(f"**Uploading ...** - `{name}`")
-    try:
-        if thumb == "no":
-            thumbnail = f"{filename}.jpg"
-        else:
-            thumbnail = thumb
-    except Exception as e:
-        await m.reply_text(str(e))
-
-    dur = int(duration(filename))
-
-    start_time = time.time()
-
-    try:
-        await m.reply_video(filename,caption=cc, supports_streaming=True,height=720,width=1280,thumb=thumbnail,duration=dur, progress=progress_bar,progress_args=(reply,start_time))
-    except Exception:
-        await m.reply_document(filename,caption=cc, progress=progress_bar,progress_args=(reply,start_time))
-
-    
-    os.remove(filename)
-
-    os.remove(f"{filename}.jpg")
-    await reply.delete (True)
-    
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           LOCAL STAND-INS
+===========================================================================
+Description        : Offline replacements for everything a batch talks to,
+                     used by `bench.py e2e`: a CDN serving HLS/DASH/PDF
+                     files, N_m3u8DL-RE and yt-dlp look-alikes that fetch
+                     from it, and a Telegram client whose part uploads cost
+                     a round trip plus their share of a bandwidth-limited
+                     link.
+
+Usage:
+    python3 fakes.py serve DIR PORT [--rate BYTES_PER_SEC] [--no-ranges]
+    python3 fakes.py N_m3u8DL-RE URL --save-name NAME --save-dir DIR ...
+    python3 fakes.py yt-dlp ... -o FILE URL
+===========================================================================
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import argparse
+import urllib.request
+from types import SimpleNamespace
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+PART_SIZE = 512 * 1024
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+
+# =============================================================================
+#                           SYNTHETIC MEDIA
+# =============================================================================
+async def _encode(out_dir, seed, duration, size):
+    os.makedirs(out_dir, exist_ok=True)
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency={300 + seed * 40}:duration={duration}",
+        "-vf", f"hue=h={seed * 37 % 360}", "-c:v", "libx264", "-preset", "ultrafast", "-g", "50",
+        "-c:a", "aac", "-f", "hls", "-hls_time", "4", "-hls_playlist_type", "vod",
+        "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init.mp4",
+        "-hls_segment_filename", os.path.join(out_dir, "seg%03d.m4s"), os.path.join(out_dir, "index.m3u8"),
+    )
+    if await proc.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to generate {out_dir}")
+    segments = sorted(x for x in os.listdir(out_dir) if x.endswith(".m4s"))
+    nbytes = sum(os.path.getsize(os.path.join(out_dir, x)) for x in segments)
+    return segments, int(nbytes * 8 / duration)
+
+
+async def make_video(out_dir, seed, duration, size="640x360", dash=False):
+    """
+    Encode a test lecture as fMP4 HLS (and a DASH SegmentList over the same
+    segments when `dash` is set). `seed` shifts the picture and tone so no
+    two lectures share a content hash.
+
+    `size` may list several resolutions ("640x360,1280x720"): each is
+    encoded into its own directory and index.m3u8 / manifest.mpd become a
+    master playlist / multi-representation MPD over them.
+    """
+    sizes = size.split(",")
+    if len(sizes) == 1:
+        variants = [("", sizes[0], *await _encode(out_dir, seed, duration, sizes[0]))]
+    else:
+        encoded = await asyncio.gather(*(
+            _encode(os.path.join(out_dir, x), seed, duration, x) for x in sizes))
+        variants = [(f"{x}/", x, *enc) for x, enc in zip(sizes, encoded)]
+        with open(os.path.join(out_dir, "index.m3u8"), "w") as f:
+            f.write("#EXTM3U\n")
+            for prefix, res, _, bandwidth in variants:
+                f.write(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={res},'
+                        f'CODECS="avc1.64001f,mp4a.40.2"\n{prefix}index.m3u8\n')
+    if dash:
+        reps = []
+        for prefix, res, segments, bandwidth in variants:
+            width, height = res.split("x")
+            urls = "\n".join(f'        <SegmentURL media="{prefix}{x}"/>' for x in segments)
+            reps.append(
+                f'    <Representation id="{height}p" width="{width}" height="{height}" bandwidth="{bandwidth}">\n'
+                '      <SegmentList duration="4">\n'
+                f'        <Initialization sourceURL="{prefix}init.mp4"/>\n'
+                f'{urls}\n'
+                '      </SegmentList>\n'
+                '    </Representation>\n'
+            )
+        with open(os.path.join(out_dir, "manifest.mpd"), "w") as f:
+            f.write(
+                '<?xml version="1.0"?>\n'
+                '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" '
+                'profiles="urn:mpeg:dash:profile:isoff-live:2011">\n'
+                '  <Period><AdaptationSet mimeType="video/mp4">\n'
+                f'{"".join(reps)}'
+                '  </AdaptationSet></Period>\n'
+                '</MPD>\n'
+            )
+
+
+def make_pdf(path, size):
+    """Write `size` bytes of incompressible data behind a PDF header."""
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        f.write(os.urandom(max(0, size - 9)))
+
+
+# =============================================================================
+#                           CDN
+# =============================================================================
+async def serve(root, port, rate=0, ranges=True):
+    """
+    Serve `root` over plain HTTP on 127.0.0.1:`port`.
+
+    With `rate` (bytes/s) every response is paced to that speed, like a
+    per-connection CDN cap; without it aiohttp's FileResponse is used.
+    Both answer single Range requests unless `ranges` is off (paced
+    responses only), like a CDN that can't seek.
+    """
+    from aiohttp import web
+
+    async def handle(request):
+        path = os.path.realpath(os.path.join(root, request.match_info["path"]))
+        if not path.startswith(os.path.realpath(root)) or not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        if not rate or request.method == "HEAD":
+            return web.FileResponse(path)
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        m = re.match(r"bytes=(\d*)-(\d*)$", request.headers.get("Range", "")) if ranges else None
+        if m and (m.group(1) or m.group(2)):
+            if m.group(1):
+                start = int(m.group(1))
+                end = min(int(m.group(2) or end), end)
+            else:
+                start = max(0, size - int(m.group(2)))
+            if start > end:
+                raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{size}"})
+            resp = web.StreamResponse(status=206, headers={
+                "Content-Length": str(end - start + 1), "Content-Range": f"bytes {start}-{end}/{size}",
+                "Accept-Ranges": "bytes"})
+        else:
+            resp = web.StreamResponse(headers={"Content-Length": str(size),
+                                               "Accept-Ranges": "bytes" if ranges else "none"})
+        await resp.prepare(request)
+        chunk = 64 * 1024
+        left = end - start + 1
+        with open(path, "rb") as f:
+            f.seek(start)
+            while left > 0:
+                data = f.read(min(chunk, left))
+                if not data:
+                    break
+                left -= len(data)
+                try:
+                    await resp.write(data)
+                except ConnectionResetError:
+                    # Players drop the connection as soon as they seek.
+                    return resp
+                await asyncio.sleep(len(data) / rate)
+        await resp.write_eof()
+        return resp
+
+    app = web.Application()
+    app.router.add_get("/{path:.*}", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    await asyncio.Event().wait()
+
+
+# =============================================================================
+#                           DOWNLOADERS
+# =============================================================================
+def _get(url):
+    with urllib.request.urlopen(url, timeout=60) as resp:
+        return resp.read()
+
+
+def _pick(tracks, spec):
+    """
+    Apply an N_m3u8DL-RE `--select-*` spec ("res=1280x720:for=best") to
+    (attrs, payload) tracks; without a spec the best bandwidth wins, like
+    --auto-select.
+    """
+    rules = dict(x.split("=", 1) for x in (spec or "").split(":") if "=" in x)
+    mode = rules.pop("for", "best")
+    found = [t for t in tracks if all(re.search(v, t[0].get(k, "")) for k, v in rules.items())]
+    if not found:
+        raise SystemExit(f"no stream matches {spec}")
+    found.sort(key=lambda t: int(t[0].get("bw", 0)), reverse=True)
+    return found[0][1] if mode == "best" else found[-1][1]
+
+
+def _segments(url, select_video=None):
+    """Segment URLs (init segment first) of an HLS playlist or a SegmentList MPD."""
+    text = _get(url).decode()
+    if ".mpd" in url:
+        reps = []
+        for m in re.finditer(r"<Representation ([^>]*)>(.*?)</Representation>", text, re.S):
+            attrs = dict(re.findall(r'(\w+)="([^"]*)"', m.group(1)))
+            attrs.update(bw=attrs.get("bandwidth", "0"), res=f"{attrs.get('width')}x{attrs.get('height')}")
+            found = re.findall(r'(?:sourceURL|media)="([^"]+)"', m.group(2))
+            reps.append((attrs, [urljoin(url, x) for x in found]))
+        return _pick(reps, select_video)
+    lines = [x.strip() for x in text.splitlines() if x.strip()]
+    if any(x.startswith("#EXT-X-STREAM-INF") for x in lines):
+        variants = []
+        for i, line in enumerate(lines):
+            if line.startswith("#EXT-X-STREAM-INF"):
+                bw = re.search(r"BANDWIDTH=(\d+)", line)
+                res = re.search(r"RESOLUTION=(\d+x\d+)", line)
+                attrs = {"bw": bw.group(1) if bw else "0", "res": res.group(1) if res else ""}
+                variants.append((attrs, urljoin(url, lines[i + 1])))
+        return _segments(_pick(variants, select_video))
+    init = [m.group(1) for x in lines for m in [re.search(r'#EXT-X-MAP:URI="([^"]+)"', x)] if m]
+    return [urljoin(url, x) for x in init + [x for x in lines if not x.startswith("#")]]
+
+
+def n_m3u8dl(argv):
+    """Fetch every segment of the selected variant on `--thread-count` threads and join them."""
+    p = argparse.ArgumentParser(prog="N_m3u8DL-RE")
+    p.add_argument("url")
+    p.add_argument("--save-name", required=True)
+    p.add_argument("--save-dir", default=".")
+    p.add_argument("--thread-count", type=int, default=16)
+    p.add_argument("--select-video")
+    p.add_argument("--select-audio")
+    args, _ = p.parse_known_args(argv)
+    segments = _segments(args.url, args.select_video)
+    out = os.path.join(args.save_dir, args.save_name + ".mp4")
+    with ThreadPoolExecutor(args.thread_count) as pool, open(out + ".tmp", "wb") as f:
+        for data in pool.map(_get, segments):
+            f.write(data)
+    os.replace(out + ".tmp", out)
+
+
+def yt_dlp(argv):
+    """Download a single file to `-o`."""
+    p = argparse.ArgumentParser(prog="yt-dlp")
+    p.add_argument("url")
+    p.add_argument("-o", required=True)
+    p.add_argument("--external-downloader")
+    p.add_argument("--external-downloader-args")
+    p.add_argument("-R")
+    p.add_argument("--fragment-retries")
+    args, _ = p.parse_known_args(argv)
+    with urllib.request.urlopen(args.url, timeout=60) as resp, open(args.o, "wb") as f:
+        while True:
+            data = resp.read(1024 * 1024)
+            if not data:
+                break
+            f.write(data)
+
+
+def install_downloaders(bin_dir):
+    """
+    Write `N_m3u8DL-RE` and `yt-dlp` wrappers into `bin_dir`.
+
+    The bot runs `./N_m3u8DL-RE` from its working directory and `yt-dlp`
+    from PATH, so the caller should chdir into `bin_dir` and put it first
+    on PATH.
+    """
+    os.makedirs(bin_dir, exist_ok=True)
+    for name in ("N_m3u8DL-RE", "yt-dlp"):
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" {name} "$@"\n')
+        os.chmod(path, 0o755)
+
+
+# =============================================================================
+#                           TELEGRAM
+# =============================================================================
+class FakeSender:
+    """One extra connection opened on a FakeClient (an MTProtoSender stand-in)."""
+
+    def __init__(self, client):
+        self.client = client
+        self.busy_until = 0.0
+
+    async def disconnect(self):
+        self.client.connections -= 1
+
+
+class FakeClient:
+    """
+    Just enough of a TelegramClient for the batch runner and the uploaders.
+
+    Every API request costs `latency` seconds; part uploads additionally
+    queue for their share of one link of `bandwidth` bytes/s, and with
+    `conn_bandwidth` for their connection's own cap too, so more
+    connections hide round trips and per-connection limits but can't beat
+    the bandwidth. Extra connections come from `connect()` and are used
+    through `_call(sender, request)`, like MTProtoSenders. Files over
+    `max_file_size` are refused when sent, like Telegram's upload limit.
+    With `flood_limit`, a chat that gets more than that many posts in a
+    minute is answered with a FloodWaitError.
+    """
+
+    def __init__(self, bandwidth=20 * 1024 * 1024, latency=0.05, conn_bandwidth=None, max_file_size=None,
+                 flood_limit=None):
+        self.bandwidth = bandwidth
+        self.max_file_size = max_file_size
+        self.flood_limit = flood_limit
+        self.flood_waits = 0
+        self.latency = latency
+        self.conn_bandwidth = conn_bandwidth
+        self.bytes_uploaded = 0
+        self.requests = 0
+        self.connections = 0
+        self.peak_connections = 0
+        self.sent = []
+        self.session = SimpleNamespace(dc_id=2, auth_key=None)
+        self._busy_until = 0.0
+        self._main = FakeSender(self)
+        self._sizes = {}
+        self._next_id = 0
+        self._posts = {}
+
+    @property
+    def loop(self):
+        return asyncio.get_running_loop()
+
+    def _msg_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _post(self, chat_id):
+        """Count a post to `chat_id` against its flood limit."""
+        if not self.flood_limit:
+            return
+        from telethon.errors import FloodWaitError
+
+        now = time.monotonic()
+        posts = [t for t in self._posts.get(chat_id, []) if now - t < 60]
+        if len(posts) >= self.flood_limit:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=int(posts[0] + 60 - now) + 1)
+        self._posts[chat_id] = posts + [now]
+
+    async def _transfer(self, nbytes, conn=None):
+        conn = conn or self._main
+        now = time.monotonic()
+        start = max(now, self._busy_until)
+        self._busy_until = finish = start + nbytes / self.bandwidth
+        if self.conn_bandwidth:
+            conn.busy_until = max(now, conn.busy_until) + nbytes / self.conn_bandwidth
+            finish = max(finish, conn.busy_until)
+        self.requests += 1
+        self.bytes_uploaded += nbytes
+        await asyncio.sleep(finish - now + self.latency)
+
+    async def connect(self):
+        """Open an extra connection; costs a handshake round trip."""
+        await asyncio.sleep(2 * self.latency)
+        self.connections += 1
+        self.peak_connections = max(self.peak_connections, self.connections)
+        return FakeSender(self)
+
+    async def _call(self, sender, request):
+        """Raw API requests; only file parts are understood."""
+        data = getattr(request, "bytes", b"")
+        await self._transfer(len(data), sender)
+        file_id = getattr(request, "file_id", None)
+        if file_id is not None:
+            self._sizes[file_id] = self._sizes.get(file_id, 0) + len(data)
+        return True
+
+    async def __call__(self, request):
+        return await self._call(self._main, request)
+
+    async def upload_file(self, file, file_name=None, progress_callback=None, **kwargs):
+        from telethon.tl.types import InputFile, InputFileBig
+
+        path = file if isinstance(file, str) else file.name
+        size = os.path.getsize(path)
+        file_id = random.getrandbits(63)
+        total = (size + PART_SIZE - 1) // PART_SIZE
+        offset = 0
+        with open(path, "rb") as f:
+            while offset < size:
+                data = f.read(PART_SIZE)
+                await self._transfer(len(data), self._main)
+                offset += len(data)
+                if progress_callback:
+                    progress_callback(offset, size)
+        self._sizes[file_id] = size
+        name = file_name or os.path.basename(path)
+        if size >= BIG_FILE_SIZE:
+            return InputFileBig(file_id, total, name)
+        return InputFile(file_id, total, name, "")
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        self._post(chat_id)
+        return SimpleNamespace(id=self._msg_id(), chat_id=chat_id, text=text)
+
+    async def edit_message(self, chat_id, message_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(id=message_id, chat_id=chat_id, text=text)
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        await asyncio.sleep(self.latency)
+
+    async def send_file(self, chat_id, file, caption=None, **kwargs):
+        if isinstance(file, list):
+            # An album: one UploadMedia round trip per file, then one post.
+            await asyncio.sleep(self.latency * len(file))
+            self._post(chat_id)
+            return [self._document(chat_id, f, c) for f, c in zip(file, caption or [None] * len(file))]
+        if isinstance(file, str):
+            file = await self.upload_file(file)
+        # Uploaded files and re-sent documents are both looked up by id.
+        await asyncio.sleep(self.latency)
+        self._post(chat_id)
+        return self._document(chat_id, file, caption)
+
+    def _document(self, chat_id, file, caption):
+        size = self._sizes.get(file.id, 0)
+        if self.max_file_size and size > self.max_file_size:
+            raise ValueError(f"FILE_PARTS_INVALID: {size} bytes is over the {self.max_file_size} byte limit")
+        doc_id = random.getrandbits(63)
+        self._sizes[doc_id] = size
+        document = SimpleNamespace(id=doc_id, access_hash=random.getrandbits(63),
+                                   file_reference=os.urandom(8), size=size)
+        msg = SimpleNamespace(id=self._msg_id(), chat_id=chat_id, text=caption, document=document)
+        self.sent.append(msg)
+        return msg
+
+
+async def fake_upload(client, file, progress_callback=None):
+    """Stand-in for fast_upload: a single-connection upload through `client`."""
+    return await client.upload_file(file, progress_callback=progress_callback)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "N_m3u8DL-RE":
+        return n_m3u8dl(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "yt-dlp":
+        return yt_dlp(sys.argv[2:])
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("serve", help="serve a directory as the fake CDN")
+    p.add_argument("root")
+    p.add_argument("port", type=int)
+    p.add_argument("--rate", type=float, default=0)
+    p.add_argument("--no-ranges", action="store_true", help="ignore Range requests (needs --rate)")
+    args = parser.parse_args()
+    asyncio.run(serve(args.root, args.port, args.rate, not args.no_ranges))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           BATCH JOURNAL
+===========================================================================
+Description        : Crash-safe SQLite record of every /upload batch and the
+                     state of each of its links (pending, resolved,
+                     downloaded, uploaded, failed). /stop, redeploys and
+                     crashes resume from here instead of starting over. In
+                     distributed mode it is also the task queue the worker
+                     processes lease links from.
+===========================================================================
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import contextlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from vars import JOURNAL_PATH, MEDIA_CACHE_MAX_ENTRIES, MEDIA_CACHE_MAX_AGE_DAYS
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id   INTEGER NOT NULL,
+    settings  TEXT NOT NULL,
+    state     TEXT NOT NULL DEFAULT 'running',
+    created   REAL NOT NULL,
+    updated   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+    job_id     INTEGER NOT NULL,
+    idx        INTEGER NOT NULL,
+    name       TEXT NOT NULL,
+    url        TEXT NOT NULL,
+    file_name  TEXT NOT NULL,
+    state      TEXT NOT NULL DEFAULT 'pending',
+    resolved   TEXT,
+    result     TEXT,
+    message_id INTEGER,
+    error      TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS media (
+    key            TEXT PRIMARY KEY,
+    kind           TEXT NOT NULL,
+    doc_id         INTEGER NOT NULL,
+    access_hash    INTEGER NOT NULL,
+    file_reference BLOB NOT NULL,
+    size           INTEGER NOT NULL,
+    created        REAL NOT NULL,
+    last_used      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS media_doc ON media (doc_id);
+CREATE TABLE IF NOT EXISTS media_stats (
+    id          INTEGER PRIMARY KEY CHECK (id = 1),
+    hits        INTEGER NOT NULL DEFAULT 0,
+    misses      INTEGER NOT NULL DEFAULT 0,
+    bytes_saved INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO media_stats (id) VALUES (1);
+CREATE TABLE IF NOT EXISTS leases (
+    job_id   INTEGER NOT NULL,
+    idx      INTEGER NOT NULL,
+    worker   TEXT NOT NULL,
+    expires  REAL NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS workers (
+    id       TEXT PRIMARY KEY,
+    started  REAL NOT NULL,
+    seen     REAL NOT NULL
+);
+"""
+
+# Link states, in the order a link moves through them.
+PENDING, RESOLVED, DOWNLOADED, UPLOADED, FAILED = (
+    "pending", "resolved", "downloaded", "uploaded", "failed")
+
+
+@contextlib.contextmanager
+def transaction(db):
+    """
+    Run the block as one write transaction. The connection is in autocommit
+    mode (isolation_level=None), where `with db:` opens none, so without
+    this every statement would commit on its own.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+def connect(path):
+    """Open the journal database in autocommit mode (see transaction())."""
+    db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class Journal:
+    """Thin wrapper around the journal database; every write is committed."""
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.db = connect(path)
+        self.db.executescript(SCHEMA)
+
+    # -- jobs ---------------------------------------------------------------
+    def create_job(self, chat_id, settings, items):
+        """Record a new batch and its links; returns the job id."""
+        now = time.time()
+        with transaction(self.db):
+            cur = self.db.execute(
+                "INSERT INTO jobs (chat_id, settings, created, updated) VALUES (?, ?, ?, ?)",
+                (chat_id, json.dumps(settings), now, now))
+            job_id = cur.lastrowid
+            self.db.executemany(
+                "INSERT INTO links (job_id, idx, name, url, file_name) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, x["index"], x["name"], x["url"], x["file_name"]) for x in items])
+        return job_id
+
+    def job(self, job_id):
+        row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["settings"] = json.loads(job["settings"])
+        return job
+
+    def jobs(self, state, chat_id=None):
+        """Return the ids of jobs in `state`, optionally for one chat."""
+        if chat_id is None:
+            rows = self.db.execute("SELECT id FROM jobs WHERE state = ? ORDER BY id", (state,))
+        else:
+            rows = self.db.execute(
+                "SELECT id FROM jobs WHERE state = ? AND chat_id = ? ORDER BY id", (state, chat_id))
+        return [row["id"] for row in rows]
+
+    def set_job_state(self, job_id, state):
+        self.db.execute("UPDATE jobs SET state = ?, updated = ? WHERE id = ?",
+                        (state, time.time(), job_id))
+
+    def pause_chat(self, chat_id):
+        """Mark a chat's running jobs as paused (used by /stop)."""
+        self.db.execute("UPDATE jobs SET state = 'paused', updated = ? WHERE chat_id = ? AND state = 'running'",
+                        (time.time(), chat_id))
+
+    # -- links --------------------------------------------------------------
+    def items(self, job_id, states=None):
+        """Return the job's links as pipeline items, in link order."""
+        rows = self.db.execute("SELECT * FROM links WHERE job_id = ? ORDER BY idx", (job_id,))
+        items = []
+        for row in rows:
+            if states and row["state"] not in states:
+                continue
+            items.append({
+                "index": row["idx"],
+                "name": row["name"],
+                "url": row["url"],
+                "file_name": row["file_name"],
+                "state": row["state"],
+                "result": json.loads(row["result"]) if row["result"] else None,
+            })
+        return items
+
+    def mark(self, job_id, idx, state, **fields):
+        """Move a link to `state`, storing `resolved`, `result`, `message_id` or `error`."""
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"])
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        sql = f"UPDATE links SET state = ?{', ' + columns if columns else ''} WHERE job_id = ? AND idx = ?"
+        self.db.execute(sql, (state, *fields.values(), job_id, idx))
+
+    def counts(self, job_id):
+        rows = self.db.execute("SELECT state, COUNT(*) AS n FROM links WHERE job_id = ? GROUP BY state", (job_id,))
+        return {row["state"]: row["n"] for row in rows}
+
+
+# Query parameters that change between otherwise identical links (signatures,
+# tokens, expiry stamps) and must not split the dedup cache.
+VOLATILE_PARAMS = {
+    "token", "expires", "exp", "signature", "sig", "policy", "key-pair-id",
+    "hdnts", "hdntl", "__token__", "auth", "e", "st",
+}
+
+
+def normalize_url(url):
+    """Canonical form of a source link for the dedup cache."""
+    parts = urlsplit(url.strip())
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k.lower() not in VOLATILE_PARAMS and not k.lower().startswith("x-amz-"))
+    return urlunsplit(("https", parts.netloc.lower(), parts.path.rstrip("/"), urlencode(query), ""))
+
+
+class MediaCache:
+    """
+    Maps source links and content hashes to media Telegram already has.
+
+    Keys are "url:<normalized link>" or "hash:<content hash>"; both point at
+    the same document reference so a repeat link is re-sent by reference
+    with no download and no upload.
+    """
+
+    def __init__(self, journal, max_entries=MEDIA_CACHE_MAX_ENTRIES, max_age_days=MEDIA_CACHE_MAX_AGE_DAYS):
+        self.db = journal.db
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+
+    def lookup(self, *keys):
+        """Return the cached reference for the first matching key, or None."""
+        for key in keys:
+            if not key:
+                continue
+            row = self.db.execute("SELECT * FROM media WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                continue
+            if row["created"] < time.time() - self.max_age:
+                self.invalidate(row["doc_id"])
+                continue
+            self.db.execute("UPDATE media SET last_used = ? WHERE key = ?", (time.time(), key))
+            return dict(row)
+        return None
+
+    def store(self, keys, kind, document):
+        """Remember a sent Telethon `Document` under every key in `keys`."""
+        now = time.time()
+        with transaction(self.db):
+            self.db.executemany(
+                "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(key, kind, document.id, document.access_hash, bytes(document.file_reference),
+                  document.size, now, now) for key in keys if key])
+        self.prune()
+
+    def invalidate(self, doc_id):
+        """Forget a document, e.g. after Telegram rejected its file reference."""
+        self.db.execute("DELETE FROM media WHERE doc_id = ?", (doc_id,))
+
+    def prune(self):
+        """Apply the age and size caps."""
+        self.db.execute("DELETE FROM media WHERE created < ?", (time.time() - self.max_age,))
+        self.db.execute(
+            "DELETE FROM media WHERE key NOT IN (SELECT key FROM media ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,))
+
+    def record(self, hit, size=0):
+        if hit:
+            self.db.execute("UPDATE media_stats SET hits = hits + 1, bytes_saved = bytes_saved + ? WHERE id = 1",
+                            (size,))
+        else:
+            self.db.execute("UPDATE media_stats SET misses = misses + 1 WHERE id = 1")
+
+    def stats(self):
+        row = dict(self.db.execute("SELECT hits, misses, bytes_saved FROM media_stats WHERE id = 1").fetchone())
+        row["entries"] = self.db.execute("SELECT COUNT(DISTINCT doc_id) FROM media").fetchone()[0]
+        return row
+
+
+class TaskQueue:
+    """
+    The journal's open links as a work queue shared by worker processes.
+
+    A worker leases one link at a time and keeps its leases alive with
+    `heartbeat`; a lease that is not renewed within `ttl` seconds (the
+    worker died or hung) makes the link available to the others again.
+    Links are only leased up to `window` places past the job's first
+    unposted link, so workers never run far ahead of the ordered posting.
+    """
+
+    def __init__(self, journal, worker, ttl=60, window=8):
+        # A connection of its own: workers call the queue from a thread, and
+        # its transactions must not take in the event loop's journal writes.
+        self.db = connect(journal.path)
+        self.worker = worker
+        self.ttl = ttl
+        self.window = window
+
+    def lease(self):
+        """Lease the next open link of any running job; returns (job_id, idx) or None."""
+        now = time.time()
+        with transaction(self.db):
+            # Jobs with the fewest live leases first, so workers spread out.
+            row = self.db.execute(
+                """
+                SELECT l.job_id, l.idx FROM links l
+                JOIN jobs j ON j.id = l.job_id
+                LEFT JOIN leases s ON s.job_id = l.job_id AND s.idx = l.idx
+                WHERE j.state = 'running' AND l.state IN (?, ?, ?)
+                  AND (s.expires IS NULL OR s.expires < ?)
+                  AND l.idx < ? + (SELECT MIN(idx) FROM links
+                                   WHERE job_id = l.job_id AND state NOT IN (?, ?))
+                ORDER BY (SELECT COUNT(*) FROM leases WHERE job_id = l.job_id AND expires >= ?),
+                         l.job_id, l.idx
+                LIMIT 1
+                """,
+                (PENDING, RESOLVED, DOWNLOADED, now, self.window, UPLOADED, FAILED, now)).fetchone()
+            if row is not None:
+                self.db.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?, ?)",
+                                (row["job_id"], row["idx"], self.worker, now + self.ttl))
+        return (row["job_id"], row["idx"]) if row is not None else None
+
+    def heartbeat(self):
+        """
+        Renew this worker's leases and return the (job_id, idx) pairs it
+        still holds. Leases on jobs that stopped running are dropped.
+        """
+        now = time.time()
+        with transaction(self.db):
+            self.db.execute("INSERT OR REPLACE INTO workers VALUES (?, COALESCE("
+                            "(SELECT started FROM workers WHERE id = ?), ?), ?)",
+                            (self.worker, self.worker, now, now))
+            self.db.execute("DELETE FROM leases WHERE worker = ? AND job_id IN "
+                            "(SELECT id FROM jobs WHERE state != 'running')", (self.worker,))
+            self.db.execute("UPDATE leases SET expires = ? WHERE worker = ?", (now + self.ttl, self.worker))
+        rows = self.db.execute("SELECT job_id, idx FROM leases WHERE worker = ?", (self.worker,))
+        return {(row["job_id"], row["idx"]) for row in rows}
+
+    def release(self, job_id, idx):
+        self.db.execute("DELETE FROM leases WHERE job_id = ? AND idx = ? AND worker = ?",
+                        (job_id, idx, self.worker))
+
+    def turn(self, job_id, idx):
+        """True once every earlier link of the job has been posted or failed."""
+        row = self.db.execute("SELECT COUNT(*) FROM links WHERE job_id = ? AND idx < ? AND state NOT IN (?, ?)",
+                              (job_id, idx, UPLOADED, FAILED)).fetchone()
+        return row[0] == 0
+
+    def remaining(self, job_id):
+        """Links of the job not yet posted or failed."""
+        row = self.db.execute("SELECT COUNT(*) FROM links WHERE job_id = ? AND state NOT IN (?, ?)",
+                              (job_id, UPLOADED, FAILED)).fetchone()
+        return row[0]
+
+    def live_workers(self):
+        """Workers that sent a heartbeat within the lease TTL."""
+        row = self.db.execute("SELECT COUNT(*) FROM workers WHERE seen >= ?", (time.time() - self.ttl,)).fetchone()
+        return row[0]
+
+
+def _on_disk(entry):
+    path = entry.get("path")
+    return bool(path) and os.path.exists(path) and os.path.getsize(path) == entry.get("size")
+
+
+def reusable(result):
+    """
+    True when a journalled download result still has its file on disk: the
+    download itself, or every part it was split into.
+    """
+    if not result:
+        return False
+    parts = result.get("parts")
+    if parts and all(_on_disk(p) for p in parts):
+        return True
+    return _on_disk(result)
@@ -2,20 +2,163 @@
 # Subscribe YouTube Channel For Amazing Bot https://youtube.com/@Tech_VJ
 # Ask Doubt on telegram @KingVJ01
 
+import json
+import time
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
-
-logging.basicConfig(
-    level=logging.ERROR,
-    format=
-    "%(asctime)s - %(levelname)s - %(message)s [%(filename)s:%(lineno)d]",
-    datefmt="%d-%b-%y %H:%M:%S",
-    handlers=[
-        RotatingFileHandler("logs.txt", maxBytes=50000000, backupCount=10),
-        logging.StreamHandler(),
-    ],
-)
-logging.getLogger("pyrogram").setLevel(logging.WARNING)
-
-
-logging = logging.getLogger()
+import contextlib
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from vars import LOG_LEVEL, LOG_FILE, LOG_JSON_FILE, LOG_QUEUE_SIZE, LOG_OUTPUT_CHARS
+
+# ---------------------------------------------------------------------------
+# Non-blocking logging: every logger feeds a bounded queue and one listener
+# thread does the formatting, file writes and rotation, so the event loop
+# never waits on disk. When the writer falls behind, new records are
+# dropped (and counted) instead of stalling the loop.
+#
+# Records carry the job id and link index of the batch link being worked
+# on (see `link`); `event` records (stage, bytes, duration, ...) only go to
+# the JSON-lines log.
+# ---------------------------------------------------------------------------
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s%(where)s [%(filename)s:%(lineno)d]"
+DATE_FORMAT = "%d-%b-%y %H:%M:%S"
+
+_job = contextvars.ContextVar("log_job", default=None)
+_link = contextvars.ContextVar("log_link", default=None)
+_listener = None
+
+# Records dropped because the queue was full.
+dropped = 0
+
+
+@contextlib.contextmanager
+def link(job_id, index=None):
+    """Tag every record logged inside the block (and tasks started there)."""
+    job_token, link_token = _job.set(job_id), _link.set(index)
+    try:
+        yield
+    finally:
+        _job.reset(job_token)
+        _link.reset(link_token)
+
+
+def event(logger, message, level=logging.INFO, **fields):
+    """Log a structured record, e.g. event(log, "fetched", stage="fetch", bytes=n, duration=s)."""
+    logger.log(level, message, extra={"fields": fields})
+
+
+def clip(text, limit=LOG_OUTPUT_CHARS):
+    """Keep the head and tail of long tool output for a log line."""
+    text = text.strip()
+    if limit <= 0 or len(text) <= limit:
+        return text
+    half = limit // 2
+    return f"{text[:half]}\n... {len(text) - 2 * half} characters skipped ...\n{text[-half:]}"
+
+
+class _Context(logging.Filter):
+    """Stamp records with the job/link of the logging task (runs on the caller's thread)."""
+
+    def filter(self, record):
+        record.job = _job.get()
+        record.link = _link.get()
+        if record.job is None:
+            record.where = ""
+        elif record.link is None:
+            record.where = f" [job {record.job}]"
+        else:
+            record.where = f" [job {record.job} #{record.link}]"
+        return True
+
+
+class _Plain(logging.Filter):
+    """Keep structured events out of the text log."""
+
+    def filter(self, record):
+        return not hasattr(record, "fields")
+
+
+class _DroppingQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, job, link and event fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "job", None) is not None:
+            entry["job"] = record.job
+        if getattr(record, "link", None) is not None:
+            entry["link"] = record.link
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup(level=LOG_LEVEL, path=LOG_FILE, json_path=LOG_JSON_FILE, queue_size=LOG_QUEUE_SIZE, console=True):
+    """
+    Route all logging through the queue; safe to call more than once.
+
+    Args:
+        level (str or int): Root logger level.
+        path (str): Rotating text log (50 MB x 10).
+        json_path (str): Rotating JSON-lines log; "" or None for none.
+        queue_size (int): Records buffered for the writer thread.
+        console (bool): Echo the text log to stderr too.
+
+    Returns:
+        QueueListener: the running listener (shut down at exit).
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    text = logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+    handlers = [RotatingFileHandler(path, maxBytes=50000000, backupCount=10)]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(text)
+        handler.addFilter(_Plain())
+    if json_path:
+        handler = RotatingFileHandler(json_path, maxBytes=50000000, backupCount=10)
+        handler.setFormatter(JsonFormatter())
+        handlers.append(handler)
+
+    records = queue.Queue(queue_size)
+    feeder = _DroppingQueueHandler(records)
+    feeder.addFilter(_Context())
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(feeder)
+    root.setLevel(level)
+    # Telethon's DEBUG output is per network packet.
+    logging.getLogger("telethon").setLevel(max(root.level, logging.INFO))
+
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+    return _listener
+
+
+def shutdown():
+    """Write out whatever is still queued and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
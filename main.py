@@ -13,48 +13,55 @@ Description        : This bot downloads links from a .TXT file and uploads
 """
 
 import os
-import re
 import sys
-import time
-import random
 import asyncio
-import requests
-import subprocess
 import logging
 from telethon import TelegramClient, events
-import aiohttp
-from moviepy.editor import VideoFileClip  # To extract video metadata
-from telethon.tl.types import DocumentAttributeVideo  # For video attributes
 
 # ---------------------------------------------------------------------------
 # Import configuration variables from vars module
 # ---------------------------------------------------------------------------
-from vars import API_ID, API_HASH, BOT_TOKEN
+from vars import (
+    API_ID, API_HASH, BOT_TOKEN, HOST_LIMITS, DEFAULT_HOST_LIMIT, METRICS_FILE, METRICS_INTERVAL,
+    DISTRIBUTED, LEASE_TTL, DISPATCH_WINDOW,
+)
 
 # ---------------------------------------------------------------------------
 # Import custom helper functions for downloading operations
 # ---------------------------------------------------------------------------
-import core as helper  # Assumes helper.download_video() and helper.download() exist
+import core as helper
+import logs
+import journal
+import metrics
+from batch import BatchRunner, build_items
+from scheduler import Scheduler
+from progress import ProgressHub
+from pipeline import HostLimiter, parse_host_limits
 
-# ---------------------------------------------------------------------------
-# Import external fast_upload function from devgagantools library
-# Attempt to import fast_upload; if not found, fallback to upload_file as fast_upload
-# ---------------------------------------------------------------------------
-try:
-    from devgagantools.spylib import fast_upload
-except ImportError:
-    from devgagantools.spylib import upload_file as fast_upload
-
-# ---------------------------------------------------------------------------
-# Set up logging configuration
-# ---------------------------------------------------------------------------
-logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("telethon")
 
 # ---------------------------------------------------------------------------
-# Initialize the Telethon client
+# The Telethon client, the batch journal and everything bound to them are
+# built in main(), so importing this module opens no session or database.
 # ---------------------------------------------------------------------------
-bot = TelegramClient("bot", API_ID, API_HASH).start(bot_token=BOT_TOKEN)
+bot = None
+JOURNAL = None
+MEDIA = None
+RUNNER = None
+QUEUE = None
+
+# Fair scheduling of jobs, downloads and uploads across users.
+SCHEDULER = Scheduler()
+
+# Per-CDN download caps, shared by every batch in this process.
+HOST_LIMITER = HostLimiter(parse_host_limits(HOST_LIMITS), DEFAULT_HOST_LIMIT)
+
+# Scheduler occupancy, read whenever a metrics snapshot is written.
+QUEUES = {"jobs": SCHEDULER.jobs, "downloads": SCHEDULER.downloads, "uploads": SCHEDULER.uploads}
+metrics.gauge("leech_slots_active", "Scheduler slots in use (jobs = active batches).", ("queue",),
+              fn=lambda: {(name,): q.active for name, q in QUEUES.items()})
+metrics.gauge("leech_queue_waiting", "Requests waiting for a scheduler slot.", ("queue",),
+              fn=lambda: {(name,): q.waiting() for name, q in QUEUES.items()})
 
 # =============================================================================
 #                           HELPER FUNCTIONS
@@ -76,43 +83,11 @@ def human_readable(size, decimal_places=2):
         size /= 1024
     return f"{size:.{decimal_places}f}PB"
 
-def format_eta(seconds):
-    """Format seconds as HH:MM:SS."""
-    return time.strftime("%H:%M:%S", time.gmtime(seconds))
-
-def generate_thumbnail(video_file, thumbnail_path, time_offset="00:00:01.000"):
-    """
-    Generate a thumbnail image from a video file using FFmpeg.
-
-    Args:
-        video_file (str): Path to the source video file.
-        thumbnail_path (str): Path where the thumbnail image will be saved.
-        time_offset (str): Timestamp offset (HH:MM:SS.mmm) to capture the thumbnail.
-
-    Returns:
-        str or None: Returns the thumbnail path if successful, otherwise None.
-    """
-    ffmpeg_executable = "ffmpeg"  # Change to absolute path if necessary
-    command = [
-        ffmpeg_executable,
-        "-i", video_file,
-        "-ss", time_offset,
-        "-vframes", "1",
-        thumbnail_path,
-        "-y"  # Overwrite output file if it exists
-    ]
-    try:
-        subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return thumbnail_path
-    except subprocess.CalledProcessError as e:
-        log.error(f"Thumbnail generation failed: {e}")
-        return None
-
 # =============================================================================
 #                           TELEGRAM BOT HANDLERS
 # =============================================================================
 
-@bot.on(events.NewMessage(pattern=r'^/start'))
+@events.register(events.NewMessage(pattern=r'^/start'))
 async def start_handler(event):
     """
     /start command handler.
@@ -129,23 +104,28 @@ async def start_handler(event):
     await asyncio.sleep(5)
     await bot.delete_messages(event.chat_id, msg.id)
 
-@bot.on(events.NewMessage(pattern=r'^/stop'))
+@events.register(events.NewMessage(pattern=r'^/stop'))
 async def stop_handler(event):
     """
     /stop command handler.
     
-    Stops the bot by restarting the script.
+    Stops the bot by restarting the script. The chat's running batches are
+    paused in the journal and can be continued with /resume.
     """
-    await event.reply("**Stopped** 🚦")
+    JOURNAL.pause_chat(event.chat_id)
+    await event.reply("**Stopped** 🚦\nSend /resume to continue from where it stopped.")
+    log.info(f"Stopped by chat {event.chat_id}, restarting")
+    # exec skips atexit: flush the queued log records first.
+    logs.shutdown()
     os.execl(sys.executable, sys.executable, *sys.argv)
 
-@bot.on(events.NewMessage(pattern=r'^/upload'))
+@events.register(events.NewMessage(pattern=r'^/upload'))
 async def upload_handler(event):
     """
     /upload command handler.
     
     Processes a .TXT file with download links, prompts for additional inputs,
-    downloads each file, and uploads it to Telegram using fast_upload.
+    records the batch in the journal and hands it to the batch runner.
     """
     async with bot.conversation(event.chat_id) as conv:
         # STEP 1: Get the TXT file with links
@@ -235,211 +215,86 @@ async def upload_handler(event):
                 thumb_path = None
         batch_thumb = thumb_path
 
-        # Notify processing start
-        status_msg = await conv.send_message("Processing your links...")
-
-        # Process each link
-        count = start_index
-        for link in links[start_index - 1:]:
-            # Reconstruct URL
-            link_protocol, link_body = link
-            V = link_body.replace("file/d/", "uc?export=download&id=") \
-                         .replace("www.youtube-nocookie.com/embed", "youtu.be") \
-                         .replace("?modestbranding=1", "") \
-                         .replace("/view?usp=sharing", "")
-            url = "https://" + V
-
-            # Special URL processing
-            if "visionias" in url:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(
-                        url,
-                        headers={
-                            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,'
-                                      'image/avif,image/webp,image/apng,*/*;q=0.8',
-                            'User-Agent': 'Mozilla/5.0'
-                        }
-                    ) as resp:
-                        text = await resp.text()
-                        m = re.search(r"(https://.*?playlist\.m3u8.*?)\"", text)
-                        if m:
-                            url = m.group(1)
-            elif 'videos.classplusapp' in url:
-                api_url = "https://api.classplusapp.com/cams/uploader/video/jw-signed-url?url=" + url
-                response = requests.get(api_url, headers={'x-access-token': 'TOKEN'})
-                try:
-                    url = response.json()['url']
-                except Exception as e:
-                    log.error(f"Error processing Classplusapp URL: {e}")
-            elif '/master.mpd' in url:
-                url = f"https://anonymouspwplayer-b99f57957198.herokuapp.com/pw?url={url}?token={pw_token}"
-
-            # Construct safe file name
-            name1 = link_protocol.replace("\t", "").replace(":", "").replace("/", "") \
-                                  .replace("+", "").replace("#", "").replace("|", "") \
-                                  .replace("@", "").replace("*", "").replace(".", "") \
-                                  .replace("https", "").replace("http", "").strip()
-            file_name = f'{str(count).zfill(3)}) {name1[:60]}'
-
-            try:
-                cc = (
-                    f"**{str(count).zfill(3)}**. {name1}{caption}.mkv\n"
-                    f"**Batch Name »** {batch_name}\n"
-                    f"**Downloaded By :** TechMon ❤️‍🔥 @TechMonX"
-                )
-                cc1 = (
-                    f"**{str(count).zfill(3)}**. {name1}{caption}.pdf\n"
-                    f"**Batch Name »** {batch_name}\n"
-                    f"**Downloaded By :** TechMon ❤️‍🔥 @TechMonX"
-                )
-
-                if "drive" in url:
-                    try:
-                        ka = await helper.download(url, file_name)
-                        await conv.send_message("Uploading document...")
-                        await bot.send_file(event.chat_id, file=ka, caption=cc1)
-                        os.remove(ka)
-                        await asyncio.sleep(1)
-                    except Exception as e:
-                        await conv.send_message(str(e))
-                        await asyncio.sleep(5)
-                        continue
-                elif ".pdf" in url:
-                    try:
-                        cmd_pdf = (
-                            f'yt-dlp --external-downloader aria2c '
-                            f'--external-downloader-args "-j 128 -x 16 -s 16 -k 1M --timeout=120 --connect-timeout=120 '
-                            f'--max-download-limit=0 --max-overall-download-limit=0 '
-                            f'--enable-http-pipelining=true --file-allocation=falloc" '
-                            f'-o "{file_name}.pdf" "{url}"'
-                        )
-                        download_cmd = f"{cmd_pdf} -R 25 --fragment-retries 25"
-                        os.system(download_cmd)
-                        await bot.send_file(event.chat_id, file=f'{file_name}.pdf', caption=cc1)
-                        os.remove(f'{file_name}.pdf')
-                        await asyncio.sleep(1)
-                    except Exception as e:
-                        await conv.send_message(str(e))
-                        await asyncio.sleep(5)
-                        continue
-                else:
-                    # Use N_m3u8DL-RE for video downloads.
-                    n_cmd = (
-                        f'./N_m3u8DL-RE "{url}" --save-name "{file_name}" '
-                        f'--del-after-done --thread-count 16 --auto-select --live-perform-as-vod'
-                    )
-                    max_retries = 3
-                    retries = 0
-                    while retries < max_retries:
-                        try:
-                            subprocess.run(n_cmd, shell=True, check=True)
-                            res_file = f"{file_name}.mp4"
-                            break
-                        except Exception as e:
-                            if ("HTTP Error 500" in str(e) or "timeout" in str(e)):
-                                wait_time = random.randint(10, 20)
-                                time.sleep(wait_time)
-                                retries += 1
-                                continue
-                            else:
-                                raise e
-                    else:
-                        await conv.send_message(f"Failed to download after {max_retries} attempts.")
-                        continue
-
-                    # Process the downloaded video file.
-                    clip = VideoFileClip(res_file)
-                    duration = int(clip.duration)
-                    width, height = clip.size
-                    clip.close()
-
-                    if batch_thumb is None:
-                        thumb_file = f"{file_name}_thumb.jpg"
-                        generated_thumb = generate_thumbnail(res_file, thumb_file)
-                        current_thumb = generated_thumb
-                    else:
-                        current_thumb = batch_thumb
-
-                    progress_msg = await conv.send_message("Uploading file... 0%")
-                    last_percent = 0
-                    last_time = time.time()
-                    last_bytes = 0
-
-                    async def progress_callback(current, total):
-                        nonlocal last_percent, last_time, last_bytes
-                        percent = (current / total) * 100
-                        if percent - last_percent >= 5 or current == total:
-                            now = time.time()
-                            dt = now - last_time
-                            speed = (current - last_bytes) / dt if dt > 0 else 0
-                            speed_str = human_readable(speed) + "/s"
-                            bar_length = 20
-                            filled_length = int(bar_length * current // total)
-                            progress_bar = "█" * filled_length + "░" * (bar_length - filled_length)
-                            perc_str = f"{percent:.2f}%"
-                            cur_str = human_readable(current)
-                            tot_str = human_readable(total)
-                            if speed > 0:
-                                eta_seconds = (total - current) / speed
-                                eta = format_eta(eta_seconds)
-                            else:
-                                eta = "Calculating..."
-                            text = (
-                                f"<b>\n"
-                                f" ╭──⌯════🆄︎ᴘʟᴏᴀᴅɪɴɢ⬆️⬆️═════⌯──╮ \n"
-                                f"├⚡ {progress_bar}|﹝{perc_str}﹞ \n"
-                                f"├🚀 Speed » {speed_str} \n"
-                                f"├📟 Processed » {cur_str}\n"
-                                f"├🧲 Size - ETA » {tot_str} - {eta} \n"
-                                f"├🤖 By » TechMon\n"
-                                f"╰─═══ ✪ TechMon ✪ ═══─╯\n"
-                                f"</b>"
-                            )
-                            try:
-                                await bot.edit_message(event.chat_id, progress_msg.id, text)
-                            except Exception as ex:
-                                log.error(f"Progress update failed: {ex}")
-                            last_percent = percent
-                            last_time = now
-                            last_bytes = current
-
-                    with open(res_file, "rb") as file_obj:
-                        uploaded_file = await fast_upload(bot, file_obj, progress_callback=progress_callback)
-                    await bot.delete_messages(event.chat_id, progress_msg.id)
-
-                    uploaded_file.name = f"{file_name}.mp4"
-                    attributes = [DocumentAttributeVideo(duration, w=width, h=height, supports_streaming=True)]
-
-                    await bot.send_file(
-                        event.chat_id,
-                        file=uploaded_file,
-                        caption=cc,
-                        supports_streaming=True,
-                        attributes=attributes,
-                        thumb=current_thumb
-                    )
-                    await asyncio.sleep(1)
-
-                count += 1
-
-            except Exception as e:
-                error_text = (
-                    f"**Downloading Interrupted**\n{str(e)}\n"
-                    f"**Name »** {file_name}\n"
-                    f"**URL »** `{url}`"
-                )
-                await conv.send_message(error_text)
-                continue
-
-        await conv.send_message("**Done Boss 😎**")
-        await bot.delete_messages(event.chat_id, status_msg.id)
-
-        if batch_thumb is not None and os.path.exists(batch_thumb):
-            os.remove(batch_thumb)
+        settings = {
+            "pw_token": pw_token,
+            "batch_name": batch_name,
+            "res": res,
+            "caption": caption,
+            "thumb": batch_thumb,
+        }
+        items = build_items(links, start_index)
+        job_id = JOURNAL.create_job(event.chat_id, settings, items)
+
+    await start_job(job_id)
+
+@events.register(events.NewMessage(pattern=r'^/resume'))
+async def resume_handler(event):
+    """
+    /resume command handler.
+
+    Continues the chat's batches that were paused by /stop.
+    """
+    job_ids = JOURNAL.jobs("paused", event.chat_id)
+    if not job_ids:
+        await event.reply("Nothing to resume.")
+        return
+    for job_id in job_ids:
+        JOURNAL.set_job_state(job_id, "running")
+        asyncio.create_task(start_job(job_id))
+
+@events.register(events.NewMessage(pattern=r'^/cachestats'))
+async def cachestats_handler(event):
+    """
+    /cachestats command handler.
+
+    Reports how much the upload dedup cache has saved.
+    """
+    stats = MEDIA.stats()
+    await event.reply(
+        f"**Cached files:** {stats['entries']}\n"
+        f"**Hits / misses:** {stats['hits']} / {stats['misses']}\n"
+        f"**Saved:** {human_readable(stats['bytes_saved'])}"
+    )
+
+def start_job(job_id):
+    """Run a batch here, or hand it to the workers and follow it in distributed mode."""
+    if DISTRIBUTED:
+        return RUNNER.watch(job_id, QUEUE)
+    return RUNNER.run(job_id)
+
+async def resume_jobs():
+    """Continue every batch that was still running when the process stopped."""
+    for job_id in JOURNAL.jobs("running"):
+        asyncio.create_task(start_job(job_id))
 
 def main():
+    global bot, JOURNAL, MEDIA, RUNNER, QUEUE
+    logs.setup()
+    bot = TelegramClient("bot", API_ID, API_HASH)
+    for handler in (start_handler, stop_handler, upload_handler, resume_handler, cachestats_handler):
+        bot.add_event_handler(handler)
+
+    # Batch journal shared by every handler; unfinished batches resume from it.
+    JOURNAL = journal.Journal()
+
+    # Telegram media references reused for repeat links and identical files.
+    MEDIA = journal.MediaCache(JOURNAL)
+
+    # The /upload batch stages, bound to this client; progress is one
+    # coalesced, rate-limited status message per chat.
+    RUNNER = BatchRunner(bot, JOURNAL, MEDIA, ProgressHub(bot), SCHEDULER, HOST_LIMITER)
+
+    # Distributed mode: batches are run by worker.py processes off the journal.
+    QUEUE = journal.TaskQueue(JOURNAL, "coordinator", ttl=LEASE_TTL, window=DISPATCH_WINDOW)
+
+    bot.start(bot_token=BOT_TOKEN)
     print("Bot is running... (Commit a70a8a8)")
-    bot.run_until_disconnected()
+    bot.loop.create_task(resume_jobs())
+    bot.loop.create_task(metrics.export(METRICS_FILE, METRICS_INTERVAL))
+    try:
+        bot.run_until_disconnected()
+    finally:
+        bot.loop.run_until_complete(helper.close_http_session())
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           MANIFEST INSPECTION
+===========================================================================
+Description        : Reads HLS master playlists and DASH MPDs before a
+                     lecture is downloaded, picks the video variant closest
+                     to the resolution chosen in /upload plus the audio
+                     track that goes with it, and turns the pick into an
+                     explicit N_m3u8DL-RE selection (or the direct media
+                     URLs for ffmpeg), instead of `--auto-select` always
+                     taking the best variant.
+===========================================================================
+"""
+
+import re
+import shlex
+import logging
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin
+
+import core as helper
+
+log = logging.getLogger(__name__)
+
+RES_RE = re.compile(r"^(\d+)x(\d+)$")
+ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+# Manifests bigger than this are not master playlists worth parsing.
+MAX_MANIFEST_SIZE = 4 * 1024 * 1024
+
+
+def _attrs(line):
+    """Attribute list of an #EXT-X tag as a dict with quotes stripped."""
+    return {k: v.strip('"') for k, v in ATTR_RE.findall(line.split(":", 1)[1])}
+
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_hls(text, url):
+    """
+    Parse an HLS master playlist.
+
+    Returns:
+        {"kind": "hls", "video": [...], "audio": [...]}, or None for a media
+        playlist (nothing to choose from). Video variants carry id, url,
+        width, height, bandwidth, codecs and their AUDIO group; audio
+        renditions carry id, group, lang, name, url and default.
+    """
+    video, audio = [], []
+    lines = [x.strip() for x in text.splitlines() if x.strip()]
+    for i, line in enumerate(lines):
+        if line.startswith("#EXT-X-STREAM-INF"):
+            attrs = _attrs(line)
+            uri = next((x for x in lines[i + 1:] if not x.startswith("#")), None)
+            if uri is None:
+                continue
+            width, height = 0, 0
+            match = RES_RE.match(attrs.get("RESOLUTION", ""))
+            if match:
+                width, height = int(match.group(1)), int(match.group(2))
+            video.append({
+                "id": str(len(video)),
+                "url": urljoin(url, uri),
+                "width": width,
+                "height": height,
+                "bandwidth": _int(attrs.get("AVERAGE-BANDWIDTH") or attrs.get("BANDWIDTH")),
+                "codecs": attrs.get("CODECS", ""),
+                "audio": attrs.get("AUDIO"),
+            })
+        elif line.startswith("#EXT-X-MEDIA") and "TYPE=AUDIO" in line:
+            attrs = _attrs(line)
+            audio.append({
+                "id": str(len(audio)),
+                "group": attrs.get("GROUP-ID"),
+                "lang": attrs.get("LANGUAGE", ""),
+                "name": attrs.get("NAME", ""),
+                "url": urljoin(url, attrs["URI"]) if attrs.get("URI") else None,
+                "bandwidth": 0,
+                "default": attrs.get("DEFAULT") == "YES",
+            })
+    if not video:
+        return None
+    return {"kind": "hls", "video": video, "audio": audio}
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_dash(text, url):
+    """
+    Parse the first Period of a DASH MPD.
+
+    Returns:
+        {"kind": "dash", "video": [...], "audio": [...]}, or None when it
+        has no video representations. Entries are shaped like parse_hls'
+        (the representation id is the id; url is always None).
+    """
+    root = ET.fromstring(text)
+    period = next((el for el in root if _local(el.tag) == "Period"), None)
+    if period is None:
+        return None
+    video, audio = [], []
+    for aset in period:
+        if _local(aset.tag) != "AdaptationSet":
+            continue
+        roles = [el.get("value") for el in aset if _local(el.tag) == "Role"]
+        for rep in aset:
+            if _local(rep.tag) != "Representation":
+                continue
+            mime = rep.get("mimeType") or aset.get("mimeType") or ""
+            kind = rep.get("contentType") or aset.get("contentType") or mime.split("/")[0]
+            entry = {
+                "id": rep.get("id", ""),
+                "url": None,
+                "bandwidth": _int(rep.get("bandwidth")),
+                "codecs": rep.get("codecs") or aset.get("codecs") or "",
+            }
+            if kind == "video":
+                entry["width"] = _int(rep.get("width") or aset.get("width"))
+                entry["height"] = _int(rep.get("height") or aset.get("height"))
+                entry["audio"] = None
+                video.append(entry)
+            elif kind == "audio":
+                entry.update(group=None, lang=aset.get("lang") or rep.get("lang") or "",
+                             name=aset.get("label") or "", default="main" in roles)
+                audio.append(entry)
+    if not video:
+        return None
+    return {"kind": "dash", "video": video, "audio": audio}
+
+
+def choose(manifest, res):
+    """
+    Pick the video variant and audio track for a requested resolution.
+
+    The variant whose height is closest to the requested one wins, the
+    smaller one on a tie, and then the highest bitrate at that height.
+    HLS audio is the default rendition of the variant's AUDIO group; DASH
+    audio the best bitrate in the main (or first) language.
+
+    Args:
+        manifest (dict): parse_hls / parse_dash result.
+        res (str): "1280x720"-style resolution, or "UN" for no preference.
+
+    Returns:
+        {"kind", "video", "audio"} (audio may be None), or None when there
+        is no preference or no variant reports its resolution.
+    """
+    match = RES_RE.match(res or "")
+    sized = [v for v in manifest["video"] if v["height"]]
+    if not match or not sized:
+        return None
+    target = int(match.group(2))
+    video = min(sized, key=lambda v: (abs(v["height"] - target), v["height"], -v["bandwidth"]))
+
+    tracks = manifest["audio"]
+    audio = None
+    if manifest["kind"] == "hls":
+        group = [a for a in tracks if video["audio"] and a["group"] == video["audio"]]
+        if group:
+            audio = next((a for a in group if a["default"]), group[0])
+    elif tracks:
+        main = next((a for a in tracks if a["default"]), tracks[0])
+        audio = max((a for a in tracks if a["lang"] == main["lang"]), key=lambda a: a["bandwidth"])
+    return {"kind": manifest["kind"], "video": video, "audio": audio}
+
+
+async def inspect(url, res):
+    """
+    Fetch the manifest at `url` and choose its variants for `res`.
+
+    Returns:
+        choose()'s result, or None when there is nothing to choose (a media
+        playlist, no resolution asked for, not a manifest at all).
+
+    Raises:
+        aiohttp.ClientError, ET.ParseError: the manifest could not be read.
+    """
+    if not RES_RE.match(res or "") or not (".m3u8" in url or ".mpd" in url):
+        return None
+    async with helper.http_session().get(url) as resp:
+        resp.raise_for_status()
+        if (resp.content_length or 0) > MAX_MANIFEST_SIZE:
+            return None
+        text = await resp.text()
+        final_url = str(resp.url)
+    if text.lstrip().startswith("#EXTM3U"):
+        manifest = parse_hls(text, final_url)
+    elif "<MPD" in text:
+        manifest = parse_dash(text, final_url)
+    else:
+        manifest = None
+    return choose(manifest, res) if manifest else None
+
+
+def n_m3u8dl_args(selection):
+    """
+    N_m3u8DL-RE options selecting exactly the chosen tracks.
+
+    DASH tracks are selected by representation id; HLS variants by
+    resolution (best bitrate, which is what choose() picked among equals)
+    and HLS audio by language or name.
+    """
+    video, audio = selection["video"], selection["audio"]
+    if selection["kind"] == "dash":
+        args = ["--select-video", f"id={re.escape(video['id'])}:for=best"]
+    else:
+        args = ["--select-video", f"res={video['width']}x{video['height']}:for=best"]
+    if audio is not None:
+        if selection["kind"] == "dash":
+            spec = f"id={re.escape(audio['id'])}"
+        elif audio["lang"]:
+            spec = f"lang={re.escape(audio['lang'])}"
+        else:
+            spec = f"name={re.escape(audio['name'])}"
+        args += ["--select-audio", f"{spec}:for=best"]
+    return " ".join(shlex.quote(x) for x in args)
+
+
+def describe(selection):
+    """Short log form, e.g. "1280x720 @ 2.8 Mb/s + audio en"."""
+    video, audio = selection["video"], selection["audio"]
+    text = f"{video['width']}x{video['height']} @ {video['bandwidth'] / 1e6:.1f} Mb/s"
+    if audio is not None:
+        text += f" + audio {audio['lang'] or audio['name'] or audio['id']}"
+    return text
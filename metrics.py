@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           METRICS
+===========================================================================
+Description        : In-process counters, gauges and histograms for the
+                     batch stages, rendered in the Prometheus text format.
+                     The bot writes them to METRICS_FILE every
+                     METRICS_INTERVAL seconds (each worker.py process to
+                     its own snapshot_path) and app.py serves them at
+                     /metrics, so the health-check process needs no
+                     access to the bot's memory.
+===========================================================================
+"""
+
+import os
+import time
+import asyncio
+import logging
+import contextlib
+
+import logs
+
+log = logging.getLogger(__name__)
+
+# Stage durations run from sub-second probes to multi-hour downloads.
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+_registry = {}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{k}="{_escape(v)}"' for k, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of samples, one per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) tuples."""
+        for key, value in sorted(self._values.items()):
+            yield "", key, (), value
+
+    def render(self, const=()):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            labels = _labels(self.labelnames, key, tuple(const) + tuple(extra))
+            lines.append(f"{self.name}{suffix}{labels} {_number(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. With `fn` the gauge is read at render
+    time instead: `fn()` returns a number, or a dict of label tuple -> number.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.fn is None:
+            yield from super().samples()
+            return
+        try:
+            value = self.fn()
+        except Exception as e:
+            log.error(f"Gauge {self.name} failed: {e}")
+            return
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for key, v in sorted(items):
+            yield "", tuple(str(x) for x in key), (), v
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = entry[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the block (async code inside is fine)."""
+        start = time.perf_counter()
+        yield
+        self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield "_bucket", key, (("le", _number(bound)),), cumulative
+            yield "_sum", key, (), total
+            yield "_count", key, (), count
+
+
+def _register(cls, name, *args, **kwargs):
+    metric = _registry.get(name)
+    if metric is None:
+        metric = _registry[name] = cls(name, *args, **kwargs)
+    return metric
+
+
+def counter(name, help, labels=()):
+    return _register(Counter, name, help, labels)
+
+
+def gauge(name, help, labels=(), fn=None):
+    return _register(Gauge, name, help, labels, fn=fn)
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, help, labels, buckets=buckets)
+
+
+def render(const=()):
+    """
+    Every registered metric in the Prometheus text exposition format.
+
+    Args:
+        const: (name, value) label pairs added to every sample, e.g. the
+            worker id, so snapshots of several processes can be merged.
+    """
+    return "\n".join(metric.render(const) for metric in _registry.values()) + "\n"
+
+
+def merge(texts):
+    """
+    Merge snapshots of several processes into one exposition, keeping each
+    family's HELP/TYPE once and its samples together. The snapshots must
+    not share series (see render's `const`).
+    """
+    families = {}
+    for text in texts:
+        name = None
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                name = line.split(" ", 3)[2]
+                families.setdefault(name, [line, None])
+            elif line.startswith("# TYPE "):
+                if families[name][1] is None:
+                    families[name][1] = line
+            elif line and name is not None:
+                families[name].append(line)
+    return "\n".join("\n".join(x for x in lines if x) for lines in families.values()) + "\n"
+
+
+def snapshot_path(path, worker_id):
+    """Where worker `worker_id` writes its snapshot: metrics.prom -> metrics.<id>.prom."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{worker_id}{ext}"
+
+
+# ---------------------------------------------------------------------------
+# Shared batch-stage metrics.
+# ---------------------------------------------------------------------------
+STAGE_SECONDS = histogram(
+    "leech_stage_seconds", "Time spent in each batch stage.", ("stage", "host"))
+STAGE_FAILURES = counter(
+    "leech_stage_failures_total", "Batch stage failures.", ("stage", "host"))
+STAGE_BYTES = counter(
+    "leech_stage_bytes_total", "Bytes downloaded or uploaded.", ("stage", "host"))
+RETRIES = counter(
+    "leech_retries_total", "Retried attempts.", ("stage", "host"))
+CACHE = counter(
+    "leech_cache_total", "Cache lookups by cache and result.", ("cache", "result"))
+LINKS = counter(
+    "leech_links_total", "Links finished, by outcome.", ("result",))
+EXPORTED = gauge(
+    "leech_metrics_exported_timestamp_seconds", "When this snapshot was written.", fn=time.time)
+LOG_DROPPED = gauge(
+    "leech_log_records_dropped", "Log records dropped because the log writer fell behind.",
+    fn=lambda: logs.dropped)
+
+
+@contextlib.contextmanager
+def stage(name, host=""):
+    """
+    Time a batch stage; failures are counted (and re-raised) instead. Each
+    one is also logged as a structured event.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STAGE_FAILURES.inc(stage=name, host=host)
+        logs.event(log, f"{name} failed", logging.WARNING, stage=name, host=host,
+                   duration=round(time.perf_counter() - start, 3), error=logs.clip(str(e), 500))
+        raise
+    elapsed = time.perf_counter() - start
+    STAGE_SECONDS.observe(elapsed, stage=name, host=host)
+    logs.event(log, f"{name} done", stage=name, host=host, duration=round(elapsed, 3))
+
+
+def write(path, const=()):
+    """Atomically replace `path` with the current snapshot."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(render(const))
+    os.replace(tmp, path)
+
+
+async def export(path, interval, const=()):
+    """Write the snapshot to `path` every `interval` seconds, forever."""
+    while True:
+        try:
+            write(path, const)
+        except OSError as e:
+            log.error(f"Could not write metrics to {path}: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           SEND PACER
+===========================================================================
+Description        : Spaces the bot's posts to each chat instead of sleeping
+                     a fixed second after every one. A post only waits when
+                     the previous post to the same chat was less than the
+                     chat's interval ago; a FloodWait from Telegram is waited
+                     out, the post retried, and that chat's interval widened
+                     until posts go through cleanly again.
+===========================================================================
+"""
+
+import time
+import asyncio
+import logging
+from collections import defaultdict
+
+from telethon.errors import FloodWaitError
+
+import metrics
+from vars import SEND_INTERVAL
+
+log = logging.getLogger(__name__)
+
+FLOOD_WAITS = metrics.counter("leech_flood_wait_seconds_total", "Seconds Telegram told the bot to wait before posting.")
+
+# Longest a chat's interval grows after repeated flood waits (seconds).
+MAX_INTERVAL = 30.0
+
+
+class Pacer:
+    """
+    Per-chat spacing for messages, with FloodWait handling.
+
+    Every flood wait doubles the chat's interval (up to MAX_INTERVAL); each
+    clean post shrinks it back by `decay` towards `interval`.
+    """
+
+    def __init__(self, interval=SEND_INTERVAL, attempts=5, decay=0.9):
+        self.interval = interval
+        self.attempts = attempts
+        self.decay = decay
+        self._intervals = {}
+        self._next = {}
+        self._locks = defaultdict(asyncio.Lock)
+
+    def interval_of(self, chat_id):
+        return self._intervals.get(chat_id, self.interval)
+
+    async def send(self, chat_id, func):
+        """
+        Await `func()` (a call that posts to `chat_id`) once the chat's
+        interval has passed, and return its result.
+
+        Raises:
+            FloodWaitError: Telegram still refused after `attempts` tries.
+        """
+        async with self._locks[chat_id]:
+            for attempt in range(1, self.attempts + 1):
+                delay = self._next.get(chat_id, 0.0) - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    result = await func()
+                except FloodWaitError as e:
+                    FLOOD_WAITS.inc(e.seconds)
+                    interval = min(MAX_INTERVAL, max(self.interval_of(chat_id), 0.5) * 2)
+                    self._intervals[chat_id] = interval
+                    self._next[chat_id] = time.monotonic() + e.seconds
+                    log.warning(f"Flood wait of {e.seconds}s posting to {chat_id}, "
+                                f"spacing posts {interval:.1f}s apart (attempt {attempt}/{self.attempts})")
+                    if attempt == self.attempts:
+                        raise
+                    continue
+                interval = self.interval_of(chat_id)
+                self._intervals[chat_id] = max(self.interval, interval * self.decay)
+                self._next[chat_id] = time.monotonic() + interval
+                return result
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           BATCH PIPELINE
+===========================================================================
+Description        : Bounded producer/consumer pipeline used by /upload.
+                     A pool of download workers prefetches the next links
+                     while the upload stage drains them in the original
+                     order, with per-host limits and a disk budget.
+===========================================================================
+"""
+
+import os
+import shutil
+import asyncio
+import logging
+import contextlib
+from urllib.parse import urlparse
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+BUFFERED = metrics.gauge("leech_buffered_bytes", "Downloaded bytes waiting for upload, all batches.")
+
+
+class DiskBudget:
+    """
+    Caps the number of downloaded-but-not-yet-uploaded bytes kept on disk.
+
+    A download is only started while the buffered bytes stay below `limit`
+    and the volume still has `reserve` bytes free. The next item to be
+    posted is always let through: everything buffered is only freed once it
+    is posted, so holding it back could deadlock the batch. Free space
+    changes outside the process, so waiters re-check it every `poll`
+    seconds. With several workers the cap is soft: downloads already
+    running may finish past it.
+    """
+
+    def __init__(self, limit, reserve=0, path=".", poll=5):
+        self.limit = limit
+        self.reserve = reserve
+        self.path = path
+        self.poll = poll
+        self.used = 0
+        self.posted = 0
+        self._cond = asyncio.Condition()
+
+    def _has_room(self, pos):
+        if self.used == 0 or pos <= self.posted:
+            return True
+        if self.limit and self.used >= self.limit:
+            return False
+        if self.reserve:
+            try:
+                if shutil.disk_usage(self.path).free < self.reserve:
+                    return False
+            except OSError:
+                pass
+        return True
+
+    async def wait(self, pos):
+        """Block until the download of item number `pos` (0-based) may start."""
+        async with self._cond:
+            while not self._has_room(pos):
+                try:
+                    await asyncio.wait_for(self._cond.wait(), self.poll)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def add(self, nbytes):
+        async with self._cond:
+            self.used += nbytes
+            BUFFERED.inc(nbytes)
+
+    async def release(self, nbytes):
+        """Free the bytes of the item just posted; items are posted in order."""
+        async with self._cond:
+            self.posted += 1
+            freed = min(self.used, nbytes)
+            self.used -= freed
+            BUFFERED.dec(freed)
+            self._cond.notify_all()
+
+
+def result_size(result):
+    """Return the on-disk size of a fetch result (0 for errors/missing files)."""
+    if not isinstance(result, dict):
+        return 0
+    if result.get("parts"):
+        return sum(os.path.getsize(p["path"]) for p in result["parts"] if os.path.exists(p["path"]))
+    path = result.get("path")
+    if path and os.path.exists(path):
+        return os.path.getsize(path)
+    return 0
+
+
+def host_key(url):
+    """
+    Group a link under the CDN it will hit, for per-host concurrency limits.
+
+    The PW `/master.mpd` links all go through the same proxy, so they share
+    one key no matter which origin they point at.
+    """
+    if "/master.mpd" in url:
+        return "pw"
+    if "classplusapp" in url:
+        return "classplus"
+    if "visionias" in url:
+        return "visionias"
+    if "drive.google" in url:
+        return "drive"
+    return urlparse(url).netloc or "default"
+
+
+def parse_host_limits(spec):
+    """Parse "classplus=2,pw=3" into {"classplus": 2, "pw": 3}."""
+    limits = {}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        key, value = part.split("=", 1)
+        try:
+            limits[key.strip()] = int(value)
+        except ValueError:
+            log.error(f"Ignoring bad host limit: {part!r}")
+    return limits
+
+
+class HostLimiter:
+    """Per-host semaphores, created on first use."""
+
+    def __init__(self, limits=None, default=0):
+        self.limits = limits or {}
+        self.default = default
+        self._sems = {}
+
+    def get(self, key):
+        limit = self.limits.get(key, self.default)
+        if not limit:
+            return contextlib.nullcontext()
+        if key not in self._sems:
+            self._sems[key] = asyncio.Semaphore(limit)
+        return self._sems[key]
+
+
+async def run_pipeline(items, fetch, post, workers=1, prefetch=2, budget=None,
+                       host_of=None, hosts=None):
+    """
+    Run `fetch(item)` on a pool of workers ahead of `post(item, result)`.
+
+    Items are fetched concurrently but always posted in their original order.
+    A fetched item waits in the window until every earlier item is posted.
+
+    Args:
+        items (list): Work items, in the order they must be posted.
+        fetch (coroutine function): Download stage. Its return value (or the
+            exception it raised) is handed to `post`.
+        post (coroutine function): Upload stage, always called in order.
+        workers (int): Number of concurrent fetches.
+        prefetch (int): Maximum number of fetched items waiting for upload,
+            on top of the ones being fetched.
+        budget (DiskBudget): Optional cap on buffered bytes.
+        host_of (callable): Maps an item to its host key.
+        hosts (HostLimiter): Per-host concurrency limits for `fetch`.
+    """
+    workers = max(1, workers)
+    window = asyncio.Semaphore(workers + max(0, prefetch))
+    loop = asyncio.get_running_loop()
+    slots = [loop.create_future() for _ in items]
+    position = 0
+
+    async def worker():
+        nonlocal position
+        while True:
+            await window.acquire()
+            if position >= len(items):
+                window.release()
+                return
+            i = position
+            position += 1
+            item = items[i]
+            if budget is not None:
+                await budget.wait(i)
+            limit = hosts.get(host_of(item)) if hosts and host_of else contextlib.nullcontext()
+            try:
+                async with limit:
+                    result = await fetch(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result = e
+            size = result_size(result)
+            if budget is not None:
+                await budget.add(size)
+            slots[i].set_result((result, size))
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        for i, item in enumerate(items):
+            result, size = await slots[i]
+            try:
+                await post(item, result)
+            finally:
+                if budget is not None:
+                    await budget.release(size)
+                window.release()
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
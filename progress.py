@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           PROGRESS SERVICE
+===========================================================================
+Description        : One status message per chat covering every upload
+                     running there. Upload callbacks only record numbers;
+                     a per-chat flusher renders the latest state at most
+                     once per edit budget and backs off on FloodWait
+                     without blocking anything else.
+===========================================================================
+"""
+
+import html
+import time
+import asyncio
+import logging
+
+from telethon.errors import FloodWaitError, MessageNotModifiedError
+
+from utils import hrb, hrt
+from vars import PROGRESS_EDITS_PER_MIN
+
+log = logging.getLogger(__name__)
+
+
+class Tracker:
+    """Progress of one upload. Calling it is the upload's progress callback."""
+
+    def __init__(self, hub, chat_id, label):
+        self.hub = hub
+        self.chat_id = chat_id
+        self.label = label
+        self.current = 0
+        self.total = None
+        self.start = time.time()
+
+    def __call__(self, current, total=None):
+        # Hot path: no formatting, no I/O, just the latest numbers.
+        self.current = current
+        self.total = total
+        self.hub._dirty.add(self.chat_id)
+
+    def render(self):
+        elapsed = max(time.time() - self.start, 1e-3)
+        speed = self.current / elapsed
+        if self.total:
+            perc = self.current * 100 / self.total
+            filled = int(20 * self.current // self.total)
+            bar = "█" * filled + "░" * (20 - filled)
+            eta = hrt((self.total - self.current) / speed, precision=2) if speed > 0 else "Calculating..."
+            size = f"{hrb(self.total)} - {eta}"
+        else:
+            perc = 0.0
+            bar = "▒" * 20
+            size = "streaming"
+        return (
+            f"<b>{html.escape(self.label)}</b>\n"
+            f"├⚡ {bar}|﹝{perc:.2f}%﹞\n"
+            f"├🚀 Speed » {hrb(speed)}/s\n"
+            f"├📟 Processed » {hrb(self.current)}\n"
+            f"├🧲 Size - ETA » {size}"
+        )
+
+
+class ProgressHub:
+    """Coalesces progress edits per chat under a per-chat edit budget."""
+
+    def __init__(self, client, edits_per_min=PROGRESS_EDITS_PER_MIN):
+        self.client = client
+        self.interval = 60 / max(1, edits_per_min)
+        self._trackers = {}
+        self._messages = {}
+        self._flushers = {}
+        self._dirty = set()
+
+    def track(self, chat_id, label):
+        """Start tracking an upload in `chat_id`; returns the callback."""
+        tracker = Tracker(self, chat_id, label)
+        self._trackers.setdefault(chat_id, []).append(tracker)
+        self._dirty.add(chat_id)
+        if chat_id not in self._flushers or self._flushers[chat_id].done():
+            self._flushers[chat_id] = asyncio.ensure_future(self._flush(chat_id))
+        return tracker
+
+    def done(self, tracker):
+        """Stop tracking; the chat's status message goes once nothing is left."""
+        trackers = self._trackers.get(tracker.chat_id, [])
+        if tracker in trackers:
+            trackers.remove(tracker)
+        self._dirty.add(tracker.chat_id)
+
+    def render(self, chat_id):
+        trackers = self._trackers.get(chat_id, [])
+        blocks = "\n\n".join(t.render() for t in trackers)
+        return (
+            f"<b> ╭──⌯════🆄︎ᴘʟᴏᴀᴅɪɴɢ⬆️⬆️═════⌯──╮</b>\n"
+            f"{blocks}\n"
+            f"<b>╰─═══ ✪ TechMon ✪ ═══─╯</b>"
+        )
+
+    async def _flush(self, chat_id):
+        backoff_until = 0
+        while True:
+            wait = max(self.interval, backoff_until - time.time())
+            await asyncio.sleep(wait)
+            if chat_id not in self._dirty:
+                continue
+            self._dirty.discard(chat_id)
+            try:
+                if not self._trackers.get(chat_id):
+                    # Let the next track() start a fresh flusher and message.
+                    self._trackers.pop(chat_id, None)
+                    self._flushers.pop(chat_id, None)
+                    msg = self._messages.pop(chat_id, None)
+                    if msg is not None:
+                        await self.client.delete_messages(chat_id, msg.id)
+                    return
+                text = self.render(chat_id)
+                msg = self._messages.get(chat_id)
+                if msg is None:
+                    self._messages[chat_id] = await self.client.send_message(chat_id, text, parse_mode="html")
+                else:
+                    await self.client.edit_message(chat_id, msg.id, text, parse_mode="html")
+            except FloodWaitError as e:
+                # Keep collecting state; the next edit simply waits it out.
+                log.info(f"FloodWait {e.seconds}s on progress for {chat_id}")
+                backoff_until = time.time() + e.seconds
+                self._dirty.add(chat_id)
+            except MessageNotModifiedError:
+                pass
+            except Exception as ex:
+                log.error(f"Progress update failed: {ex}")
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           LINK RESOLVERS
+===========================================================================
+Description        : Turns TXT links into URLs the downloaders can fetch.
+                     Resolvers are registered per host pattern, results are
+                     kept in an LRU whose TTL never outlives a signed URL,
+                     and the batch resolves a few links ahead of the
+                     download stage.
+===========================================================================
+"""
+
+import re
+import json
+import time
+import base64
+import calendar
+import codecs
+import asyncio
+import logging
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+import core as helper
+from vars import RESOLVER_CACHE_SIZE, RESOLVER_TTL, RESOLVE_CONCURRENCY
+
+log = logging.getLogger(__name__)
+
+# Signed URLs are treated as expired this many seconds early, so a download
+# never starts on a URL that dies halfway through the playlist fetch.
+EXPIRY_MARGIN = 120
+
+_resolvers = []
+
+
+def resolver(pattern, ttl=RESOLVER_TTL):
+    """
+    Register `func(url, pw_token)` as the resolver for URLs matching `pattern`.
+
+    The first registered pattern that matches wins.
+    """
+    def decorator(func):
+        _resolvers.append((re.compile(pattern), func, ttl))
+        return func
+    return decorator
+
+
+class TTLCache:
+    """A small LRU where every entry also carries its own expiry time."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value, ttl):
+        self._data[key] = (time.time() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
+def _jwt_expiry(token):
+    """Return the `exp` claim of a JWT, or None."""
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    try:
+        payload = parts[1] + "=" * (-len(parts[1]) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def url_expiry(url):
+    """
+    Best-effort expiry (epoch seconds) of a signed URL, or None if unsigned.
+
+    Understands CloudFront/S3-style `Expires`, `X-Amz-Date` + `X-Amz-Expires`,
+    Akamai `hdnts`/`hdntl` tokens and JWTs passed as query parameters.
+    """
+    query = parse_qs(urlparse(url).query)
+    found = []
+    for key, values in query.items():
+        value = values[0]
+        lower = key.lower()
+        if lower in ("expires", "exp", "e") and value.isdigit() and int(value) > 10 ** 9:
+            found.append(float(value))
+        elif lower in ("hdnts", "hdntl", "__token__"):
+            m = re.search(r"exp=(\d+)", value)
+            if m:
+                found.append(float(m.group(1)))
+        elif value.count(".") == 2:
+            exp = _jwt_expiry(value)
+            if exp:
+                found.append(exp)
+    if "X-Amz-Date" in query and "X-Amz-Expires" in query:
+        try:
+            signed = calendar.timegm(time.strptime(query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ"))
+            found.append(signed + int(query["X-Amz-Expires"][0]))
+        except ValueError:
+            pass
+    return min(found) if found else None
+
+
+# =============================================================================
+#                           RESOLVERS
+# =============================================================================
+PLAYLIST_RE = re.compile(r"(https://.*?playlist\.m3u8.*?)\"")
+
+
+@resolver(r"visionias")
+async def resolve_visionias(url, pw_token):
+    """Stream the lecture page and stop at the first playlist.m3u8 link."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    text = ""
+    async with helper.http_session().get(
+        url,
+        headers={
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,'
+                      'image/avif,image/webp,image/apng,*/*;q=0.8',
+            'User-Agent': 'Mozilla/5.0'
+        }
+    ) as resp:
+        async for chunk in resp.content.iter_chunked(16384):
+            text += decoder.decode(chunk)
+            m = PLAYLIST_RE.search(text)
+            if m:
+                return m.group(1)
+            # Keep a tail so a link split across chunks still matches.
+            text = text[-4096:]
+    return url
+
+
+@resolver(r"videos\.classplusapp")
+async def resolve_classplus(url, pw_token):
+    api_url = "https://api.classplusapp.com/cams/uploader/video/jw-signed-url?url=" + url
+    # Errors propagate: the caller's retry engine retries 5xx/429 and network
+    # errors, and an unsigned URL would only fail later, in the downloader.
+    async with helper.http_session().get(api_url, headers={'x-access-token': 'TOKEN'}) as response:
+        response.raise_for_status()
+        data = await response.json(content_type=None)
+    signed = data.get("url") if isinstance(data, dict) else None
+    if not signed:
+        raise ValueError(f"Classplus returned no signed URL: {str(data)[:200]}")
+    return signed
+
+
+@resolver(r"/master\.mpd")
+async def resolve_pw(url, pw_token):
+    return f"https://anonymouspwplayer-b99f57957198.herokuapp.com/pw?url={url}?token={pw_token}"
+
+
+# =============================================================================
+#                           CACHE AND LOOK-AHEAD
+# =============================================================================
+_cache = TTLCache(RESOLVER_CACHE_SIZE)
+_inflight = {}
+_limit = None
+
+
+def _find(url):
+    for pattern, func, ttl in _resolvers:
+        if pattern.search(url):
+            return func, ttl
+    return None, None
+
+
+async def _resolve(key, func, ttl):
+    global _limit
+    if _limit is None:
+        _limit = asyncio.Semaphore(RESOLVE_CONCURRENCY)
+    url, pw_token = key
+    async with _limit:
+        resolved = await func(url, pw_token)
+    if resolved != url:
+        expires = url_expiry(resolved)
+        lifetime = ttl if expires is None else min(ttl, expires - time.time() - EXPIRY_MARGIN)
+        if lifetime > 0:
+            _cache.put(key, resolved, lifetime)
+    return resolved
+
+
+def _start(key, func, ttl):
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_resolve(key, func, ttl))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _inflight.pop(key, None))
+    return task
+
+
+async def resolve(url, pw_token=None):
+    """Return the downloadable URL for `url`, from cache when still valid."""
+    func, ttl = _find(url)
+    if func is None:
+        return url
+    key = (url, pw_token)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    return await asyncio.shield(_start(key, func, ttl))
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        log.info(f"Look-ahead resolution failed: {task.exception()}")
+
+
+def prefetch(urls, pw_token=None):
+    """Start resolving `urls` in the background; failures are retried later."""
+    for url in urls:
+        func, ttl = _find(url)
+        key = (url, pw_token)
+        if func is None or key in _inflight or _cache.get(key) is not None:
+            continue
+        _start(key, func, ttl).add_done_callback(_log_failure)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           RETRY ENGINE
+===========================================================================
+Description        : One retry policy for every download path: capped
+                     exponential backoff with full jitter, retryable vs
+                     fatal errors told apart by exit code and output, a
+                     per-batch retry budget, and a circuit breaker per CDN
+                     host so a dead host fails fast (or its links wait)
+                     while the other hosts keep going.
+===========================================================================
+"""
+
+import re
+import time
+import random
+import asyncio
+import logging
+from collections import defaultdict
+
+import metrics
+from vars import (
+    RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_BUDGET_RATIO,
+    BREAKER_THRESHOLD, BREAKER_COOLDOWN, BREAKER_MAX_DEFER,
+)
+
+log = logging.getLogger(__name__)
+
+RETRY_SLEEP = metrics.counter("leech_retry_sleep_seconds_total", "Backoff slept before retries.", ("host",))
+BREAKER_TRIPS = metrics.counter("leech_breaker_trips_total", "Times a host's circuit breaker opened.", ("host",))
+
+# Downloader output that means "try again later" / "never going to work".
+# Fatal patterns win when both match.
+FATAL_RE = re.compile(
+    r"HTTP Error 4(?:0[0-4]|10)\b|\b(?:400|401|403|404|410) (?:Bad Request|Unauthorized|Forbidden|Not Found|Gone)"
+    r"|Unsupported URL|No video formats|is not a valid URL|No such file or directory",
+    re.IGNORECASE)
+RETRYABLE_RE = re.compile(
+    r"HTTP Error (?:5\d\d|429)|\b(?:5\d\d|429) (?:\w+ )*(?:Error|Gateway|Unavailable|Timeout|Requests)"
+    r"|timed? ?out|Connection (?:reset|refused|aborted|closed)|Temporary failure in name resolution"
+    r"|Name or service not known|Network is unreachable|Remote end closed|IncompleteRead"
+    r"|EOF occurred|SSL|ECONNRESET|ETIMEDOUT|Broken pipe",
+    re.IGNORECASE)
+
+
+def retryable(error):
+    """
+    Decide whether `error` is worth another attempt.
+
+    Understands core.ProcessError (timeouts, signals, exit codes and
+    output), core.DownloadError (its `retryable` flag), aiohttp response
+    errors (by status) and plain network errors.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    flag = getattr(error, "retryable", None)
+    if flag is not None:
+        return flag
+    if getattr(error, "timed_out", False):
+        return True
+    returncode = getattr(error, "returncode", None)
+    if returncode is not None:
+        if returncode in (126, 127):
+            return False
+        if returncode < 0 or returncode in (137, 143):
+            return True
+        output = f"{getattr(error, 'stderr', '')}\n{getattr(error, 'stdout', '')}"
+        if FATAL_RE.search(output):
+            return False
+        return bool(RETRYABLE_RE.search(output))
+    status = getattr(error, "status", None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    module = type(error).__module__ or ""
+    if module.startswith("aiohttp"):
+        return True
+    return bool(RETRYABLE_RE.search(str(error))) and not FATAL_RE.search(str(error))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"{host} keeps failing, skipped (next try in {retry_in:.0f}s)")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive retryable failures of one host and
+    stays open for `cooldown` seconds; then a single trial call is let
+    through (half-open), which either closes it again or re-opens it.
+    """
+
+    def __init__(self, host, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    @property
+    def is_open(self):
+        return self.failures >= self.threshold
+
+    def retry_in(self):
+        return max(0.0, self.open_until - time.monotonic())
+
+    def available(self):
+        """True when a call would be let through right now."""
+        return not self.is_open or (self.retry_in() == 0 and not self.probing)
+
+    def admit(self):
+        if not self.is_open:
+            return
+        if self.retry_in() > 0 or self.probing:
+            raise CircuitOpenError(self.host, max(self.retry_in(), 1))
+        self.probing = True
+
+    def success(self):
+        self.failures = 0
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        was_probing, self.probing = self.probing, False
+        if self.failures == self.threshold or was_probing:
+            self.open_until = time.monotonic() + self.cooldown
+            BREAKER_TRIPS.inc(host=self.host)
+            log.warning(f"Circuit open for {self.host} for {self.cooldown}s")
+
+    def abandon(self):
+        """A trial call was cancelled; let another one through."""
+        self.probing = False
+
+
+class Budget:
+    """
+    Retry budget for one batch: retries stop once they exceed
+    `floor + ratio * calls`, so a bad batch can't turn into a retry storm.
+    Also keeps what was spent, for the end-of-batch report.
+    """
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, floor=10):
+        self.ratio = ratio
+        self.floor = floor
+        self.calls = 0
+        self.retries = 0
+        self.slept = 0.0
+        self.deferred = 0.0
+        self.hosts = defaultdict(int)
+
+    def allow(self):
+        return self.retries < self.floor + self.ratio * self.calls
+
+    def summary(self):
+        """Short human summary, or "" when nothing was retried or deferred."""
+        if not self.retries and not self.deferred:
+            return ""
+        worst = ", ".join(f"{h} ×{n}" for h, n in sorted(self.hosts.items(), key=lambda x: -x[1])[:3])
+        text = f"{self.retries} retries ({self.slept:.0f}s backoff)"
+        if self.deferred:
+            text += f", {self.deferred:.0f}s waiting on failing hosts"
+        return f"{text}: {worst}" if worst else text
+
+
+class RetryPolicy:
+    """Capped exponential backoff with full jitter."""
+
+    def __init__(self, attempts=RETRY_ATTEMPTS, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt):
+        """Seconds to sleep before retry number `attempt` (1-based)."""
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+
+class RetryEngine:
+    """Retries with backoff behind per-host circuit breakers."""
+
+    def __init__(self, policy=None, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.policy = policy or RetryPolicy()
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._breakers = {}
+
+    def breaker(self, host):
+        if host not in self._breakers:
+            self._breakers[host] = CircuitBreaker(host, self.threshold, self.cooldown)
+        return self._breakers[host]
+
+    def open_hosts(self):
+        return {host: b.retry_in() for host, b in self._breakers.items() if b.is_open}
+
+    async def wait(self, host, budget=None, limit=BREAKER_MAX_DEFER):
+        """
+        Defer while `host`'s breaker is open, for at most `limit` seconds.
+
+        Call it before taking a download slot, so a link waiting on a dead
+        host doesn't block links to healthy ones.
+        """
+        breaker = self.breaker(host)
+        waited = 0.0
+        while not breaker.available() and waited < limit:
+            delay = min(max(breaker.retry_in(), 1.0), limit - waited)
+            await asyncio.sleep(delay)
+            waited += delay
+        if budget is not None:
+            budget.deferred += waited
+
+    async def run(self, func, host, budget=None, stage="download", attempts=None, classify=retryable):
+        """
+        Await `func()` until it succeeds, fails for good, or runs out of
+        attempts/budget; the last error is raised.
+
+        Raises:
+            CircuitOpenError: `host` is failing and its cooldown hasn't passed.
+        """
+        breaker = self.breaker(host)
+        attempts = attempts or self.policy.attempts
+        attempt = 0
+        while True:
+            breaker.admit()
+            if budget is not None:
+                budget.calls += 1
+            try:
+                result = await func()
+            except asyncio.CancelledError:
+                breaker.abandon()
+                raise
+            except Exception as e:
+                if not classify(e):
+                    # The host answered; the link itself is bad.
+                    breaker.success()
+                    raise
+                breaker.failure()
+                attempt += 1
+                if attempt >= attempts or breaker.is_open or (budget is not None and not budget.allow()):
+                    raise
+                delay = self.policy.delay(attempt)
+                if budget is not None:
+                    budget.retries += 1
+                    budget.slept += delay
+                    budget.hosts[host] += 1
+                metrics.RETRIES.inc(stage=stage, host=host)
+                RETRY_SLEEP.inc(delay, host=host)
+                log.info(f"Retrying {stage} on {host} in {delay:.1f}s (attempt {attempt + 1}/{attempts}): {e}")
+                await asyncio.sleep(delay)
+                continue
+            breaker.success()
+            return result
+
+
+# Process-wide engine: breakers are shared by every batch and user.
+ENGINE = RetryEngine()
+
+metrics.gauge("leech_breaker_open", "Hosts whose circuit breaker is open.", ("host",),
+              fn=lambda: {(host,): 1 for host in ENGINE.open_hosts()})
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           JOB SCHEDULER
+===========================================================================
+Description        : Shares the bot between users. Every batch is a job with
+                     its own scratch directory; jobs, downloads and uploads
+                     go through global limits that hand out slots round-robin
+                     across users, so one huge batch can't starve the rest.
+                     ffmpeg/ffprobe are capped globally by core.execute.
+===========================================================================
+"""
+
+import os
+import shutil
+import asyncio
+import logging
+import contextlib
+from collections import OrderedDict, deque
+
+from vars import MAX_ACTIVE_JOBS, GLOBAL_DOWNLOADS, GLOBAL_UPLOADS, WORK_DIR
+
+log = logging.getLogger(__name__)
+
+
+class FairLimiter:
+    """
+    A semaphore that serves waiting owners round-robin.
+
+    Each owner (a user) has its own FIFO of waiters; whenever a slot frees
+    up it goes to the next owner in rotation rather than to whoever queued
+    first.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiters = OrderedDict()
+
+    async def acquire(self, owner):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(owner, deque()).append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            else:
+                queue = self._waiters.get(owner)
+                if queue and fut in queue:
+                    queue.remove(fut)
+                    if not queue:
+                        del self._waiters[owner]
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        while self.active < self.limit and self._waiters:
+            owner, queue = next(iter(self._waiters.items()))
+            fut = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(owner)
+            else:
+                del self._waiters[owner]
+            if fut.cancelled():
+                continue
+            self.active += 1
+            fut.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, owner):
+        await self.acquire(owner)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def position(self, owner):
+        """1-based place of `owner`'s first waiter in the grant order, or 0."""
+        queues = [(o, len(q)) for o, q in self._waiters.items()]
+        place = 0
+        for rnd in range(max((n for _, n in queues), default=0)):
+            for o, n in queues:
+                if rnd < n:
+                    place += 1
+                    if o == owner:
+                        return place
+        return 0
+
+    def waiting(self):
+        return sum(len(q) for q in self._waiters.values())
+
+
+class Scheduler:
+    """Global limits and scratch space shared by every job in the process."""
+
+    def __init__(self, jobs=MAX_ACTIVE_JOBS, downloads=GLOBAL_DOWNLOADS, uploads=GLOBAL_UPLOADS,
+                 work_dir=WORK_DIR):
+        self.jobs = FairLimiter(jobs)
+        self.downloads = FairLimiter(downloads)
+        self.uploads = FairLimiter(uploads)
+        self.work_dir = work_dir
+
+    def scratch(self, job_id):
+        """Per-job working directory, so file names never collide across users."""
+        path = os.path.join(self.work_dir, f"job-{job_id}")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def cleanup(self, job_id):
+        shutil.rmtree(os.path.join(self.work_dir, f"job-{job_id}"), ignore_errors=True)
+
+    @contextlib.asynccontextmanager
+    async def admit(self, owner, on_wait=None, interval=15):
+        """
+        Wait for a job slot for `owner`.
+
+        While queued, `on_wait(position)` is awaited whenever the owner's
+        queue position changes (checked every `interval` seconds).
+        """
+        waiter = asyncio.ensure_future(self.jobs.acquire(owner))
+        last = None
+        try:
+            while True:
+                done, _ = await asyncio.wait({waiter}, timeout=0 if last is None else interval)
+                if done:
+                    waiter.result()
+                    break
+                position = self.jobs.position(owner)
+                if on_wait is not None and position != last:
+                    await on_wait(position)
+                last = position
+        except BaseException:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self.jobs.release()
+            waiter.cancel()
+            raise
+        try:
+            yield
+        finally:
+            self.jobs.release()
@@ -0,0 +1,12 @@
+import batch
+
+
+def test_url_cache_key_depends_on_resolution_for_videos_only():
+    video = {"url": "https://cdn.example/lecture/master.m3u8"}
+    doc = {"url": "https://cdn.example/notes.pdf"}
+    assert batch.url_cache_key({"res": "640x360"}, video) != batch.url_cache_key({"res": "1920x1080"}, video)
+    assert batch.url_cache_key({"res": "640x360"}, doc) == batch.url_cache_key({"res": "1920x1080"}, doc)
+
+
+def test_part_caption():
+    assert batch.part_caption("Lecture 1\nnotes", 2, 3) == "Lecture 1 · Part 2/3\nnotes"
@@ -0,0 +1,42 @@
+import core as helper
+
+
+def test_plan_split_small_file_is_one_part():
+    offsets = [(0.0, 0), (10.0, 100), (20.0, 200)]
+    assert helper.plan_split(offsets, 300, 1000, margin=0) == [(0.0, None)]
+
+
+def test_plan_split_cuts_at_last_fitting_keyframe():
+    offsets = [(0.0, 0), (10.0, 400), (20.0, 800), (30.0, 1200)]
+    parts = helper.plan_split(offsets, 1600, 1000, margin=0)
+    assert parts == [(0.0, 20.0), (20.0, None)]
+
+
+def test_plan_split_parts_stay_under_budget():
+    offsets = [(float(t), t * 100) for t in range(0, 100, 2)]
+    total = 100 * 100
+    parts = helper.plan_split(offsets, total, 2000, margin=0.1)
+    sizes = dict(offsets)
+    for start, end in parts:
+        end_bytes = total if end is None else sizes[end]
+        assert end_bytes - sizes[start] <= 1800
+    assert parts[-1][1] is None
+
+
+def test_plan_split_oversize_gop_becomes_its_own_part():
+    offsets = [(0.0, 0), (10.0, 5000), (20.0, 5100)]
+    parts = helper.plan_split(offsets, 5200, 1000, margin=0)
+    assert parts[0] == (0.0, 10.0)
+    assert parts[-1][1] is None
+
+
+def test_content_hash_covers_the_whole_file(tmp_path):
+    a = tmp_path / "a"
+    b = tmp_path / "b"
+    data = bytearray(8 * 1024 * 1024)
+    a.write_bytes(data)
+    # Differs only between the old head/middle/tail samples.
+    data[2 * 1024 * 1024] = 1
+    b.write_bytes(data)
+    assert helper.content_hash(str(a)) != helper.content_hash(str(b))
+    assert helper.content_hash(str(a)) == helper.content_hash(str(a))
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+import journal
+
+
+def make_items(n):
+    return [{"index": i, "name": f"n{i}", "url": f"https://cdn.example/{i}.pdf", "file_name": f"{i:03d}"}
+            for i in range(1, n + 1)]
+
+
+@pytest.fixture
+def db(tmp_path):
+    return journal.Journal(str(tmp_path / "journal.db"))
+
+
+def running_job(db, n):
+    return db.create_job(1, {}, make_items(n))
+
+
+def test_create_job_is_all_or_nothing(db):
+    items = make_items(3) + [make_items(1)[0]]
+    with pytest.raises(Exception):
+        db.create_job(1, {}, items)
+    assert db.db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+    assert db.db.execute("SELECT COUNT(*) FROM links").fetchone()[0] == 0
+
+
+def test_lease_stays_within_window(db):
+    job_id = running_job(db, 5)
+    queue = journal.TaskQueue(db, "w1", ttl=60, window=2)
+    assert queue.lease() == (job_id, 1)
+    assert queue.lease() == (job_id, 2)
+    assert queue.lease() is None
+
+    db.mark(job_id, 1, journal.UPLOADED)
+    assert queue.lease() == (job_id, 3)
+
+
+def test_lease_skips_held_links_until_they_expire(db):
+    job_id = running_job(db, 2)
+    first = journal.TaskQueue(db, "w1", ttl=60, window=1)
+    second = journal.TaskQueue(db, "w2", ttl=60, window=1)
+    assert first.lease() == (job_id, 1)
+    assert second.lease() is None
+
+    first.release(job_id, 1)
+    assert second.lease() == (job_id, 1)
+
+
+def test_lease_ignores_jobs_that_are_not_running(db):
+    job_id = db.create_job(1, {}, make_items(1))
+    db.pause_chat(1)
+    queue = journal.TaskQueue(db, "w1")
+    assert queue.lease() is None
+    db.set_job_state(job_id, "running")
+    assert queue.lease() == (job_id, 1)
+
+
+def test_turn_waits_for_every_earlier_link(db):
+    job_id = running_job(db, 3)
+    queue = journal.TaskQueue(db, "w1")
+    assert queue.turn(job_id, 1)
+    assert not queue.turn(job_id, 3)
+    db.mark(job_id, 1, journal.UPLOADED)
+    db.mark(job_id, 2, journal.FAILED, error="gone")
+    assert queue.turn(job_id, 3)
+    assert queue.remaining(job_id) == 1
+
+
+def test_heartbeat_drops_leases_of_paused_jobs(db):
+    job_id = running_job(db, 2)
+    queue = journal.TaskQueue(db, "w1", window=2)
+    queue.lease()
+    assert queue.heartbeat() == {(job_id, 1)}
+    db.set_job_state(job_id, "paused")
+    assert queue.heartbeat() == set()
+
+
+def test_reusable(tmp_path):
+    path = tmp_path / "a.mp4"
+    path.write_bytes(b"x" * 10)
+    part = tmp_path / "a.part1.mp4"
+    part.write_bytes(b"y" * 4)
+    assert journal.reusable({"path": str(path), "size": 10})
+    assert not journal.reusable({"path": str(path), "size": 11})
+    os.remove(path)
+    assert journal.reusable({"path": str(path), "size": 10, "parts": [{"path": str(part), "size": 4}]})
+    assert not journal.reusable({"path": str(path), "size": 10, "parts": [{"path": str(part)}]})
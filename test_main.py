@@ -0,0 +1,28 @@
+import os
+import sys
+import json
+import subprocess
+
+from bench import COLD_START_BANNED
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_in(tmp_path, module):
+    """Import `module` in a fresh interpreter run from `tmp_path`; return sys.modules."""
+    code = f"import sys, json; import {module}; print(json.dumps(sorted(sys.modules)))"
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, check=True, timeout=60)
+    return set(json.loads(out.stdout))
+
+
+def test_importing_main_has_no_side_effects(tmp_path):
+    modules = import_in(tmp_path, "main")
+    assert sorted(os.listdir(tmp_path)) == []
+    assert not {m.split(".")[0] for m in modules} & set(COLD_START_BANNED)
+
+
+def test_worker_startup_skips_dead_dependencies(tmp_path):
+    modules = import_in(tmp_path, "worker")
+    assert not {m.split(".")[0] for m in modules} & set(COLD_START_BANNED)
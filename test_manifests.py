@@ -0,0 +1,89 @@
+import manifests
+
+MASTER = """#EXTM3U
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",LANGUAGE="en",NAME="English",DEFAULT=YES,URI="audio/en.m3u8"
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",LANGUAGE="hi",NAME="Hindi",URI="audio/hi.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2",AUDIO="aud"
+360/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2800000,RESOLUTION=1280x720,AUDIO="aud"
+720/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2500000,AVERAGE-BANDWIDTH=2000000,RESOLUTION=1280x720,AUDIO="aud"
+720b/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080,AUDIO="aud"
+1080/index.m3u8
+"""
+
+MPD = """<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011">
+  <Period>
+    <AdaptationSet mimeType="video/mp4">
+      <Representation id="v360" bandwidth="700000" width="640" height="360"/>
+      <Representation id="v720" bandwidth="2500000" width="1280" height="720"/>
+    </AdaptationSet>
+    <AdaptationSet mimeType="audio/mp4" lang="en">
+      <Role schemeIdUri="urn:mpeg:dash:role:2011" value="main"/>
+      <Representation id="a64" bandwidth="64000"/>
+      <Representation id="a128" bandwidth="128000"/>
+    </AdaptationSet>
+    <AdaptationSet mimeType="audio/mp4" lang="hi">
+      <Representation id="h256" bandwidth="256000"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+def test_parse_hls_master():
+    manifest = manifests.parse_hls(MASTER, "https://cdn.example/course/master.m3u8")
+    assert [v["height"] for v in manifest["video"]] == [360, 720, 720, 1080]
+    assert manifest["video"][0]["url"] == "https://cdn.example/course/360/index.m3u8"
+    assert manifest["video"][2]["bandwidth"] == 2000000
+    assert [a["lang"] for a in manifest["audio"]] == ["en", "hi"]
+    assert manifest["audio"][0]["url"] == "https://cdn.example/course/audio/en.m3u8"
+
+
+def test_parse_hls_media_playlist_has_nothing_to_choose():
+    assert manifests.parse_hls("#EXTM3U\n#EXTINF:4,\nseg0.ts\n", "https://x/a.m3u8") is None
+
+
+def test_parse_dash():
+    manifest = manifests.parse_dash(MPD, "https://x/a.mpd")
+    assert [v["id"] for v in manifest["video"]] == ["v360", "v720"]
+    assert [a["id"] for a in manifest["audio"]] == ["a64", "a128", "h256"]
+    assert manifest["audio"][0]["default"] is True
+
+
+def test_choose_closest_height_then_best_bitrate():
+    manifest = manifests.parse_hls(MASTER, "https://x/master.m3u8")
+    selection = manifests.choose(manifest, "1280x720")
+    assert selection["video"]["url"].endswith("/720/index.m3u8")
+    assert selection["audio"]["lang"] == "en"
+    # 480 is 120 away from 360 and 240 from 720.
+    assert manifests.choose(manifest, "854x480")["video"]["height"] == 360
+
+
+def test_choose_tie_prefers_smaller():
+    manifest = {"kind": "hls", "audio": [], "video": [
+        {"id": "0", "height": 360, "width": 640, "bandwidth": 1, "audio": None},
+        {"id": "1", "height": 720, "width": 1280, "bandwidth": 1, "audio": None},
+    ]}
+    assert manifests.choose(manifest, "960x540")["video"]["height"] == 360
+
+
+def test_choose_without_preference():
+    manifest = manifests.parse_hls(MASTER, "https://x/master.m3u8")
+    assert manifests.choose(manifest, "UN") is None
+
+
+def test_choose_dash_audio_is_best_of_main_language():
+    manifest = manifests.parse_dash(MPD, "https://x/a.mpd")
+    selection = manifests.choose(manifest, "640x360")
+    assert selection["video"]["id"] == "v360"
+    assert selection["audio"]["id"] == "a128"
+
+
+def test_n_m3u8dl_args():
+    dash = manifests.choose(manifests.parse_dash(MPD, "https://x/a.mpd"), "1280x720")
+    assert manifests.n_m3u8dl_args(dash) == "--select-video id=v720:for=best --select-audio id=a128:for=best"
+    hls = manifests.choose(manifests.parse_hls(MASTER, "https://x/m.m3u8"), "1920x1080")
+    assert manifests.n_m3u8dl_args(hls) == "--select-video res=1920x1080:for=best --select-audio lang=en:for=best"
@@ -0,0 +1,46 @@
+import metrics
+
+LINKS = metrics.counter("test_links_total", "Links.", ("result",))
+SECONDS = metrics.histogram("test_seconds", "Seconds.", buckets=(1, 5))
+
+
+def test_render_adds_const_labels():
+    LINKS.inc(result="ok")
+    text = metrics.render((("worker", "w1"),))
+    assert 'test_links_total{result="ok",worker="w1"} 1' in text
+    assert "# TYPE test_links_total counter" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    SECONDS.observe(0.5)
+    SECONDS.observe(3)
+    SECONDS.observe(60)
+    lines = SECONDS.render().splitlines()
+    assert 'test_seconds_bucket{le="1"} 1' in lines
+    assert 'test_seconds_bucket{le="5"} 2' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 3' in lines
+    assert "test_seconds_count 3" in lines
+
+
+def test_merge_keeps_families_together():
+    a = ("# HELP x_total X.\n# TYPE x_total counter\nx_total{worker=\"a\"} 1\n"
+         "# HELP y Y.\n# TYPE y gauge\ny{worker=\"a\"} 2\n")
+    b = ("# HELP x_total X.\n# TYPE x_total counter\nx_total{worker=\"b\"} 3\n"
+         "# HELP z Z.\n# TYPE z gauge\nz{worker=\"b\"} 4\n")
+    assert metrics.merge([a, b]).splitlines() == [
+        "# HELP x_total X.",
+        "# TYPE x_total counter",
+        'x_total{worker="a"} 1',
+        'x_total{worker="b"} 3',
+        "# HELP y Y.",
+        "# TYPE y gauge",
+        'y{worker="a"} 2',
+        "# HELP z Z.",
+        "# TYPE z gauge",
+        'z{worker="b"} 4',
+    ]
+
+
+def test_snapshot_path():
+    assert metrics.snapshot_path("metrics.prom", "w1") == "metrics.w1.prom"
+    assert metrics.snapshot_path("/data/metrics.prom", "*") == "/data/metrics.*.prom"
@@ -0,0 +1,67 @@
+import asyncio
+import random
+
+from pipeline import DiskBudget, HostLimiter, host_key, parse_host_limits, run_pipeline
+
+
+def test_host_key():
+    assert host_key("https://x.example/abc/master.mpd") == "pw"
+    assert host_key("https://videos.classplusapp.com/a.m3u8") == "classplus"
+    assert host_key("https://drive.google.com/uc?id=1") == "drive"
+    assert host_key("https://cdn.example/a.pdf") == "cdn.example"
+
+
+def test_parse_host_limits():
+    assert parse_host_limits("classplus=2, pw=3,bad,drive=x") == {"classplus": 2, "pw": 3}
+
+
+def test_pipeline_posts_in_order():
+    async def main():
+        posted = []
+
+        async def fetch(i):
+            await asyncio.sleep(random.random() / 100)
+            return {"i": i}
+
+        async def post(i, result):
+            posted.append((i, result["i"]))
+
+        await run_pipeline(list(range(20)), fetch, post, workers=4, prefetch=3,
+                           host_of=lambda i: "h", hosts=HostLimiter({"h": 2}))
+        return posted
+
+    assert asyncio.run(main()) == [(i, i) for i in range(20)]
+
+
+def test_pipeline_hands_fetch_errors_to_post():
+    async def main():
+        seen = []
+
+        async def fetch(i):
+            if i == 1:
+                raise ValueError("bad link")
+            return {}
+
+        async def post(i, result):
+            seen.append(type(result).__name__)
+
+        await run_pipeline([0, 1, 2], fetch, post, workers=2)
+        return seen
+
+    assert asyncio.run(main()) == ["dict", "ValueError", "dict"]
+
+
+def test_disk_budget_always_admits_the_next_to_post(tmp_path):
+    async def main():
+        # A reserve that is never met: only the head of line may start.
+        budget = DiskBudget(0, reserve=1 << 60, path=str(tmp_path), poll=0.05)
+        await budget.add(100)
+        await asyncio.wait_for(budget.wait(0), 1)
+        blocked = asyncio.ensure_future(budget.wait(1))
+        await asyncio.sleep(0.1)
+        assert not blocked.done()
+        await budget.release(100)
+        await asyncio.wait_for(blocked, 1)
+
+    asyncio.run(main())
+
@@ -0,0 +1,58 @@
+import json
+import time
+import base64
+
+import resolvers
+
+
+def jwt(claims):
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+    return f"eyJhbGciOiJIUzI1NiJ9.{payload}.c2ln"
+
+
+def test_url_expiry_unsigned():
+    assert resolvers.url_expiry("https://cdn.example/a.m3u8?quality=720") is None
+
+
+def test_url_expiry_expires_param():
+    assert resolvers.url_expiry("https://cdn.example/a.m3u8?Expires=1767225600&Signature=x") == 1767225600
+
+
+def test_url_expiry_akamai_token():
+    url = "https://cdn.example/a.m3u8?hdnts=st=1767222000~exp=1767225600~acl=/*~hmac=ab"
+    assert resolvers.url_expiry(url) == 1767225600
+
+
+def test_url_expiry_jwt():
+    assert resolvers.url_expiry(f"https://cdn.example/a.mpd?token={jwt({'exp': 1767225600})}") == 1767225600
+
+
+def test_url_expiry_amz_is_utc_whatever_the_local_zone(monkeypatch):
+    monkeypatch.setenv("TZ", "Europe/London")
+    time.tzset()
+    try:
+        # 1 July: London is on BST (UTC+1).
+        url = "https://bucket.s3.amazonaws.com/a.pdf?X-Amz-Date=20260701T120000Z&X-Amz-Expires=3600"
+        assert resolvers.url_expiry(url) == 1782907200 + 3600
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_url_expiry_takes_the_earliest():
+    url = f"https://cdn.example/a.m3u8?Expires=1767225600&token={jwt({'exp': 1767220000})}"
+    assert resolvers.url_expiry(url) == 1767220000
+
+
+def test_ttl_cache_expires_and_evicts(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(resolvers.time, "time", lambda: now[0])
+    cache = resolvers.TTLCache(2)
+    cache.put("a", 1, 10)
+    cache.put("b", 2, 10)
+    cache.get("a")
+    cache.put("c", 3, 10)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    now[0] = 11
+    assert cache.get("a") is None
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+import core as helper
+import retry
+
+
+class StatusError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+@pytest.mark.parametrize("error, expected", [
+    (helper.ProcessError("yt-dlp", 1, stderr="ERROR: HTTP Error 503: Service Unavailable"), True),
+    (helper.ProcessError("yt-dlp", 1, stderr="ERROR: HTTP Error 404: Not Found"), False),
+    (helper.ProcessError("yt-dlp", 1, stderr="HTTP Error 403 after Connection reset"), False),
+    (helper.ProcessError("ffmpeg", 1, stderr="Invalid data found"), False),
+    (helper.ProcessError("ffmpeg", 127), False),
+    (helper.ProcessError("ffmpeg", -9), True),
+    (helper.ProcessError("N_m3u8DL-RE", None, timed_out=True), True),
+    (helper.DownloadError("short read", retryable=True), True),
+    (helper.DownloadError("HTTP 404", 404), False),
+    (StatusError(502), True),
+    (StatusError(429), True),
+    (StatusError(403), False),
+    (asyncio.TimeoutError(), True),
+    (ConnectionResetError(), True),
+    (ValueError("no signed URL"), False),
+    (retry.CircuitOpenError("cdn", 10), False),
+])
+def test_retryable(error, expected):
+    assert retry.retryable(error) is expected
+
+
+def test_breaker_opens_after_threshold_and_half_opens(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(retry.time, "monotonic", lambda: now[0])
+    breaker = retry.CircuitBreaker("cdn", threshold=2, cooldown=30)
+    breaker.admit()
+    breaker.failure()
+    breaker.admit()
+    breaker.failure()
+    assert breaker.is_open
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.admit()
+
+    now[0] += 31
+    breaker.admit()
+    # Only one trial call while half-open.
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.admit()
+    breaker.failure()
+    assert breaker.retry_in() == 30
+
+    now[0] += 31
+    breaker.admit()
+    breaker.success()
+    assert not breaker.is_open
+    breaker.admit()
+
+
+def test_budget_caps_retries():
+    budget = retry.Budget(ratio=0.5, floor=1)
+    budget.calls = 4
+    budget.retries = 2
+    assert budget.allow()
+    budget.retries = 3
+    assert not budget.allow()
+
+
+def test_engine_retries_then_succeeds():
+    engine = retry.RetryEngine(retry.RetryPolicy(attempts=3, base=0, cap=0), threshold=5)
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise StatusError(503)
+        return "ok"
+
+    budget = retry.Budget()
+    assert asyncio.run(engine.run(flaky, "cdn", budget)) == "ok"
+    assert budget.retries == 2
+    assert not engine.breaker("cdn").failures
+
+
+def test_engine_does_not_retry_fatal_errors():
+    engine = retry.RetryEngine(retry.RetryPolicy(attempts=3, base=0, cap=0))
+    calls = []
+
+    async def missing():
+        calls.append(1)
+        raise StatusError(404)
+
+    with pytest.raises(StatusError):
+        asyncio.run(engine.run(missing, "cdn"))
+    assert len(calls) == 1
+    assert engine.breaker("cdn").failures == 0
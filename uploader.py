@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           TELEGRAM UPLOADER
+===========================================================================
+Description        : Part uploads straight on top of Telethon's raw
+                     SaveFilePartRequest / SaveBigFilePartRequest.
+                     `upload_file` sends the parts of a finished file over
+                     several extra MTProto connections, reading ahead off
+                     the event loop and growing or shrinking the number of
+                     connections with the measured throughput.
+                     `upload_growing` feeds parts of a file that is still
+                     being written (a fragmented MP4 streamed out of
+                     ffmpeg), so upload and download of a single lecture
+                     overlap.
+===========================================================================
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import weakref
+
+from telethon import helpers
+from telethon.errors import FloodWaitError
+from telethon.network import MTProtoSender
+from telethon.tl.functions.upload import SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig
+
+import metrics
+from vars import UPLOAD_CONNECTIONS
+
+log = logging.getLogger(__name__)
+
+CONNECTIONS = metrics.gauge("leech_upload_connections", "Parallel upload connections in use.")
+
+# Telegram wants every part but the last to be exactly this size.
+PART_SIZE = 512 * 1024
+
+# Files below this size must use SaveFilePart, so they are re-uploaded
+# the normal way once the stream turns out to be small.
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+# Parts read per trip to the thread pool, and parts buffered per connection.
+READ_BATCH = 8
+READ_AHEAD = 2
+
+# Connection tuning: re-measured every TUNE_INTERVAL seconds; more
+# connections are kept only if they buy at least TUNE_GAIN more throughput.
+START_CONNECTIONS = 4
+TUNE_STEP = 2
+TUNE_INTERVAL = 1.0
+TUNE_GAIN = 0.1
+
+PART_RETRIES = 3
+
+# Connection count that worked best for each client's last upload.
+_tuned = weakref.WeakKeyDictionary()
+
+
+def _read(path, offset, size):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+async def upload_growing(client, path, writer, name=None, poll=0.5, progress_callback=None):
+    """
+    Upload `path` while `writer` (a task producing it) is still running.
+
+    Parts are sent as soon as a full PART_SIZE block is on disk and at least
+    one more byte follows it; until the writer finishes the total part count
+    is unknown and sent as -1. The writer must only ever append to the file
+    (ffmpeg writing to `pipe:1` redirected into it guarantees that).
+
+    `progress_callback(current, total)` gets total=None while the final size
+    is still unknown.
+
+    Returns:
+        InputFile or InputFileBig ready for `client.send_file`.
+
+    Raises:
+        Whatever `writer` raised; the parts sent so far are abandoned.
+    """
+    file_id = helpers.generate_random_long()
+    name = name or os.path.basename(path)
+    part = 0
+    offset = 0
+
+    while True:
+        finished = writer.done()
+        if finished and writer.exception() is not None:
+            raise writer.exception()
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+
+        if finished:
+            if size < BIG_FILE_SIZE:
+                return await client.upload_file(path, file_name=name, progress_callback=progress_callback)
+            total = (size + PART_SIZE - 1) // PART_SIZE
+            while offset < size:
+                data = await asyncio.to_thread(_read, path, offset, PART_SIZE)
+                await client(SaveBigFilePartRequest(file_id, part, total, data))
+                offset += len(data)
+                part += 1
+                if progress_callback:
+                    progress_callback(offset, size)
+            return InputFileBig(file_id, total, name)
+
+        if size - offset > PART_SIZE:
+            data = await asyncio.to_thread(_read, path, offset, PART_SIZE)
+            await client(SaveBigFilePartRequest(file_id, part, -1, data))
+            offset += len(data)
+            part += 1
+            if progress_callback:
+                progress_callback(offset, None)
+            continue
+
+        await asyncio.wait({writer}, timeout=poll)
+
+
+# =============================================================================
+#                           PARALLEL UPLOADS
+# =============================================================================
+async def open_sender(client):
+    """
+    Open an extra connection to the client's home DC.
+
+    It reuses the client's auth key, so no new login or authorization
+    import is needed; requests go through `client._call(sender, request)`.
+    """
+    dc = await client._get_dc(client.session.dc_id)
+    sender = MTProtoSender(client.session.auth_key, loggers=client._log)
+    await sender.connect(client._connection(
+        dc.ip_address, dc.port, dc.id,
+        loggers=client._log, proxy=client._proxy, local_addr=client._local_addr,
+    ))
+    return sender
+
+
+class ConnectionTuner:
+    """
+    Hill-climbs the number of parallel connections on measured throughput.
+
+    Adds `step` connections while each step raises the rate by more than
+    TUNE_GAIN and falls back to the best count as soon as one doesn't.
+    A later drop to half the best rate (the network changed) starts the
+    climb again.
+    """
+
+    def __init__(self, start, high, step=TUNE_STEP):
+        self.n = max(1, min(start, high))
+        self.high = high
+        self.step = step
+        self.best_n = self.n
+        self.best_rate = 0.0
+        self.climbing = True
+
+    def sample(self, rate):
+        """Feed the bytes/s of the last interval; returns the new count."""
+        if rate > self.best_rate * (1 + TUNE_GAIN):
+            self.best_rate, self.best_n = rate, self.n
+            if self.climbing and self.n < self.high:
+                self.n = min(self.high, self.n + self.step)
+        elif self.n != self.best_n:
+            self.n = self.best_n
+            self.climbing = False
+        elif rate < self.best_rate / 2:
+            self.best_rate = rate
+            self.climbing = True
+        return self.n
+
+
+class ParallelUpload:
+    """
+    One file, uploaded part by part over `tuner.n` connections.
+
+    A reader task pulls READ_BATCH parts at a time in a worker thread into
+    a bounded queue; each connection has its own task taking parts off it,
+    so memory stays at about (connections * READ_AHEAD + READ_BATCH) parts.
+    """
+
+    def __init__(self, client, path, name, connect, tuner, progress_callback=None):
+        self.client = client
+        self.path = path
+        self.name = name
+        self.connect = connect
+        self.tuner = tuner
+        self.progress_callback = progress_callback
+        self.size = os.path.getsize(path)
+        self.big = self.size > BIG_FILE_SIZE
+        self.total = max(1, (self.size + PART_SIZE - 1) // PART_SIZE)
+        self.file_id = helpers.generate_random_long()
+        self.md5 = None if self.big else hashlib.md5()
+        self.queue = asyncio.Queue(tuner.high * READ_AHEAD)
+        self.sent = 0
+        self.parts_sent = 0
+        self.drained = False
+        self.workers = {}
+
+    async def _read(self):
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            part = 0
+            for offset in range(0, self.size, PART_SIZE * READ_BATCH):
+                chunk = await asyncio.to_thread(os.pread, fd, PART_SIZE * READ_BATCH, offset)
+                if self.md5 is not None:
+                    self.md5.update(chunk)
+                for start in range(0, len(chunk), PART_SIZE):
+                    await self.queue.put((part, chunk[start:start + PART_SIZE]))
+                    part += 1
+            if part == 0:
+                await self.queue.put((0, b""))
+            await self.queue.put(None)
+        finally:
+            os.close(fd)
+
+    def _request(self, part, data):
+        if self.big:
+            return SaveBigFilePartRequest(self.file_id, part, self.total, data)
+        return SaveFilePartRequest(self.file_id, part, data)
+
+    async def _send(self, sender, part, data):
+        for attempt in range(1, PART_RETRIES + 1):
+            try:
+                await self.client._call(sender, self._request(part, data))
+                return
+            except FloodWaitError as e:
+                log.warning(f"Upload part {part} hit a flood wait of {e.seconds}s")
+                await asyncio.sleep(e.seconds)
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                if attempt == PART_RETRIES:
+                    raise
+                log.warning(f"Upload part {part} failed ({e}), retrying")
+                await asyncio.sleep(attempt)
+        raise RuntimeError(f"Upload part {part} kept hitting flood waits")
+
+    async def _work(self, slot):
+        sender = await self.connect()
+        try:
+            # Connections above the tuned count finish their part and leave.
+            while slot < self.tuner.n:
+                item = await self.queue.get()
+                if item is None:
+                    self.drained = True
+                    self.queue.put_nowait(None)
+                    return
+                part, data = item
+                await self._send(sender, part, data)
+                self.sent += len(data)
+                self.parts_sent += 1
+                if self.progress_callback:
+                    self.progress_callback(self.sent, self.size)
+        finally:
+            await sender.disconnect()
+
+    def _scale(self):
+        for slot, task in list(self.workers.items()):
+            if task.done():
+                del self.workers[slot]
+        if self.drained:
+            return
+        for slot in range(min(self.tuner.n, self.total)):
+            if slot not in self.workers:
+                self.workers[slot] = asyncio.ensure_future(self._work(slot))
+        CONNECTIONS.set(len(self.workers))
+
+    async def run(self):
+        """
+        Returns:
+            InputFile or InputFileBig ready for `client.send_file`.
+        """
+        reader = asyncio.ensure_future(self._read())
+        last_sent, last_time = 0, time.monotonic()
+        try:
+            while True:
+                self._scale()
+                tasks = [reader, *self.workers.values()]
+                done, _ = await asyncio.wait(tasks, timeout=TUNE_INTERVAL,
+                                             return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    if task.exception() is not None:
+                        raise task.exception()
+                if reader.done() and all(task.done() for task in self.workers.values()):
+                    break
+                now = time.monotonic()
+                if now - last_time >= TUNE_INTERVAL and not self.drained:
+                    self.tuner.sample((self.sent - last_sent) / (now - last_time))
+                    last_sent, last_time = self.sent, now
+        finally:
+            for task in [reader, *self.workers.values()]:
+                task.cancel()
+            await asyncio.gather(reader, *self.workers.values(), return_exceptions=True)
+            CONNECTIONS.set(0)
+
+        if self.parts_sent != self.total:
+            raise RuntimeError(f"Uploaded {self.parts_sent} of {self.total} parts of {self.name}")
+        if self.big:
+            return InputFileBig(self.file_id, self.total, self.name)
+        return InputFile(self.file_id, self.total, self.name, self.md5.hexdigest())
+
+
+async def upload_file(client, file, name=None, progress_callback=None, connect=None,
+                      connections=UPLOAD_CONNECTIONS):
+    """
+    Upload a finished file over parallel connections.
+
+    Drop-in for devgagantools' `upload_file`. The connection count starts
+    where the client's previous upload settled and is re-tuned as it goes.
+
+    Args:
+        client: The Telethon client.
+        file: Path or open file object (only its `.name` is used).
+        name (str): File name shown in Telegram; defaults to the base name.
+        progress_callback: `progress_callback(current, total)`.
+        connect (coroutine function): Opens one connection; defaults to
+            `open_sender(client)`. The result needs `disconnect()` and is
+            passed to `client._call`.
+        connections (int): Most connections to open.
+
+    Returns:
+        InputFile or InputFileBig ready for `client.send_file`.
+    """
+    path = file if isinstance(file, str) else file.name
+    connect = connect or (lambda: open_sender(client))
+    tuner = ConnectionTuner(_tuned.get(client, START_CONNECTIONS), connections)
+    upload = ParallelUpload(client, path, name or os.path.basename(path), connect, tuner,
+                            progress_callback)
+    result = await upload.run()
+    _tuned[client] = tuner.best_n
+    log.debug(f"Uploaded {upload.name} over {tuner.best_n} connections")
+    return result
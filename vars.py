@@ -1,5 +1,123 @@
-from os import environ
+from os import environ, cpu_count
 
 API_ID = int(environ.get("API_ID", "22182189"))
 API_HASH = environ.get("API_HASH", "5e7c4088f8e23d0ab61e29ae11960bf5")
 BOT_TOKEN = environ.get("BOT_TOKEN", "")
+
+# Batch pipeline: how many links may be downloaded ahead of the uploader and
+# how many buffered bytes (and free-space reserve) the prefetch may use.
+PREFETCH = int(environ.get("PREFETCH", "2"))
+DISK_BUDGET_MB = int(environ.get("DISK_BUDGET_MB", "4096"))
+DISK_RESERVE_MB = int(environ.get("DISK_RESERVE_MB", "1024"))
+
+# Download worker pool: links fetched at once per batch, and per-CDN caps
+# ("classplus=2,visionias=2,pw=2"); hosts not listed use DEFAULT_HOST_LIMIT.
+DOWNLOAD_WORKERS = int(environ.get("DOWNLOAD_WORKERS", "3"))
+HOST_LIMITS = environ.get("HOST_LIMITS", "classplus=2,visionias=2,pw=2")
+DEFAULT_HOST_LIMIT = int(environ.get("DEFAULT_HOST_LIMIT", "0"))
+
+# Shared subprocess executor: concurrent ffmpeg/ffprobe ("cpu") and
+# downloader ("io") processes, and their timeouts in seconds.
+CPU_PROCS = int(environ.get("CPU_PROCS", str(cpu_count() or 2)))
+IO_PROCS = int(environ.get("IO_PROCS", "8"))
+DOWNLOAD_TIMEOUT = int(environ.get("DOWNLOAD_TIMEOUT", "10800"))
+FFMPEG_TIMEOUT = int(environ.get("FFMPEG_TIMEOUT", "600"))
+
+# Shared HTTP client: total pooled connections and connections per host.
+HTTP_POOL_SIZE = int(environ.get("HTTP_POOL_SIZE", "100"))
+HTTP_PER_HOST = int(environ.get("HTTP_PER_HOST", "16"))
+
+# Link resolution: links resolved ahead of the downloaders, cached entries,
+# cache lifetime for unsigned URLs (seconds) and concurrent resolver calls.
+RESOLVE_AHEAD = int(environ.get("RESOLVE_AHEAD", "4"))
+RESOLVER_CACHE_SIZE = int(environ.get("RESOLVER_CACHE_SIZE", "1024"))
+RESOLVER_TTL = int(environ.get("RESOLVER_TTL", "1800"))
+RESOLVE_CONCURRENCY = int(environ.get("RESOLVE_CONCURRENCY", "4"))
+
+# Batch journal (SQLite). Keep it on a persistent volume so redeploys resume.
+JOURNAL_PATH = environ.get("JOURNAL_PATH", "journal.db")
+
+# Upload dedup cache: Telegram media references reused for repeat links.
+MEDIA_CACHE_MAX_ENTRIES = int(environ.get("MEDIA_CACHE_MAX_ENTRIES", "20000"))
+MEDIA_CACHE_MAX_AGE_DAYS = int(environ.get("MEDIA_CACHE_MAX_AGE_DAYS", "30"))
+
+# Multi-user scheduler: batches running at once, global download/upload
+# slots shared round-robin between users, and the per-job scratch root.
+MAX_ACTIVE_JOBS = int(environ.get("MAX_ACTIVE_JOBS", "3"))
+GLOBAL_DOWNLOADS = int(environ.get("GLOBAL_DOWNLOADS", "6"))
+GLOBAL_UPLOADS = int(environ.get("GLOBAL_UPLOADS", "3"))
+WORK_DIR = environ.get("WORK_DIR", "work")
+
+# Upload HLS lectures while ffmpeg is still downloading them (fragmented MP4).
+STREAM_UPLOAD = environ.get("STREAM_UPLOAD", "false").lower() in ("1", "true", "yes")
+
+# Upload progress: edits per minute allowed on each chat's status message.
+PROGRESS_EDITS_PER_MIN = int(environ.get("PROGRESS_EDITS_PER_MIN", "12"))
+
+# Generated thumbnails, cached by content hash (number of files kept).
+THUMB_DIR = environ.get("THUMB_DIR", "thumbs")
+THUMB_CACHE_SIZE = int(environ.get("THUMB_CACHE_SIZE", "2000"))
+
+# Prometheus metrics snapshot written by the bot and served by app.py at
+# /metrics, and how often it is rewritten (seconds).
+METRICS_FILE = environ.get("METRICS_FILE", "metrics.prom")
+METRICS_INTERVAL = int(environ.get("METRICS_INTERVAL", "15"))
+
+# Distributed mode: main.py only talks to users and queues batches in the
+# journal; worker.py processes on the same host (sharing the journal and
+# working directory; SQLite WAL does not work across hosts or on NFS)
+# download, upload and post them. WORKER_TASKS links are fetched/uploaded
+# at once per worker, leases expire after LEASE_TTL seconds without a
+# heartbeat, and workers stay within DISPATCH_WINDOW links of the posting.
+DISTRIBUTED = environ.get("DISTRIBUTED", "false").lower() in ("1", "true", "yes")
+WORKER_ID = environ.get("WORKER_ID", "")
+WORKER_TASKS = int(environ.get("WORKER_TASKS", "3"))
+LEASE_TTL = int(environ.get("LEASE_TTL", "60"))
+DISPATCH_WINDOW = int(environ.get("DISPATCH_WINDOW", "8"))
+
+# Retries: attempts per call, backoff base/cap in seconds (full jitter), and
+# retries allowed per batch as a share of its calls. A host is skipped for
+# BREAKER_COOLDOWN seconds after BREAKER_THRESHOLD failures in a row; its
+# links wait up to BREAKER_MAX_DEFER seconds for it before failing fast.
+RETRY_ATTEMPTS = int(environ.get("RETRY_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(environ.get("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(environ.get("RETRY_MAX_DELAY", "30"))
+RETRY_BUDGET_RATIO = float(environ.get("RETRY_BUDGET_RATIO", "0.2"))
+BREAKER_THRESHOLD = int(environ.get("BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = int(environ.get("BREAKER_COOLDOWN", "60"))
+BREAKER_MAX_DEFER = int(environ.get("BREAKER_MAX_DEFER", "300"))
+
+# Telegram uploads: "native" (uploader.py, parallel parts over extra
+# connections tuned on measured throughput) or "spylib" (devgagantools),
+# and the most parallel connections one upload may open.
+UPLOADER = environ.get("UPLOADER", "native").lower()
+UPLOAD_CONNECTIONS = int(environ.get("UPLOAD_CONNECTIONS", "16"))
+
+# Videos bigger than this (Telegram's limit for bots) are cut at keyframes
+# into parts that are uploaded together and posted as numbered posts.
+MAX_UPLOAD_MB = int(environ.get("MAX_UPLOAD_MB", "2000"))
+
+# Move the moov atom of downloaded MP4s to the front (in place) so Telegram
+# clients start playback without fetching the end of the file first.
+FASTSTART = environ.get("FASTSTART", "true").lower() in ("1", "true", "yes")
+
+# Direct downloads (PDFs, Drive files): files of at least SEGMENT_MIN_MB are
+# fetched as up to DOWNLOAD_SEGMENTS parallel Range requests; smaller ones
+# (or servers without Range support) with a single GET.
+DOWNLOAD_SEGMENTS = int(environ.get("DOWNLOAD_SEGMENTS", "8"))
+SEGMENT_MIN_MB = int(environ.get("SEGMENT_MIN_MB", "8"))
+
+# Posting: consecutive documents go out as albums of up to ALBUM_SIZE (1 turns
+# albums off, Telegram allows 10), and posts to one chat are spaced at least
+# SEND_INTERVAL seconds apart (more after a flood wait).
+ALBUM_SIZE = min(10, int(environ.get("ALBUM_SIZE", "10")))
+SEND_INTERVAL = float(environ.get("SEND_INTERVAL", "1"))
+
+# Logging: level, rotating text log, JSON-lines log of per-job/per-link events
+# ("" turns it off), records buffered for the writer thread before new ones
+# are dropped, and characters of tool output kept per log line.
+LOG_LEVEL = environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FILE = environ.get("LOG_FILE", "logs.txt")
+LOG_JSON_FILE = environ.get("LOG_JSON_FILE", "logs.jsonl")
+LOG_QUEUE_SIZE = int(environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_OUTPUT_CHARS = int(environ.get("LOG_OUTPUT_CHARS", "2000"))
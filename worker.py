@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+===========================================================================
+                           BATCH WORKER
+===========================================================================
+Description        : Distributed mode (DISTRIBUTED=true) worker. Leases links
+                     of running batches from the shared journal, downloads
+                     and uploads them with its own bot session, and posts
+                     each one only after every earlier link of the batch is
+                     posted, so chats still see links in order. Run as many
+                     as the box can take; a worker that dies simply stops
+                     renewing its leases. Workers must run on the same host
+                     and in the same working directory as main.py: the
+                     journal is SQLite in WAL mode (shared memory, so no
+                     other hosts and no NFS/CIFS), and batch thumbnails
+                     sent to /upload are files on the bot's local disk.
+
+Usage:
+    WORKER_ID=w1 python3 worker.py
+===========================================================================
+"""
+
+import os
+import time
+import socket
+import asyncio
+import logging
+import contextlib
+import concurrent.futures
+
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+
+from vars import (
+    API_ID, API_HASH, BOT_TOKEN, HOST_LIMITS, DEFAULT_HOST_LIMIT, WORKER_ID, WORKER_TASKS,
+    LEASE_TTL, DISPATCH_WINDOW, METRICS_FILE, METRICS_INTERVAL,
+)
+
+import core as helper
+import logs
+import retry
+import metrics
+import journal
+from batch import BatchRunner, log_done
+from scheduler import Scheduler
+from progress import ProgressHub
+from pipeline import HostLimiter, host_key, parse_host_limits
+
+log = logging.getLogger(__name__)
+
+# Links that may still be fetched or uploaded by a worker.
+OPEN_STATES = (journal.PENDING, journal.RESOLVED, journal.DOWNLOADED)
+
+
+class Worker:
+    """
+    Pulls leased links through fetch -> upload -> (in order) post.
+
+    At most `tasks` links are being fetched or uploaded at once. Links
+    that are uploaded and only waiting for their turn to be posted don't
+    count, so a dead worker's lease on an earlier link can always be
+    picked up by someone.
+    """
+
+    def __init__(self, runner, queue, tasks=WORKER_TASKS, poll=1):
+        self.runner = runner
+        self.queue = queue
+        self.tasks = tasks
+        self.poll = poll
+        self.active = 0
+        self._running = {}
+        self._budgets = {}
+        # The queue's sqlite calls block (up to the busy timeout), so they run
+        # one at a time on their own thread instead of on the event loop.
+        self._db = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="queue")
+
+    def _queue(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._db, func, *args)
+
+    async def run(self):
+        heartbeat = asyncio.ensure_future(self._heartbeat())
+        try:
+            while True:
+                lease = None
+                if self.active < self.tasks:
+                    try:
+                        lease = await self._queue(self.queue.lease)
+                    except Exception as e:
+                        log.error(f"Lease failed: {e}")
+                if lease is None:
+                    await asyncio.sleep(self.poll)
+                    continue
+                self.active += 1
+                self._running[lease] = asyncio.ensure_future(self.process(*lease))
+        finally:
+            heartbeat.cancel()
+            for task in self._running.values():
+                task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                held = await self._queue(self.queue.heartbeat)
+            except Exception as e:
+                log.error(f"Heartbeat failed: {e}")
+                held = None
+            if held is not None:
+                for key, task in list(self._running.items()):
+                    if key not in held:
+                        log.info(f"Lost the lease on job {key[0]} link {key[1]}, dropping it")
+                        task.cancel()
+            await asyncio.sleep(self.queue.ttl / 3)
+
+    async def process(self, job_id, idx):
+        runner = self.runner
+        scheduler = runner.scheduler
+        preparing = True
+        try:
+            with logs.link(job_id, idx):
+                job = runner.journal.job(job_id)
+                chat_id = job["chat_id"]
+                batch = dict(job["settings"], chat_id=chat_id, job_id=job_id)
+                batch["items"] = runner.journal.items(job_id, states=OPEN_STATES)
+                batch["scratch"] = scheduler.scratch(job_id)
+                batch["retries"] = self._budgets.setdefault(job_id, retry.Budget())
+                item = next((x for x in batch["items"] if x["index"] == idx), None)
+                if item is None:
+                    return
+
+                error = None
+                await retry.ENGINE.wait(host_key(item["url"]), batch["retries"])
+                async with scheduler.downloads.slot(chat_id):
+                    start = time.perf_counter()
+                    try:
+                        result = await runner.fetch_link(batch, item)
+                        log_done("fetched", "fetch", result, start)
+                    except Exception as e:
+                        result = e
+                start = time.perf_counter()
+                async with scheduler.uploads.slot(chat_id):
+                    try:
+                        result = await runner.prepare_link(batch, item, result)
+                    except Exception as e:
+                        error = e
+                self.active -= 1
+                preparing = False
+
+                while not await self._turn(job_id, idx):
+                    await asyncio.sleep(self.poll)
+                if error is None:
+                    try:
+                        await runner.send_link(batch, item, result)
+                        log_done("posted", "post", result, start)
+                    except Exception as e:
+                        error = e
+                if error is not None:
+                    await runner.report_failure(batch, item, result, error)
+        except Exception as e:
+            log.exception(f"Job {job_id} link {idx} crashed: {e}")
+        finally:
+            if preparing:
+                self.active -= 1
+            self._running.pop((job_id, idx), None)
+            try:
+                await self._queue(self.queue.release, job_id, idx)
+            except Exception as e:
+                # The lease expires on its own after the TTL.
+                log.error(f"Releasing job {job_id} link {idx} failed: {e}")
+
+    async def _turn(self, job_id, idx):
+        try:
+            return await self._queue(self.queue.turn, job_id, idx)
+        except Exception as e:
+            log.warning(f"Checking the turn of job {job_id} link {idx} failed: {e}")
+            return False
+
+
+async def main():
+    worker_id = WORKER_ID or f"{socket.gethostname()}-{os.getpid()}"
+    # In-memory session: every worker is its own login, no session file clashes.
+    client = TelegramClient(StringSession(), API_ID, API_HASH, receive_updates=False)
+    await client.start(bot_token=BOT_TOKEN)
+    db = journal.Journal()
+    runner = BatchRunner(
+        client, db, journal.MediaCache(db), ProgressHub(client), Scheduler(),
+        HostLimiter(parse_host_limits(HOST_LIMITS), DEFAULT_HOST_LIMIT),
+    )
+    queue = journal.TaskQueue(db, worker_id, ttl=LEASE_TTL, window=DISPATCH_WINDOW)
+    # One snapshot per worker; app.py merges them into /metrics.
+    snapshot = metrics.snapshot_path(METRICS_FILE, worker_id)
+    exporter = asyncio.ensure_future(metrics.export(snapshot, METRICS_INTERVAL, (("worker", worker_id),)))
+    print(f"Worker {worker_id} is running...")
+    try:
+        await Worker(runner, queue).run()
+    finally:
+        exporter.cancel()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(snapshot)
+        await helper.close_http_session()
+        await client.disconnect()
+
+
+if __name__ == '__main__':
+    logs.setup()
+    asyncio.run(main())